@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import csv
+import io
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from typing import IO, Optional
+
+from storage import OrderStore, STATUS_APPROVED, STATUS_REJECTED
+from telebirr import EAT
+
+ANALYTICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sales_daily (
+    day TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    service TEXT NOT NULL,
+    amount TEXT NOT NULL,
+    approved INTEGER NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0,
+    revenue INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, platform, service, amount)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS funnel_daily (
+    day TEXT NOT NULL,
+    step TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, step)
+) WITHOUT ROWID;
+
+-- Who got past each step today, one row per user and step, so going back and forth is
+-- not counted again. Older days are pruned, their counts live on in funnel_daily.
+CREATE TABLE IF NOT EXISTS funnel_users (
+    day TEXT NOT NULL,
+    step TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (day, step, user_id)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS funnel_users_count AFTER INSERT ON funnel_users BEGIN
+    INSERT INTO funnel_daily (day, step, count) VALUES (NEW.day, NEW.step, 1)
+    ON CONFLICT (day, step) DO UPDATE SET count = count + 1;
+END;
+"""
+
+# Conversation states in funnel order; a step is counted when a user gets past that state.
+FUNNEL_STEPS = ("START", "PLATFORM_MENU", "SERVICE_MENU", "PACKAGE_MENU", "AWAITING_INPUT", "CONFIRMATION",
+                "AWAITING_PROOF")
+CSV_COLUMNS = ("day", "platform", "service", "amount", "approved", "rejected", "revenue")
+
+
+def day_of(timestamp: float) -> str:
+    # Days follow local time, so "today" ends at midnight in Addis Ababa.
+    return datetime.fromtimestamp(timestamp, EAT).strftime("%Y-%m-%d")
+
+
+class Analytics:
+    """Sales and funnel rollups, kept up to date as things happen rather than computed
+    from the orders table.
+
+    Every decision adds to one sales_daily row (day x platform x service x package) with
+    an UPSERT. A funnel step is an INSERT OR IGNORE into today's funnel_users, and only a
+    new row bumps funnel_daily (by trigger), so repeats by the same user are not counted.
+    Reports only read the rollup rows of the days asked for, not the orders.
+    """
+
+    def __init__(self, store: OrderStore):
+        self.store = store
+        store.add_schema(ANALYTICS_SCHEMA)
+
+    async def backfill(self) -> None:
+        """Build sales_daily from the orders table the first time the rollups are used."""
+        if await self.store.fetchone("SELECT 1 FROM sales_daily LIMIT 1"):
+            return
+        # Checked again inside the write, in case another shard worker got there first.
+        await self.store.write(
+            "INSERT INTO sales_daily (day, platform, service, amount, approved, rejected, revenue)"
+            " SELECT date(updated_at, 'unixepoch', '+3 hours'), platform, service, amount,"
+            " SUM(status = ?), SUM(status = ?), SUM(CASE WHEN status = ? THEN COALESCE(price, 0) ELSE 0 END)"
+            " FROM orders WHERE status IN (?, ?) AND NOT EXISTS (SELECT 1 FROM sales_daily)"
+            " GROUP BY 1, 2, 3, 4",
+            (STATUS_APPROVED, STATUS_REJECTED, STATUS_APPROVED, STATUS_APPROVED, STATUS_REJECTED),
+        )
+
+    # --- Recording ---
+    def record_decision(self, order, status: str) -> None:
+        approved = status == STATUS_APPROVED
+        self.store.write_nowait(
+            "INSERT INTO sales_daily (day, platform, service, amount, approved, rejected, revenue)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (day, platform, service, amount) DO UPDATE SET"
+            " approved = approved + excluded.approved, rejected = rejected + excluded.rejected,"
+            " revenue = revenue + excluded.revenue",
+            (day_of(time.time()), order["platform"], order["service"], order["amount"], int(approved),
+             int(not approved), (order["price"] or 0) if approved else 0),
+        )
+
+    def step(self, user_id: int, state: str) -> None:
+        self.store.write_nowait("INSERT OR IGNORE INTO funnel_users (day, step, user_id) VALUES (?, ?, ?)",
+                                (day_of(time.time()), state, user_id))
+
+    def prune(self) -> None:
+        self.store.write_nowait("DELETE FROM funnel_users WHERE day < ?", (day_of(time.time()),))
+
+    async def watch(self, interval: float) -> None:
+        while True:
+            self.prune()
+            await asyncio.sleep(interval)
+
+    # --- Reports ---
+    async def summary(self, since: str) -> dict:
+        """Totals from day ``since`` (YYYY-MM-DD) on: by platform, top packages and the funnel."""
+        packages = await self.store.fetchall(
+            "SELECT platform, service, amount, SUM(approved) AS approved, SUM(rejected) AS rejected,"
+            " SUM(revenue) AS revenue FROM sales_daily WHERE day >= ? GROUP BY platform, service, amount"
+            " ORDER BY revenue DESC", (since,))
+        today = await self.store.fetchone("SELECT SUM(revenue) AS revenue FROM sales_daily WHERE day = ?",
+                                          (day_of(time.time()),))
+        funnel = await self.store.fetchall("SELECT step, SUM(count) AS n FROM funnel_daily WHERE day >= ? GROUP BY step",
+                                           (since,))
+        steps = Counter({row["step"]: row["n"] for row in funnel})
+
+        platforms: dict[str, dict] = {}
+        for row in packages:
+            totals = platforms.setdefault(row["platform"], Counter())
+            totals.update(approved=row["approved"], rejected=row["rejected"], revenue=row["revenue"])
+        return {
+            "approved": sum(row["approved"] for row in packages),
+            "rejected": sum(row["rejected"] for row in packages),
+            "revenue": sum(row["revenue"] for row in packages),
+            "revenue_today": (today["revenue"] if today else None) or 0,
+            "platforms": platforms,
+            "packages": packages,
+            "funnel": [(step, steps[step]) for step in FUNNEL_STEPS],
+        }
+
+    async def export_csv(self, since: str, chunk_size: int = 1000) -> IO[bytes]:
+        """sales_daily from ``since`` on as CSV, read a page at a time into a temporary file
+        rather than built in memory. The caller closes the file."""
+        out = tempfile.TemporaryFile()
+        text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+        writer = csv.writer(text)
+        writer.writerow(CSV_COLUMNS)
+        after: Optional[tuple] = (since, "", "", "")
+        while after:
+            rows = await self.store.fetchall(
+                f"SELECT {', '.join(CSV_COLUMNS)} FROM sales_daily WHERE (day, platform, service, amount) > (?, ?, ?, ?)"
+                " ORDER BY day, platform, service, amount LIMIT ?", after + (chunk_size,))
+            writer.writerows(tuple(row) for row in rows)
+            after = tuple(rows[-1])[:4] if len(rows) == chunk_size else None
+        text.detach()
+        out.seek(0)
+        return out
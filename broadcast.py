@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+from outbox import Outbox, PRIORITY_ADMIN, PRIORITY_BULK
+from storage import OrderStore
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL DEFAULT 0,
+    admin_chat_id INTEGER NOT NULL,
+    text TEXT,
+    from_chat_id INTEGER,
+    message_id INTEGER,
+    status TEXT NOT NULL,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    progress_message_id INTEGER,
+    started_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class Broadcaster:
+    """Sends one message to every known user.
+
+    Recipients are streamed from the users table a page at a time (keyset pagination on
+    user_id), so only one page of ids is held at a time. Each page is handed to the outbox
+    at bulk priority, which runs many sends concurrently within the global and per-chat
+    limits. With shard workers a broadcast runs on the worker that got /broadcast, at that
+    worker's share of the bot's global rate. The cursor is committed after every page, so
+    a broadcast interrupted by a crash resumes from its last completed page on the next
+    start.
+    """
+
+    def __init__(self, store: OrderStore, outbox: Outbox, page_size: int = 500, progress_interval: float = 10):
+        self.store = store
+        self.outbox = outbox
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self._tasks: dict[int, asyncio.Task] = {}
+        store.add_schema(BROADCAST_SCHEMA)
+        store.add_column("broadcasts", "shard", "INTEGER NOT NULL DEFAULT 0")
+
+    async def start(self, admin_chat_id: int, text: Optional[str] = None,
+                    from_chat_id: Optional[int] = None, message_id: Optional[int] = None) -> int:
+        """Start a broadcast of ``text``, or of a copy of an existing message."""
+        broadcast_id = self.store.ids.next()
+        now = time.time()
+        total = await self.store.count_users()
+        await self.store.write(
+            "INSERT INTO broadcasts (id, shard, admin_chat_id, text, from_chat_id, message_id, status, total,"
+            " started_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, 'running', ?, ?, ?)",
+            (broadcast_id, self.outbox.shard, admin_chat_id, text, from_chat_id, message_id, total, now, now),
+        )
+        self._spawn(broadcast_id)
+        return broadcast_id
+
+    async def resume_all(self) -> None:
+        rows = await self.store.fetchall("SELECT id FROM broadcasts WHERE status = 'running' AND shard = ?",
+                                         (self.outbox.shard,))
+        for row in rows:
+            logger.info("Resuming broadcast %s.", row["id"])
+            self._spawn(row["id"])
+
+    async def stop(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    def _spawn(self, broadcast_id: int) -> None:
+        task = asyncio.create_task(self._run(broadcast_id), name=f"broadcast_{broadcast_id}")
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    def _send(self, row, user_id: int) -> asyncio.Future:
+        if row["message_id"]:
+            return self.outbox.enqueue('copy_message', user_id, PRIORITY_BULK, persist=False,
+                                       from_chat_id=row["from_chat_id"], message_id=row["message_id"])
+        return self.outbox.enqueue('send_message', user_id, PRIORITY_BULK, persist=False, text=row["text"])
+
+    async def _run(self, broadcast_id: int) -> None:
+        row = await self.store.fetchone("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+        cursor, sent, failed, blocked = row["cursor"], row["sent"], row["failed"], row["blocked"]
+        progress_message_id = row["progress_message_id"]
+        started = time.monotonic()
+        done_at_start = sent + failed + blocked
+        reported_at = 0.0
+
+        while True:
+            user_ids = await self.store.users_page(cursor, self.page_size)
+            if not user_ids:
+                break
+            results = await asyncio.gather(*(self._send(row, user_id) for user_id in user_ids), return_exceptions=True)
+            for user_id, result in zip(user_ids, results):
+                if isinstance(result, Forbidden) or (isinstance(result, BadRequest) and "chat not found" in result.message.lower()):
+                    self.store.mark_blocked(user_id)
+                    blocked += 1
+                elif isinstance(result, Exception):
+                    failed += 1
+                else:
+                    sent += 1
+            cursor = user_ids[-1]
+            await self.store.write(
+                "UPDATE broadcasts SET cursor = ?, sent = ?, failed = ?, blocked = ?, updated_at = ? WHERE id = ?",
+                (cursor, sent, failed, blocked, time.time(), broadcast_id),
+            )
+
+            if time.monotonic() - reported_at >= self.progress_interval:
+                reported_at = time.monotonic()
+                done = sent + failed + blocked
+                rate = (done - done_at_start) / max(reported_at - started, 1e-6)
+                remaining = max(row["total"] - done, 0)
+                eta = remaining / rate if rate else 0
+                progress_message_id = await self._report(row, progress_message_id, sent, failed, blocked,
+                                                         f"⏳ {rate:.1f}/s, ETA {int(eta // 60)}m {int(eta % 60)}s")
+
+        await self.store.write("UPDATE broadcasts SET status = 'done', updated_at = ? WHERE id = ?", (time.time(), broadcast_id))
+        await self._report(row, progress_message_id, sent, failed, blocked, "✅ ተጠናቋል")
+
+    async def _report(self, row, progress_message_id: Optional[int], sent: int, failed: int, blocked: int,
+                      status: str) -> Optional[int]:
+        text = (f"📣 Broadcast {row['id']}\n\n"
+                f"Sent: {sent}/{row['total']}\n"
+                f"Failed: {failed} | Blocked (pruned): {blocked}\n"
+                f"{status}")
+        try:
+            if progress_message_id:
+                await self.outbox.enqueue('edit_message_text', row["admin_chat_id"], PRIORITY_ADMIN, persist=False,
+                                          message_id=progress_message_id, text=text)
+                return progress_message_id
+            message = await self.outbox.enqueue('send_message', row["admin_chat_id"], PRIORITY_ADMIN,
+                                                persist=False, text=text)
+        except TelegramError as exc:
+            logger.warning("Could not report broadcast progress: %s", exc)
+            return progress_message_id
+        self.store.write_nowait("UPDATE broadcasts SET progress_message_id = ? WHERE id = ?", (message.message_id, row["id"]))
+        return message.message_id
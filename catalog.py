@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+import os
+import zlib
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping, Optional, Union
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+CATALOG_PATH = os.environ.get("CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.json"))
+
+# --- Button Texts ---
+BACK_BUTTON = "◀️ ተመለስ"
+MAIN_EXIT_BUTTON = "🏠 ዋና መውጫ"
+_LAYOUT_BUTTONS = {"$back": BACK_BUTTON, "$exit": MAIN_EXIT_BUTTON}
+
+# --- Inline Menu Callback Data ---
+# Choices are "m:<catalog version>:<path>", with the path made of indices into the price
+# table: p<platform>, s<platform>.<service>, k<platform>.<service>.<package>. The version
+# makes buttons of a catalog that has since been reloaded resolve to nothing instead of
+# to whatever moved into their place. Back buttons name the menu they are on.
+MENU_PREFIX = "m"
+MENU_EXIT = "m:x"
+MENU_BACK_SERVICES = "m:b:s"
+MENU_BACK_PACKAGES = "m:b:k"
+MENU_BACK_PROMPT = "m:b:i"
+_INLINE_LAYOUT_BUTTONS = {"$back": (BACK_BUTTON, MENU_BACK_SERVICES), "$exit": (MAIN_EXIT_BUTTON, MENU_EXIT)}
+
+
+@dataclass(frozen=True)
+class Package:
+    platform: str
+    service: str
+    amount: str
+    price: int
+    button: str
+
+
+@dataclass(frozen=True)
+class Service:
+    platform: str
+    key: str
+    button: str
+    unit: str
+    prompt: str
+    example: str
+    input_prefixes: tuple
+    input_error: str
+    input_type: str
+    packages: Mapping[str, Package]
+    keyboard: ReplyKeyboardMarkup
+    # Service id on the supplier panel; orders of services without one are placed by hand.
+    panel_service: Optional[int] = None
+    inline_keyboard: Optional[InlineKeyboardMarkup] = None
+
+    def validate_input(self, user_input: str) -> Optional[str]:
+        """Return the error message for an invalid link/username, ``None`` if it is fine."""
+        if self.input_prefixes and not user_input.startswith(self.input_prefixes):
+            return self.input_error
+        return None
+
+
+@dataclass(frozen=True)
+class Platform:
+    key: str
+    button: str
+    title: str
+    services: Mapping[str, Service]
+    keyboard: Optional[ReplyKeyboardMarkup]
+    inline_keyboard: Optional[InlineKeyboardMarkup] = None
+
+
+@dataclass(frozen=True)
+class Catalog:
+    """Prices compiled into immutable keyboards and button-text lookup tables.
+
+    Handlers never build keyboards or parse button text: every reply keyboard is
+    prebuilt and every button a user can press maps straight to its entry.
+    """
+    platforms: Mapping[str, Platform]
+    platform_keyboard: ReplyKeyboardMarkup
+    platform_buttons: Mapping[str, Platform]
+    # (platform, lowercased button text) -> Service
+    service_buttons: Mapping[tuple, Service]
+    # (platform, service, button text) -> Package
+    package_buttons: Mapping[tuple, Package]
+    prompt_keyboard: ReplyKeyboardMarkup
+    mtime: float = 0.0
+    platform_inline_keyboard: Optional[InlineKeyboardMarkup] = None
+    prompt_inline_keyboard: Optional[InlineKeyboardMarkup] = None
+    # Inline menu callback path -> Platform, Service or Package
+    menu_entries: Mapping[str, Union[Platform, Service, Package]] = field(default_factory=dict)
+    version: str = ""
+    # Texts of the reply keyboard buttons and data of the inline menu buttons, which users
+    # may legitimately press twice in a row (two backs, the same menu again).
+    menu_buttons: frozenset = frozenset()
+
+    def service(self, platform: str, service: str) -> Optional[Service]:
+        entry = self.platforms.get(platform)
+        return entry.services.get(service) if entry else None
+
+    def package(self, platform: str, service: str, amount: str) -> Optional[Package]:
+        entry = self.service(platform, service)
+        return entry.packages.get(amount) if entry else None
+
+    def price(self, platform: str, service: str, amount: str) -> Optional[int]:
+        package = self.package(platform, service, amount)
+        return package.price if package else None
+
+    def menu_entry(self, callback_data: str) -> Union[Platform, Service, Package, None]:
+        """What an inline menu button stands for, None if it is from another catalog version."""
+        _, version, path = callback_data.split(":", 2)
+        return self.menu_entries.get(path) if version == self.version else None
+
+
+def _keyboard(rows, **kwargs) -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup([[KeyboardButton(text) for text in row] for row in rows], resize_keyboard=True, **kwargs)
+
+
+def _inline_keyboard(rows) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=data) for text, data in row] for row in rows])
+
+
+def compile_catalog(data: dict, mtime: float = 0.0) -> Catalog:
+    platforms = {}
+    service_buttons = {}
+    package_buttons = {}
+    menu_entries = {}
+    version = f"{zlib.crc32(json.dumps(data, sort_keys=True).encode()) & 0xFFFFFF:06x}"
+    menu = lambda path: f"{MENU_PREFIX}:{version}:{path}"
+
+    for platform_index, (platform_key, platform_data) in enumerate(data["platforms"].items()):
+        services = {}
+        service_paths = {}
+        for service_index, (service_key, service_data) in enumerate(platform_data.get("services", {}).items()):
+            unit = service_data["unit"]
+            packages = {}
+            inline_rows = []
+            for package_index, (amount, price) in enumerate(service_data["packages"].items()):
+                button = f"{amount} {unit} | {price} ETB"
+                package = Package(platform_key, service_key, amount, int(price), button)
+                packages[amount] = package
+                package_buttons[(platform_key, service_key, button)] = package
+                path = f"k{platform_index}.{service_index}.{package_index}"
+                menu_entries[path] = package
+                inline_rows.append([(button, menu(path))])
+
+            package_rows = [[package.button] for package in packages.values()] + [[BACK_BUTTON]]
+            service = Service(
+                platform=platform_key,
+                key=service_key,
+                button=service_data["button"],
+                unit=unit,
+                prompt=service_data["prompt"],
+                example=service_data["example"],
+                input_prefixes=tuple(service_data.get("input_prefixes", ())),
+                input_error=service_data.get("input_error", ""),
+                input_type=service_data["input_type"],
+                packages=MappingProxyType(packages),
+                keyboard=_keyboard(package_rows, one_time_keyboard=True),
+                panel_service=service_data.get("panel_service"),
+                inline_keyboard=_inline_keyboard(inline_rows + [[(BACK_BUTTON, MENU_BACK_PACKAGES)]]),
+            )
+            services[service_key] = service
+            service_buttons[(platform_key, service.button.lower())] = service
+            service_paths[service_key] = f"s{platform_index}.{service_index}"
+            menu_entries[service_paths[service_key]] = service
+
+        layout = [[_LAYOUT_BUTTONS.get(key) or services[key].button for key in row]
+                  for row in platform_data.get("layout", [])]
+        inline_layout = [[_INLINE_LAYOUT_BUTTONS.get(key) or (services[key].button, menu(service_paths[key])) for key in row]
+                         for row in platform_data.get("layout", [])]
+        platforms[platform_key] = Platform(
+            key=platform_key,
+            button=platform_data["button"],
+            title=platform_data["title"],
+            services=MappingProxyType(services),
+            keyboard=_keyboard(layout) if services else None,
+            inline_keyboard=_inline_keyboard(inline_layout) if services else None,
+        )
+        menu_entries[f"p{platform_index}"] = platforms[platform_key]
+
+    platform_paths = {platform.key: f"p{index}" for index, platform in enumerate(platforms.values())}
+    menu_buttons = {BACK_BUTTON, MAIN_EXIT_BUTTON, MENU_EXIT, MENU_BACK_SERVICES, MENU_BACK_PACKAGES, MENU_BACK_PROMPT}
+    menu_buttons.update(platform.button for platform in platforms.values())
+    menu_buttons.update(service.button for service in service_buttons.values())
+    menu_buttons.update(button for _, _, button in package_buttons)
+    menu_buttons.update(menu(path) for path in menu_entries)
+    platform_rows = [[platforms[key].button for key in row] for row in data["platform_layout"]]
+    return Catalog(
+        platforms=MappingProxyType(platforms),
+        platform_keyboard=_keyboard(platform_rows),
+        platform_buttons=MappingProxyType({platform.button: platform for platform in platforms.values()}),
+        service_buttons=MappingProxyType(service_buttons),
+        package_buttons=MappingProxyType(package_buttons),
+        prompt_keyboard=_keyboard([[BACK_BUTTON]]),
+        mtime=mtime,
+        platform_inline_keyboard=_inline_keyboard([[(platforms[key].button, menu(platform_paths[key])) for key in row]
+                                                   for row in data["platform_layout"]]),
+        prompt_inline_keyboard=_inline_keyboard([[(BACK_BUTTON, MENU_BACK_PROMPT)]]),
+        menu_entries=MappingProxyType(menu_entries),
+        version=version,
+        menu_buttons=frozenset(menu_buttons),
+    )
+
+
+def load_catalog(path: str = CATALOG_PATH) -> Catalog:
+    mtime = os.stat(path).st_mtime
+    with open(path, encoding="utf-8") as f:
+        return compile_catalog(json.load(f), mtime)
+
+
+_current: Optional[Catalog] = None
+
+
+def current() -> Catalog:
+    """The live catalog. Handlers should call this once per update and use the result."""
+    global _current
+    if _current is None:
+        _current = load_catalog()
+    return _current
+
+
+def reload_if_changed(path: str = CATALOG_PATH) -> bool:
+    """Recompile the catalog if the file changed. The new catalog replaces the old one in a
+    single assignment, so an update sees either the old prices or the new ones, never a mix.
+    A broken file is logged and the previous catalog stays live."""
+    global _current
+    try:
+        mtime = os.stat(path).st_mtime
+        if _current is not None and mtime == _current.mtime:
+            return False
+        catalog = load_catalog(path)
+    except (OSError, ValueError, KeyError, TypeError) as exc:
+        logger.error("Failed to reload catalog from %s, keeping the current one.", path, exc_info=exc)
+        return False
+    _current = catalog
+    logger.info("Catalog loaded from %s.", path)
+    return True
+
+
+async def watch(interval: float, path: str = CATALOG_PATH) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        reload_if_changed(path)
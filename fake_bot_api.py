@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for the Telegram Bot API, for running the bot without Telegram.
+
+Start the bot with BOT_API_URL=http://127.0.0.1:<port> and feed it updates through
+``POST /_updates`` (or :meth:`FakeBotApi.inject` when used in-process). Updates are
+delivered to the webhook if one is set, otherwise they wait for getUpdates. Messages the
+bot sends are recorded per chat and can be read back from ``GET /_messages/<chat_id>``.
+
+    python fake_bot_api.py --port 8081
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Callable, Optional
+from urllib.parse import parse_qsl
+
+import httpx
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+from sharding import SECRET_HEADER, shard_for, update_user_id
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+# An 8x8 grey JPEG, served for every getFile download.
+TINY_JPEG = bytes.fromhex(
+    "ffd8ffe000104a46494600010100000100010000ffdb004300100b0c0e0c0a100e0d0e1211101318281a181616183123251d283a333d3c39"
+    "33383740485c4e404457453738506d51575f626768673e4d71797064785c656763ffc0000b080008000801011100ffc4001f000001050101"
+    "0101010100000000000000000102030405060708090a0bffc400b5100002010303020403050504040000017d010203000411051221314106"
+    "13516107227114328191a1082342b1c11552d1f02433627282090a161718191a25262728292a3435363738393a434445464748494a535455"
+    "565758595a636465666768696a737475767778797a838485868788898a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9ba"
+    "c2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9faffda0008010100003f002bffd9"
+)
+
+MESSAGE_METHODS = {"sendMessage", "forwardMessage", "copyMessage", "sendPhoto", "sendDocument", "editMessageText",
+                   "editMessageCaption"}
+
+
+class FakeBotApi:
+    def __init__(self, member_status: str = "member", delivery_connections: int = 40):
+        self.member_status = member_status
+        self.delivery_connections = delivery_connections
+        self.webhook_url: Optional[str] = None
+        self.secret_token: Optional[str] = None
+        self.messages: dict[int, list] = defaultdict(list)
+        self.calls: dict[str, int] = defaultdict(int)
+        self.listeners: list[Callable[[str, dict, dict], None]] = []
+        self._pending: asyncio.Queue = asyncio.Queue()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._deliverers: list[asyncio.Task] = []
+        self._client: Optional[httpx.AsyncClient] = None
+
+    # --- Updates ---
+    def inject(self, update: dict) -> dict:
+        update.setdefault("update_id", next(self._update_ids))
+        if self.webhook_url:
+            # One FIFO per connection, chosen by user, so a user's updates arrive in order.
+            self._webhook_queues[shard_for(update_user_id(update), len(self._webhook_queues))].put_nowait(update)
+        else:
+            self._pending.put_nowait(update)
+        return update
+
+    async def _deliver(self, queue: asyncio.Queue) -> None:
+        while True:
+            update = await queue.get()
+            headers = {SECRET_HEADER: self.secret_token} if self.secret_token else {}
+            try:
+                await self._client.post(self.webhook_url, json=update, headers=headers)
+            except httpx.HTTPError as exc:
+                logger.warning("Webhook delivery failed: %s", exc)
+
+    def _set_webhook(self, url: str, secret_token: Optional[str]) -> None:
+        self.webhook_url = url or None
+        self.secret_token = secret_token
+        for task in self._deliverers:
+            task.cancel()
+        self._deliverers = []
+        if self.webhook_url:
+            self._client = self._client or httpx.AsyncClient(
+                timeout=30, limits=httpx.Limits(max_connections=self.delivery_connections))
+            self._webhook_queues = [asyncio.Queue() for _ in range(self.delivery_connections)]
+            self._deliverers = [asyncio.create_task(self._deliver(queue)) for queue in self._webhook_queues]
+
+    async def _get_updates(self, params: dict) -> list:
+        timeout = float(params.get("timeout", 0))
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self._pending.get(), timeout) if timeout else self._pending.get_nowait())
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            return []
+        limit = int(params.get("limit", 100))
+        while len(updates) < limit and not self._pending.empty():
+            updates.append(self._pending.get_nowait())
+        return updates
+
+    # --- Methods ---
+    def _message(self, chat_id, **fields) -> dict:
+        message = {"message_id": next(self._message_ids), "date": int(time.time()),
+                   "chat": {"id": int(chat_id), "type": "private" if int(chat_id) > 0 else "supergroup"},
+                   "from": BOT_USER}
+        message.update(fields)
+        return message
+
+    async def call(self, method: str, params: dict):
+        self.calls[method] += 1
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method == "setWebhook":
+            self._set_webhook(params.get("url", ""), params.get("secret_token"))
+            result = True
+        elif method == "deleteWebhook":
+            self._set_webhook("", None)
+            result = True
+        elif method == "getWebhookInfo":
+            result = {"url": self.webhook_url or "", "has_custom_certificate": False, "pending_update_count": 0}
+        elif method == "getChatMember":
+            result = {"status": self.member_status,
+                      "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "User"}}
+        elif method == "getFile":
+            result = {"file_id": params["file_id"], "file_unique_id": params["file_id"][-16:],
+                      "file_size": len(TINY_JPEG), "file_path": f"photos/{params['file_id']}.jpg"}
+        elif method in MESSAGE_METHODS:
+            fields = {}
+            for key in ("text", "caption"):
+                if key in params:
+                    fields[key] = params[key]
+            markup = params.get("reply_markup")
+            if isinstance(markup, dict) and "inline_keyboard" in markup:
+                # Telegram only echoes inline keyboards back.
+                fields["reply_markup"] = markup
+            if "message_id" in params and method.startswith("edit"):
+                fields["message_id"] = int(params["message_id"])
+            result = self._message(params["chat_id"], **fields)
+            self.messages[int(params["chat_id"])].append(dict(result, method=method, reply_markup=markup))
+            if method == "copyMessage":
+                result = {"message_id": result["message_id"]}
+        else:
+            # answerCallbackQuery, deleteMessage, setMyCommands, ...
+            result = True
+        for listener in self.listeners:
+            listener(method, params, result)
+        return result
+
+
+def _parse_params(request) -> dict:
+    if not request.body:
+        return {}
+    content_type = request.headers.get("Content-Type", "")
+    if content_type.startswith("application/json"):
+        return json.loads(request.body)
+    if content_type.startswith("multipart/form-data"):
+        params = {key: values[0].decode() for key, values in request.body_arguments.items()}
+    else:
+        params = dict(parse_qsl(request.body.decode()))
+    # Nested objects arrive JSON-encoded inside form fields.
+    for key, value in params.items():
+        if isinstance(value, str) and value[:1] in "[{":
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                pass
+    return params
+
+
+class _MethodHandler(tornado.web.RequestHandler):
+    def initialize(self, api: FakeBotApi) -> None:
+        self.api = api
+
+    async def post(self, token: str, method: str) -> None:
+        try:
+            result = await self.api.call(method, _parse_params(self.request))
+        except asyncio.CancelledError:
+            # A long poll still open when the server shuts down.
+            return
+        self.write({"ok": True, "result": result})
+
+    get = post
+
+
+class _FileHandler(tornado.web.RequestHandler):
+    def get(self, token: str, path: str) -> None:
+        self.set_header("Content-Type", "image/jpeg")
+        self.write(TINY_JPEG)
+
+
+class _InjectHandler(tornado.web.RequestHandler):
+    def initialize(self, api: FakeBotApi) -> None:
+        self.api = api
+
+    def post(self) -> None:
+        self.write(self.api.inject(json.loads(self.request.body)))
+
+
+class _MessagesHandler(tornado.web.RequestHandler):
+    def initialize(self, api: FakeBotApi) -> None:
+        self.api = api
+
+    def get(self, chat_id: str) -> None:
+        self.write({"messages": self.api.messages.get(int(chat_id), [])})
+
+
+def make_app(api: FakeBotApi) -> tornado.web.Application:
+    return tornado.web.Application([
+        (r"/bot([^/]+)/(\w+)", _MethodHandler, {"api": api}),
+        (r"/file/bot([^/]+)/(.+)", _FileHandler),
+        (r"/_updates", _InjectHandler, {"api": api}),
+        (r"/_messages/(-?\d+)", _MessagesHandler, {"api": api}),
+    ])
+
+
+async def serve(api: FakeBotApi, port: int, host: str = "127.0.0.1") -> HTTPServer:
+    server = HTTPServer(make_app(api))
+    server.listen(port, host)
+    return server
+
+
+async def _main(port: int, member_status: str) -> None:
+    await serve(FakeBotApi(member_status=member_status), port)
+    logger.info("Fake Bot API listening on 127.0.0.1:%d", port)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--member-status", default="member", help="status returned by getChatMember")
+    args = parser.parse_args()
+    asyncio.run(_main(args.port, args.member_status))
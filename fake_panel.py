@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for an SMM panel (API v2), for running fulfillment without a supplier.
+
+Start the bot with PANEL_URL=http://127.0.0.1:<port>/api/v2. Orders go from Pending to In
+progress to Completed over ``--complete-after`` seconds. Links containing "partial" or
+"cancel" end that way instead, and ``--fail-rate`` answers that share of requests with a
+503 to exercise retries. Add requests with an Idempotency-Key seen before return the
+original order. Orders can be read back from ``GET /_orders``.
+
+    python fake_panel.py --port 8082 --complete-after 10
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import random
+import time
+from typing import Optional
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+from fulfillment import IDEMPOTENCY_HEADER
+
+logger = logging.getLogger(__name__)
+
+
+class FakePanel:
+    def __init__(self, key: str = "", complete_after: float = 10, fail_rate: float = 0):
+        self.key = key
+        self.complete_after = complete_after
+        self.fail_rate = fail_rate
+        self.orders: dict[int, dict] = {}
+        self.calls: dict[str, int] = {}
+        self._idempotency: dict[str, int] = {}
+        self._order_ids = itertools.count(1001)
+
+    def _status(self, order_id: str) -> dict:
+        order = self.orders.get(_int(order_id))
+        if order is None:
+            return {"error": "Incorrect order ID"}
+        elapsed = time.time() - order["created_at"]
+        if elapsed < self.complete_after / 2:
+            status, remains = "Pending", order["quantity"]
+        elif elapsed < self.complete_after:
+            status, remains = "In progress", order["quantity"] // 2
+        elif "partial" in order["link"]:
+            status, remains = "Partial", order["quantity"] // 3
+        elif "cancel" in order["link"]:
+            status, remains = "Canceled", order["quantity"]
+        else:
+            status, remains = "Completed", 0
+        return {"charge": f"{order['quantity'] * 0.001:.5f}", "start_count": "0", "status": status,
+                "remains": str(remains), "currency": "USD"}
+
+    def call(self, params: dict, idempotency_key: Optional[str]) -> dict:
+        action = params.get("action", "")
+        self.calls[action] = self.calls.get(action, 0) + 1
+        if self.key and params.get("key") != self.key:
+            return {"error": "Invalid API key"}
+        if action == "add":
+            if idempotency_key in self._idempotency:
+                return {"order": self._idempotency[idempotency_key]}
+            quantity = _int(params.get("quantity"))
+            if _int(params.get("service")) is None or not params.get("link") or not quantity:
+                return {"error": "Incorrect request"}
+            order_id = next(self._order_ids)
+            self.orders[order_id] = {"service": int(params["service"]), "link": params["link"], "quantity": quantity,
+                                     "idempotency_key": idempotency_key, "created_at": time.time()}
+            if idempotency_key:
+                self._idempotency[idempotency_key] = order_id
+            return {"order": order_id}
+        if action == "status":
+            if "orders" in params:
+                return {order_id: self._status(order_id) for order_id in params["orders"].split(",") if order_id}
+            return self._status(params.get("order", ""))
+        if action == "balance":
+            return {"balance": "100.00", "currency": "USD"}
+        return {"error": "Incorrect action"}
+
+
+def _int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _ApiHandler(tornado.web.RequestHandler):
+    def initialize(self, panel: FakePanel) -> None:
+        self.panel = panel
+
+    def post(self) -> None:
+        if random.random() < self.panel.fail_rate:
+            raise tornado.web.HTTPError(503)
+        params = {key: self.get_argument(key) for key in self.request.arguments}
+        self.write(self.panel.call(params, self.request.headers.get(IDEMPOTENCY_HEADER)))
+
+
+class _OrdersHandler(tornado.web.RequestHandler):
+    def initialize(self, panel: FakePanel) -> None:
+        self.panel = panel
+
+    def get(self) -> None:
+        self.write({"orders": {str(order_id): order for order_id, order in self.panel.orders.items()}})
+
+
+def make_app(panel: FakePanel) -> tornado.web.Application:
+    return tornado.web.Application([
+        (r"/api/v2", _ApiHandler, {"panel": panel}),
+        (r"/_orders", _OrdersHandler, {"panel": panel}),
+    ])
+
+
+async def serve(panel: FakePanel, port: int, host: str = "127.0.0.1") -> HTTPServer:
+    server = HTTPServer(make_app(panel))
+    server.listen(port, host)
+    return server
+
+
+async def _main(args) -> None:
+    await serve(FakePanel(args.key, args.complete_after, args.fail_rate), args.port)
+    logger.info("Fake panel listening on http://127.0.0.1:%d/api/v2", args.port)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--key", default="", help="API key to require, any key is accepted if empty")
+    parser.add_argument("--complete-after", type=float, default=10, help="seconds until an order completes")
+    parser.add_argument("--fail-rate", type=float, default=0, help="share of requests answered with a 503")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+import metrics
+from storage import Store
+
+logger = logging.getLogger(__name__)
+
+PANEL_LATENCY = metrics.REGISTRY.histogram("bot_panel_request_seconds", "Supplier panel request latency.", ("action",))
+PANEL_ERRORS = metrics.REGISTRY.counter("bot_panel_errors_total", "Supplier panel requests that failed.", ("action", "error"))
+FINISHED = metrics.REGISTRY.counter("bot_fulfillments_total", "Fulfillments that reached a final state.", ("status",))
+
+FULFILLMENT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fulfillments (
+    order_id INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    panel_service INTEGER NOT NULL,
+    link TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    panel_order INTEGER,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    remains INTEGER,
+    error TEXT,
+    next_attempt REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fulfillments_status ON fulfillments (shard, status);
+"""
+
+QUEUED = "queued"
+PLACED = "placed"
+COMPLETED = "completed"
+PARTIAL = "partial"
+CANCELED = "canceled"
+FAILED = "failed"
+# Sent to the panel without an answer coming back: it may or may not have been placed.
+UNKNOWN = "unknown"
+# Panel statuses that end an order; Pending, In progress and Processing mean keep polling.
+_PANEL_FINAL = {"completed": COMPLETED, "partial": PARTIAL, "canceled": CANCELED, "cancelled": CANCELED,
+                "refunded": CANCELED}
+
+# API v2 panels take at most 100 ids per multi-status request.
+STATUS_BATCH = 100
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# Raised before the request left, so the panel never saw it.
+_NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class PanelError(Exception):
+    """The panel refused the request (bad link, low balance, unknown service). Not retried."""
+
+
+class PanelUnknown(Exception):
+    """An add reached the panel but no usable answer came back. Not retried, since the order
+    may already be placed."""
+
+
+def _int(value) -> Optional[int]:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class PanelClient:
+    """Client of a standard SMM panel API v2: one POST endpoint, ``action`` selects the call.
+
+    All requests share one httpx client, so they reuse keep-alive connections, and at most
+    ``max_connections`` are in flight. Transport errors, 429 and 5xx are retried with
+    exponential backoff and jitter. An add is not idempotent on most panels (they ignore the
+    idempotency key it carries), so it is only retried when the panel cannot have acted on
+    it: connect errors and 429. Any other failure raises :class:`PanelUnknown`.
+    """
+
+    def __init__(self, url: str, key: str, max_connections: int = 10, max_attempts: int = 4, timeout: float = 20):
+        self.url = url
+        self.key = key
+        self.max_attempts = max_attempts
+        self._client = httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections))
+        # Waiting for a free connection inside httpx would count against the request timeout.
+        self._slots = asyncio.Semaphore(max_connections)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    async def _call(self, action: str, params: dict, idempotency_key: Optional[str] = None, resend: bool = True):
+        data = dict(params, key=self.key, action=action)
+        headers = {IDEMPOTENCY_HEADER: idempotency_key} if idempotency_key else None
+        for attempt in range(self.max_attempts):
+            started = time.perf_counter()
+            delay = min(2 ** attempt, 30) * (0.5 + random.random())
+            try:
+                async with self._slots:
+                    response = await self._client.post(self.url, data=data, headers=headers)
+                if response.status_code == 429 or response.status_code >= 500:
+                    delay = float(response.headers.get("Retry-After", delay))
+                    raise httpx.HTTPStatusError(f"HTTP {response.status_code}", request=response.request,
+                                                response=response)
+            except httpx.HTTPError as exc:
+                PANEL_ERRORS.inc(action, type(exc).__name__)
+                rate_limited = isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 429
+                if not (resend or rate_limited or isinstance(exc, _NOT_SENT)):
+                    raise PanelUnknown(str(exc) or type(exc).__name__) from exc
+                if attempt + 1 >= self.max_attempts:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                PANEL_LATENCY.observe(time.perf_counter() - started, action)
+            try:
+                result = response.json()
+            except ValueError:
+                result = {"error": f"HTTP {response.status_code}, not JSON"}
+            if isinstance(result, dict) and "error" in result:
+                PANEL_ERRORS.inc(action, "PanelError")
+                raise PanelError(result["error"])
+            return result
+
+    async def add(self, service: int, link: str, quantity: int, idempotency_key: str) -> int:
+        result = await self._call("add", {"service": service, "link": link, "quantity": quantity}, idempotency_key,
+                                  resend=False)
+        return int(result["order"])
+
+    async def statuses(self, panel_orders: list[int]) -> dict[int, dict]:
+        """Status of up to STATUS_BATCH panel orders in one request, by panel order id."""
+        result = await self._call("status", {"orders": ",".join(map(str, panel_orders))})
+        return {int(panel_order): status for panel_order, status in result.items()}
+
+
+class Fulfillment:
+    """Places approved orders on the supplier panel and follows them until they finish.
+
+    An order is written to the fulfillments table before the panel is called, so an order
+    approved just before a crash is still placed after the restart, with the same
+    idempotency key. Orders the panel could not be reached for are retried every
+    ``retry_interval`` and fail after ``max_attempts`` tries. An add that got no answer is
+    never resent: the order becomes UNKNOWN for an admin to check on the panel. Placed
+    orders are polled together every ``poll_interval``, in multi-status batches of 100
+    rather than one request per order, and ``on_finish`` gets the row of each order that
+    reaches a final state.
+    """
+
+    def __init__(self, store: Store, client: PanelClient, poll_interval: float = 60, retry_interval: float = 60,
+                 max_attempts: int = 10, shard: int = 0):
+        self.store = store
+        self.client = client
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self.shard = shard
+        self._on_finish: Optional[Callable[[dict], Awaitable[None]]] = None
+        self._placing: dict[int, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        store.add_schema(FULFILLMENT_SCHEMA)
+
+    def __len__(self) -> int:
+        return len(self._placing)
+
+    # --- Lifecycle ---
+    async def start(self, on_finish: Callable[[dict], Awaitable[None]]) -> None:
+        self._on_finish = on_finish
+        rows = await self.store.fetchall("SELECT * FROM fulfillments WHERE shard = ? AND status = ?", (self.shard, QUEUED))
+        for row in rows:
+            self._spawn(dict(row))
+        if rows:
+            logger.info("Resuming %d fulfillments that were not placed yet.", len(rows))
+        self._task = asyncio.create_task(self._run(), name="fulfillment")
+
+    async def stop(self, timeout: float = 10) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._placing:
+            await asyncio.wait(self._placing.values(), timeout=timeout)
+        await self.client.close()
+
+    # --- Placing ---
+    async def submit(self, order_id: int, user_id: int, panel_service: int, link: str, quantity: int) -> bool:
+        """Queue an approved order for the panel. False if it was already submitted."""
+        now = time.time()
+        row = {"order_id": order_id, "shard": self.shard, "user_id": user_id, "panel_service": panel_service,
+               "link": link, "quantity": quantity, "status": QUEUED, "next_attempt": now + self.retry_interval,
+               "created_at": now, "updated_at": now}
+        inserted = await self.store.write(
+            f"INSERT OR IGNORE INTO fulfillments ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+            tuple(row.values()),
+        )
+        if inserted:
+            self._spawn(row)
+        return bool(inserted)
+
+    def _spawn(self, row: dict) -> None:
+        order_id = row["order_id"]
+        if order_id in self._placing:
+            return
+        task = asyncio.create_task(self._place(row), name=f"fulfill_{order_id}")
+        self._placing[order_id] = task
+        task.add_done_callback(lambda _: self._placing.pop(order_id, None))
+
+    async def _place(self, row: dict) -> None:
+        order_id = row["order_id"]
+        try:
+            panel_order = await self.client.add(row["panel_service"], row["link"], row["quantity"], f"order-{order_id}")
+        except PanelError as exc:
+            await self._finish(row, FAILED, error=str(exc))
+            return
+        except PanelUnknown as exc:
+            logger.warning("No answer from the panel for order %s, not placing it again: %s", order_id, exc)
+            await self._finish(row, UNKNOWN, error=str(exc))
+            return
+        except httpx.HTTPError as exc:
+            error = str(exc) or type(exc).__name__
+            row["attempts"] = row.get("attempts", 0) + 1
+            if row["attempts"] >= self.max_attempts:
+                logger.warning("Giving up on order %s after %d attempts: %s", order_id, row["attempts"], exc)
+                self.store.write_nowait("UPDATE fulfillments SET attempts = ? WHERE order_id = ?",
+                                        (row["attempts"], order_id))
+                await self._finish(row, FAILED, error=f"panel unreachable: {error}")
+                return
+            logger.warning("Could not reach the panel for order %s, retrying later: %s", order_id, exc)
+            now = time.time()
+            self.store.write_nowait(
+                "UPDATE fulfillments SET attempts = ?, error = ?, next_attempt = ?, updated_at = ?"
+                " WHERE order_id = ?", (row["attempts"], error, now + self.retry_interval, now, order_id))
+            return
+        self.store.write_nowait(
+            "UPDATE fulfillments SET status = ?, panel_order = ?, error = NULL, updated_at = ? WHERE order_id = ?",
+            (PLACED, panel_order, time.time(), order_id))
+
+    # --- Polling ---
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("Fulfillment poll failed.")
+
+    async def poll(self) -> None:
+        """Retry orders that are due and check every placed order."""
+        retries = await self.store.fetchall(
+            "SELECT * FROM fulfillments WHERE shard = ? AND status = ? AND next_attempt <= ?",
+            (self.shard, QUEUED, time.time()))
+        for row in retries:
+            self._spawn(dict(row))
+        rows = await self.store.fetchall("SELECT * FROM fulfillments WHERE shard = ? AND status = ? ORDER BY panel_order",
+                                         (self.shard, PLACED))
+        await asyncio.gather(*(self._check([dict(row) for row in rows[i:i + STATUS_BATCH]])
+                               for i in range(0, len(rows), STATUS_BATCH)))
+
+    async def _check(self, rows: list[dict]) -> None:
+        try:
+            statuses = await self.client.statuses([row["panel_order"] for row in rows])
+        except (PanelError, httpx.HTTPError) as exc:
+            logger.warning("Panel status check of %d orders failed: %s", len(rows), exc)
+            return
+        for row in rows:
+            status = statuses.get(row["panel_order"]) or {}
+            final = _PANEL_FINAL.get(str(status.get("status", "")).lower())
+            remains = _int(status.get("remains"))
+            if final:
+                await self._finish(row, final, remains=remains if final == PARTIAL else 0)
+            elif remains is not None and remains != row["remains"]:
+                self.store.write_nowait("UPDATE fulfillments SET remains = ?, updated_at = ? WHERE order_id = ?",
+                                        (remains, time.time(), row["order_id"]))
+
+    async def _finish(self, row: dict, status: str, remains: Optional[int] = None, error: Optional[str] = None) -> None:
+        self.store.write_nowait(
+            "UPDATE fulfillments SET status = ?, remains = ?, error = ?, updated_at = ? WHERE order_id = ?",
+            (status, remains, error, time.time(), row["order_id"]))
+        FINISHED.inc(status)
+        row.update(status=status, remains=remains, error=error)
+        try:
+            await self._on_finish(row)
+        except Exception:
+            logger.exception("Fulfillment callback failed for order %s.", row["order_id"])
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""Load test: drive the full order funnel of many simulated users against the real bot.
+
+Starts fake_bot_api in this process and main.py as a subprocess pointed at it, then
+walks every user through start -> platform -> service -> package -> input ->
+confirmation -> proof, followed by an admin approval. Each step is timed from the update
+being handed to the bot until the reply reaches the user. With --panel, approved orders
+are placed on fake_panel and the funnel ends when the user is told the order completed.
+With --inline the bot runs with INLINE_MENUS and users press the menu's inline buttons.
+The report ends with the Bot API requests and bytes the bot used per completed funnel.
+
+    python loadtest.py --users 2000 --concurrency 500
+    python loadtest.py --users 2000 --webhook --shards 4 --max-p99 1.5
+    python loadtest.py --users 500 --panel --panel-fail-rate 0.1
+    python loadtest.py --users 500 --inline
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Optional
+
+import catalog
+from fake_bot_api import MESSAGE_METHODS, FakeBotApi, serve
+from fake_panel import FakePanel, serve as serve_panel
+from storage import parse_order_id, to_base36
+
+ADMIN_CHAT_ID = -1001000000001
+ADMIN_USER_ID = 1000
+FIRST_USER_ID = 10_000_000
+STEP_TIMEOUT = 60
+ORDER_ID_PATTERN = re.compile(r"#ID[0-9A-Z]+")
+
+STEPS = ("start", "platform_menu", "service_menu", "package_menu", "awaiting_input", "confirmation",
+         "awaiting_proof", "approval", "fulfillment")
+
+
+# --- Simulated users ---
+class Funnel:
+    def __init__(self, api: FakeBotApi, panel: bool = False, inline: bool = False):
+        self.api = api
+        self.panel = panel
+        self.inline = inline
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.failures: dict[str, int] = defaultdict(int)
+        self.completed = 0
+        self.api_calls: Counter = Counter()
+        self.api_bytes = 0
+        self._inbox: dict[int, asyncio.Queue] = {}
+        self._menus: dict[int, dict] = {}
+        self._message_ids = itertools.count(1)
+        api.listeners.append(self._on_call)
+
+    def _on_call(self, method: str, params: dict, result) -> None:
+        if method != "getUpdates":
+            self.api_calls[method] += 1
+            self.api_bytes += len(json.dumps(params, ensure_ascii=False, default=str).encode())
+            self.api_bytes += len(json.dumps(result, ensure_ascii=False, default=str).encode())
+        if method not in MESSAGE_METHODS:
+            return
+        inbox = self._inbox.get(int(params["chat_id"]))
+        if inbox is not None:
+            inbox.put_nowait((params.get("text") or "", result))
+
+    def _message(self, user_id: int, **fields) -> dict:
+        message = {"message_id": next(self._message_ids), "date": int(time.time()),
+                   "chat": {"id": user_id, "type": "private"},
+                   "from": {"id": user_id, "is_bot": False, "first_name": f"Load {user_id}",
+                            "username": f"load{user_id}"}}
+        message.update(fields)
+        return {"message": message}
+
+    def _approval(self, user_id: int, order_id: str) -> dict:
+        return {"callback_query": {
+            "id": str(next(self._message_ids)), "chat_instance": "loadtest", "data": f"o:a:{to_base36(parse_order_id(order_id))}",
+            "from": {"id": ADMIN_USER_ID, "is_bot": False, "first_name": "Admin"},
+            "message": {"message_id": next(self._message_ids), "date": int(time.time()),
+                        "chat": {"id": ADMIN_CHAT_ID, "type": "supergroup"}, "text": f"Order {order_id}"}}}
+
+    def _press(self, user_id: int, button: str) -> dict:
+        """A press of ``button`` on the last menu the user got."""
+        menu = self._menus.get(user_id) or {}
+        rows = (menu.get("reply_markup") or {}).get("inline_keyboard", [])
+        data = next((b["callback_data"] for row in rows for b in row if b["text"] == button), "missing")
+        return {"callback_query": {
+            "id": str(next(self._message_ids)), "chat_instance": "loadtest", "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": f"Load {user_id}", "username": f"load{user_id}"},
+            "message": {"message_id": menu.get("message_id", 0), "date": int(time.time()),
+                        "chat": {"id": user_id, "type": "private"}, "text": menu.get("text", "")}}}
+
+    async def _step(self, user_id: int, name: str, update, expect: str) -> Optional[str]:
+        """Send ``update`` (if any, called first if it is a press) and wait for the reply that
+        contains ``expect``, skipping others."""
+        inbox = self._inbox[user_id]
+        started = time.perf_counter()
+        if callable(update):
+            update = update()
+        if update is not None:
+            self.api.inject(update)
+        deadline = started + STEP_TIMEOUT
+        while True:
+            try:
+                text, message = await asyncio.wait_for(inbox.get(), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                self.failures[name] += 1
+                return None
+            if expect in text:
+                self.latencies[name].append(time.perf_counter() - started)
+                self._menus[user_id] = message
+                return text
+
+    async def run_user(self, user_id: int, path: tuple) -> None:
+        platform, service, package = path
+        self._inbox[user_id] = asyncio.Queue()
+        user_input = (service.input_prefixes[0] if service.input_prefixes else "@") + f"load{user_id}"
+        text = lambda value: self._message(user_id, text=value)
+        # Menu buttons are typed with reply keyboards, pressed once the menu is there with inline ones.
+        button = (lambda value: lambda: self._press(user_id, value)) if self.inline else text
+        steps = (
+            ("start", self._message(user_id, text="/start",
+                                    entities=[{"type": "bot_command", "offset": 0, "length": 6}]), "👋"),
+            ("platform_menu", button(platform.button), "✨"),
+            ("service_menu", button(service.button), "💖"),
+            ("package_menu", button(package.button), service.prompt),
+            ("awaiting_input", text(user_input), "💸"),
+            ("confirmation", button("✅ አረጋግጥ"), "🏦"),
+            ("awaiting_proof", self._message(user_id, photo=[
+                {"file_id": f"proof-{user_id}-s", "file_unique_id": f"u{user_id}s", "width": 90, "height": 90},
+                {"file_id": f"proof-{user_id}", "file_unique_id": f"u{user_id}", "width": 800, "height": 800}]), "#ID"),
+        )
+        try:
+            reply = None
+            for name, update, expect in steps:
+                reply = await self._step(user_id, name, update, expect)
+                if reply is None:
+                    return
+            order_id = ORDER_ID_PATTERN.search(reply).group(0)
+            if parse_order_id(order_id) is None or await self._step(
+                    user_id, "approval", self._approval(user_id, order_id), "✅ ክፍያዎ" if self.panel else "🎉") is None:
+                return
+            if self.panel and await self._step(user_id, "fulfillment", None, "🎉") is None:
+                return
+            self.completed += 1
+        finally:
+            del self._inbox[user_id]
+            self._menus.pop(user_id, None)
+
+
+def funnel_paths() -> list[tuple]:
+    """Every (platform, service, package) a user can order, so load spreads over the catalog."""
+    paths = []
+    for platform in catalog.current().platforms.values():
+        for service in platform.services.values():
+            for package in service.packages.values():
+                paths.append((platform, service, package))
+    return paths
+
+
+# --- Bot process ---
+def rss_kb(pid: int) -> int:
+    """Resident memory of ``pid`` and all of its descendants, from /proc."""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1])
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return total
+    return total + sum(rss_kb(child) for child in children)
+
+
+def cpu_seconds(pid: int) -> float:
+    """CPU time used so far by ``pid`` and its live descendants, from /proc."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return 0.0
+    # utime and stime, fields 14 and 15 of stat.
+    total = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return total + sum(cpu_seconds(child) for child in children)
+
+
+def start_bot(args, workdir: str) -> subprocess.Popen:
+    env = dict(os.environ,
+               BOT_TOKEN="1000000001:loadtest",
+               ADMIN_CHAT_ID=str(ADMIN_CHAT_ID),
+               BOT_API_URL=f"http://127.0.0.1:{args.api_port}",
+               DB_PATH=os.path.join(workdir, "bot.db"),
+               SHARD_WORKERS=str(args.shards),
+               SHARD_BASE_PORT=str(args.bot_port + 1))
+    if not args.real_limits:
+        # The fake API has no flood control, so by default measure the bot rather than the limiter.
+        env.update(OUTBOX_GLOBAL_RATE="100000", OUTBOX_CHAT_RATE="1000", OUTBOX_GROUP_RATE="1000")
+    if args.panel:
+        # The shipped catalog has no panel service ids, map every service to one.
+        with open(catalog.CATALOG_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+        services = (service for platform in data["platforms"].values() for service in platform.get("services", {}).values())
+        for panel_service, service in enumerate(services, 1):
+            service["panel_service"] = panel_service
+        with open(os.path.join(workdir, "catalog.json"), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        env.update(CATALOG_PATH=os.path.join(workdir, "catalog.json"), PANEL_URL=f"http://127.0.0.1:{args.panel_port}/api/v2",
+                   PANEL_POLL_INTERVAL="1")
+    if args.inline:
+        env.update(INLINE_MENUS="1")
+    if args.webhook or args.shards > 1:
+        env.update(WEBHOOK_URL=f"http://127.0.0.1:{args.bot_port}", WEBHOOK_LISTEN="127.0.0.1", PORT=str(args.bot_port))
+    log = open(os.path.join(workdir, "bot.log"), "w")
+    return subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")],
+                            env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_ready(api: FakeBotApi, bot: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while not (api.webhook_url or api.calls["getUpdates"]):
+        if bot.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError("bot did not start, see bot.log")
+        await asyncio.sleep(0.1)
+    # Give shard workers (started by the ingress) time to come up.
+    await asyncio.sleep(2 if api.webhook_url else 0.5)
+
+
+# --- Report ---
+def quantile(values: list, q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def report(args, funnel: Funnel, elapsed: float, rss_start: int, rss_peak: int, rss_end: int, cpu: float) -> float:
+    print(f"\nUsers: {args.users} | completed: {funnel.completed} | "
+          f"concurrency: {args.concurrency} | shards: {args.shards} | {'webhook' if args.webhook or args.shards > 1 else 'polling'}")
+    print(f"Elapsed: {elapsed:.1f}s | funnels/s: {funnel.completed / elapsed:.1f} | "
+          f"updates/s: {sum(len(v) for v in funnel.latencies.values()) / elapsed:.1f}\n")
+    print(f"{'step':<16}{'n':>7}{'fail':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    worst = 0.0
+    for step in STEPS:
+        values = sorted(funnel.latencies[step])
+        if not values and not funnel.failures[step]:
+            # A step this run does not have, like fulfillment without --panel.
+            continue
+        p99 = quantile(values, 0.99)
+        worst = max(worst, p99)
+        print(f"{step:<16}{len(values):>7}{funnel.failures[step]:>6}{quantile(values, 0.5) * 1000:>9.0f}"
+              f"{quantile(values, 0.95) * 1000:>9.0f}{p99 * 1000:>9.0f}{(values[-1] if values else 0) * 1000:>9.0f}")
+    print(f"\nRSS: start {rss_start / 1024:.1f} MiB | peak {rss_peak / 1024:.1f} MiB | "
+          f"end {rss_end / 1024:.1f} MiB | growth {(rss_end - rss_start) / 1024:+.1f} MiB "
+          f"({(rss_end - rss_start) / max(funnel.completed, 1):.1f} KiB/user)")
+    completed = max(funnel.completed, 1)
+    # Throughput on one machine is capped by its cores; CPU per funnel is what sharding must keep flat.
+    print(f"Bot CPU: {cpu:.1f}s | {cpu / completed * 1000:.0f} ms/funnel | {cpu / elapsed:.2f} cores "
+          f"(of {os.cpu_count()})")
+    print(f"Bot API: {sum(funnel.api_calls.values()) / completed:.1f} requests/funnel | "
+          f"{funnel.api_bytes / completed / 1024:.1f} KiB/funnel | "
+          + ", ".join(f"{method} {count / completed:.1f}" for method, count in funnel.api_calls.most_common()))
+    return worst
+
+
+async def run(args) -> int:
+    api = FakeBotApi(delivery_connections=args.delivery_connections)
+    server = await serve(api, args.api_port)
+    panel_server = await serve_panel(FakePanel(complete_after=2, fail_rate=args.panel_fail_rate),
+                                     args.panel_port) if args.panel else None
+    funnel = Funnel(api, args.panel, args.inline)
+    paths = funnel_paths()
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = start_bot(args, workdir)
+        try:
+            await wait_ready(api, bot)
+            rss_start = rss_peak = rss_kb(bot.pid)
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def user(index: int) -> None:
+                async with semaphore:
+                    await funnel.run_user(FIRST_USER_ID + index, paths[index % len(paths)])
+
+            async def sample() -> None:
+                nonlocal rss_peak
+                while True:
+                    rss_peak = max(rss_peak, rss_kb(bot.pid))
+                    await asyncio.sleep(0.5)
+
+            sampler = asyncio.create_task(sample())
+            funnel.api_calls.clear()
+            funnel.api_bytes = 0
+            started = time.perf_counter()
+            cpu_start = cpu_seconds(bot.pid)
+            await asyncio.gather(*(user(index) for index in range(args.users)))
+            elapsed = time.perf_counter() - started
+            cpu = cpu_seconds(bot.pid) - cpu_start
+            sampler.cancel()
+            # Let write-behind and outbox work settle so the end sample is steady state.
+            await asyncio.sleep(args.settle)
+            rss_end = rss_kb(bot.pid)
+            worst = report(args, funnel, elapsed, rss_start, rss_peak, rss_end, cpu)
+        finally:
+            bot.send_signal(signal.SIGTERM)
+            try:
+                bot.wait(15)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+            server.stop()
+            if panel_server:
+                panel_server.stop()
+
+    failed = args.users - funnel.completed
+    if failed:
+        print(f"\nFAIL: {failed} users did not complete the funnel.")
+        return 1
+    if args.max_p99 and worst > args.max_p99:
+        print(f"\nFAIL: worst step p99 {worst:.3f}s is above --max-p99 {args.max_p99}s.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200, help="users in the funnel at the same time")
+    parser.add_argument("--webhook", action="store_true", help="deliver updates by webhook instead of getUpdates")
+    parser.add_argument("--shards", type=int, default=1, help="SHARD_WORKERS for the bot (implies --webhook)")
+    parser.add_argument("--real-limits", action="store_true", help="keep the outbox's Telegram rate limits")
+    parser.add_argument("--panel", action="store_true", help="fulfil approved orders on fake_panel")
+    parser.add_argument("--panel-fail-rate", type=float, default=0, help="share of panel requests failing with a 503")
+    parser.add_argument("--inline", action="store_true", help="run the bot with INLINE_MENUS and press inline buttons")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--panel-port", type=int, default=8082)
+    parser.add_argument("--bot-port", type=int, default=8443)
+    parser.add_argument("--delivery-connections", type=int, default=40, help="fake API webhook connections")
+    parser.add_argument("--settle", type=float, default=3, help="seconds to wait before the final memory sample")
+    parser.add_argument("--max-p99", type=float, help="fail if any step's p99 latency (seconds) is above this")
+    sys.exit(asyncio.run(run(parser.parse_args())))
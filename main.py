@@ -1,19 +1,45 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import html
 import logging
 import os
-import random
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
+import time
+from typing import Optional
+from telegram import Message, Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
     CommandHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
     ConversationHandler,
     MessageHandler,
+    TypeHandler,
     filters,
     ContextTypes,
 )
-from telegram.error import TelegramError
+from telegram.error import BadRequest, TelegramError
+
+import catalog
+import metrics
+from analytics import Analytics, day_of
+from antiflood import MUTED_NOW, FloodGuard, fingerprint
+from broadcast import Broadcaster
+from catalog import BACK_BUTTON, MAIN_EXIT_BUTTON, MENU_PREFIX, Platform, Service
+from fulfillment import COMPLETED, PARTIAL, UNKNOWN, Fulfillment, PanelClient
+from membership import SUBSCRIBED_STATUSES, MembershipCache
+from metrics import InstrumentedRequest, instrument_handlers
+from outbox import Outbox, PRIORITY_ADMIN, PRIORITY_BULK, PRIORITY_USER
+from pending import CALLBACK_PREFIX as PENDING_PREFIX, PendingQueue, render_view
+from persistence import SQLitePersistence
+from processing import PerUserUpdateProcessor
+from proofhash import ProofIndex, dhash
+from reminders import StageTracker
+from reviewers import ReviewerPool
+from sharding import run_ingress, run_worker
+from storage import (OrderStore, STATUS_APPROVED, STATUS_PROOF_SUBMITTED, STATUS_REJECTED, format_order_id,
+                     order_id_time, parse_order_id, to_base36)
+from telebirr import ReceiptLookup, UsedTransactions, check_receipt, parse_receipt
 
 # --- Basic Configuration ---
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
@@ -21,38 +47,127 @@ logger = logging.getLogger(__name__)
 
 # --- Environment Variables ---
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
+# Points the bot at a local Bot API server or test stand-in instead of api.telegram.org.
+BOT_API_URL = os.environ.get("BOT_API_URL")
 ADMIN_CHAT_ID = os.environ.get("ADMIN_CHAT_ID")
+# Proofs are spread over these admin chats (comma separated), ADMIN_CHAT_ID alone if unset.
+ADMIN_CHAT_IDS = [int(chat_id) for chat_id in os.environ.get("ADMIN_CHAT_IDS", ADMIN_CHAT_ID or "").split(",")
+                  if chat_id.strip()]
+# A proof nobody decided within this many seconds moves to another reviewer.
+REVIEW_TIMEOUT = float(os.environ.get("REVIEW_TIMEOUT", 900))
 FORCE_SUB_CHANNEL = "@skyfounders"
+TELEBIRR_PHONE = os.environ.get("TELEBIRR_PHONE", "0915243897")
+TELEBIRR_NAME = os.environ.get("TELEBIRR_NAME", "Mohammed")
+# Text proofs whose Telebirr receipt (looked up at TELEBIRR_RECEIPT_URL) matches the order
+# are approved without an admin. A pasted SMS alone is only a hint for the admin.
+AUTO_APPROVE = os.environ.get("AUTO_APPROVE", "0") == "1"
+TELEBIRR_RECEIPT_URL = os.environ.get("TELEBIRR_RECEIPT_URL", "https://transactioninfo.ethiotelecom.et/receipt/{txid}")
+# Navigate with one inline menu message edited in place instead of a new message per step.
+INLINE_MENUS = os.environ.get("INLINE_MENUS", "0") == "1"
+DB_PATH = os.environ.get("DB_PATH", "bot.db")
+MEMBER_CACHE_TTL = float(os.environ.get("MEMBER_CACHE_TTL", 3600))
+MEMBER_CACHE_NEGATIVE_TTL = float(os.environ.get("MEMBER_CACHE_NEGATIVE_TTL", 30))
+MEMBER_CACHE_SIZE = int(os.environ.get("MEMBER_CACHE_SIZE", 100000))
+CATALOG_RELOAD_INTERVAL = float(os.environ.get("CATALOG_RELOAD_INTERVAL", 5))
+# Telegram allows about 30 messages a second per bot. Every message goes through the outbox,
+# replies included; the rest is headroom for callback answers and menu edits, which do not.
+OUTBOX_GLOBAL_RATE = float(os.environ.get("OUTBOX_GLOBAL_RATE", 25))
+OUTBOX_CHAT_RATE = float(os.environ.get("OUTBOX_CHAT_RATE", 1))
+# Telegram allows about 20 messages a minute into a group, which the admin chat is.
+OUTBOX_GROUP_RATE = float(os.environ.get("OUTBOX_GROUP_RATE", 20 / 60))
+PERSISTENCE_INTERVAL = float(os.environ.get("PERSISTENCE_INTERVAL", 30))
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", 64))
+# Per-user flood limit: a burst of FLOOD_BURST updates, then FLOOD_RATE per second.
+FLOOD_RATE = float(os.environ.get("FLOOD_RATE", 1))
+FLOOD_BURST = int(os.environ.get("FLOOD_BURST", 8))
+FLOOD_MUTE_AFTER = int(os.environ.get("FLOOD_MUTE_AFTER", 10))
+FLOOD_MUTE_SECONDS = float(os.environ.get("FLOOD_MUTE_SECONDS", 300))
+FLOOD_DUPLICATE_WINDOW = float(os.environ.get("FLOOD_DUPLICATE_WINDOW", 5))
+# Users who stop at the order confirmation or the payment step are reminded after this
+# many seconds, 0 turns reminders off.
+REMINDER_DELAY = float(os.environ.get("REMINDER_DELAY", 3600))
+PENDING_PAGE_SIZE = int(os.environ.get("PENDING_PAGE_SIZE", 10))
+# Proof photos whose hashes differ in at most this many of 64 bits are flagged as the same screenshot.
+PROOF_HASH_DISTANCE = int(os.environ.get("PROOF_HASH_DISTANCE", 6))
+# Approved orders are placed on this SMM panel (API v2 URL) when set, see fulfillment.py.
+PANEL_URL = os.environ.get("PANEL_URL")
+PANEL_KEY = os.environ.get("PANEL_KEY", "")
+PANEL_CONNECTIONS = int(os.environ.get("PANEL_CONNECTIONS", 10))
+PANEL_POLL_INTERVAL = float(os.environ.get("PANEL_POLL_INTERVAL", 60))
+PANEL_MAX_ATTEMPTS = int(os.environ.get("PANEL_MAX_ATTEMPTS", 10))
+
+# Webhook mode is used when WEBHOOK_URL is set, otherwise the bot falls back to polling.
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("PORT", 8443))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+
+# With SHARD_WORKERS > 1 this process becomes a webhook ingress that routes updates by user
+# to SHARD_WORKERS worker processes (each started with its own SHARD_INDEX).
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", 1))
+SHARD_INDEX = os.environ.get("SHARD_INDEX")
+SHARD_BASE_PORT = int(os.environ.get("SHARD_BASE_PORT", 9100))
+WORKER_ID = int(SHARD_INDEX or 0)
+
+# Prometheus metrics are served on /metrics when METRICS_PORT is set (shard workers use
+# METRICS_PORT + SHARD_INDEX).
+METRICS_PORT = os.environ.get("METRICS_PORT")
+METRICS_LISTEN = os.environ.get("METRICS_LISTEN", "0.0.0.0")
 
 # --- Conversation States ---
 CHECKING_SUB, PLATFORM_MENU, SERVICE_MENU, PACKAGE_MENU, AWAITING_INPUT, CONFIRMATION, AWAITING_PROOF = range(7)
+STATE_NAMES = {CHECKING_SUB: "CHECKING_SUB", PLATFORM_MENU: "PLATFORM_MENU", SERVICE_MENU: "SERVICE_MENU",
+               PACKAGE_MENU: "PACKAGE_MENU", AWAITING_INPUT: "AWAITING_INPUT", CONFIRMATION: "CONFIRMATION",
+               AWAITING_PROOF: "AWAITING_PROOF"}
+
+# --- Static Keyboards ---
+# Price dependent keyboards live in the catalog (see catalog.json), these never change.
+CONFIRM_BUTTON = "✅ አረጋግጥ"
+CONFIRM_KEYBOARD = ReplyKeyboardMarkup([[KeyboardButton(CONFIRM_BUTTON), KeyboardButton(BACK_BUTTON)]],
+                                       resize_keyboard=True, one_time_keyboard=True)
+MENU_CONFIRM = "m:c"
+MENU_BACK_CONFIRM = "m:b:c"
+# Back ("m:b:<menu>") and exit ("m:x") lead to the previous menu, whichever one it is.
+MENU_BACK_PATTERN = f"^{MENU_PREFIX}:(b:|x$)"
+MENU_CHOICE_PATTERN = f"^{MENU_PREFIX}:[0-9a-f]{{6}}:"
+CONFIRM_INLINE_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton(CONFIRM_BUTTON, callback_data=MENU_CONFIRM),
+                                                 InlineKeyboardButton(BACK_BUTTON, callback_data=MENU_BACK_CONFIRM)]])
 
-# --- Button Texts ---
-BACK_BUTTON = "◀️ ተመለስ"
-MAIN_EXIT_BUTTON = "🏠 ዋና መውጫ"
-
-# --- Data (Prices and Packages) ---
-PRICES = {
-    "telegram": {
-        "members": {"500": 120, "1000": 250, "3000": 600, "5000": 1050, "10000": 1800, "20000": 4500},
-        "post view (1 last)": {"1000": 5, "5000": 25, "10000": 50, "50000": 100},
-        "post view (5 last)": {"1000": 15, "5000": 30, "10000": 70, "50000": 300},
-        "reaction (❤️)": {"500": 20, "1000": 40, "3000": 100, "5000": 150, "10000": 320},
-        "reaction (👍)": {"500": 20, "1000": 40, "3000": 100, "5000": 150, "10000": 320},
-        "reaction (🤣)": {"500": 25, "1000": 50, "3000": 120, "5000": 200, "10000": 400},
-    },
-    "tiktok": {
-        "followers": {"500": 240, "1000": 450, "3000": 1500, "5000": 2000, "10000": 5000},
-        "like": {"500": 70, "1000": 110, "3000": 170, "5000": 200, "10000": 270, "20000": 400},
-        "video view": {"500": 30, "1000": 70, "3000": 120, "5000": 150, "10000": 200, "20000": 300},
-    },
-    "instagram": {
-        "views": {"500": 40, "1000": 80, "3000": 120, "5000": 170, "10000": 220, "20000": 300, "40000": 500},
-        "like": {"500": 60, "1000": 110, "3000": 300, "5000": 500, "10000": 900, "20000": 1900},
-        "followers": {"500": 240, "1000": 450, "3000": 1500, "5000": 2000, "10000": 5000},
-    },
-    "youtube": {}
-}
+flood_guard = FloodGuard(FLOOD_RATE, FLOOD_BURST, FLOOD_MUTE_AFTER, FLOOD_MUTE_SECONDS, FLOOD_DUPLICATE_WINDOW)
+membership_cache = MembershipCache(MEMBER_CACHE_TTL, MEMBER_CACHE_NEGATIVE_TTL, MEMBER_CACHE_SIZE)
+store = OrderStore(DB_PATH, worker_id=WORKER_ID)
+# Telegram's limits are per bot, so workers split them. Users stick to one worker, but the
+# admin group is written to by all of them.
+# Telegram's limits are per bot, so shard workers split them.
+outbox = Outbox(store, global_rate=OUTBOX_GLOBAL_RATE / SHARD_WORKERS, chat_rate=OUTBOX_CHAT_RATE,
+                group_rate=OUTBOX_GROUP_RATE / SHARD_WORKERS, shard=WORKER_ID)
+broadcaster = Broadcaster(store, outbox)
+persistence = SQLitePersistence(store, update_interval=PERSISTENCE_INTERVAL)
+pending_queue = PendingQueue(store, page_size=PENDING_PAGE_SIZE)
+proof_index = ProofIndex(store, max_distance=PROOF_HASH_DISTANCE, shard=WORKER_ID)
+used_transactions = UsedTransactions(store)
+receipt_lookup = ReceiptLookup(TELEBIRR_RECEIPT_URL) if AUTO_APPROVE and TELEBIRR_RECEIPT_URL else None
+analytics = Analytics(store)
+stages = StageTracker(store, {STATE_NAMES[CONFIRMATION]: REMINDER_DELAY, STATE_NAMES[AWAITING_PROOF]: REMINDER_DELAY},
+                      shard=WORKER_ID)
+reviewer_pool = ReviewerPool(store, ADMIN_CHAT_IDS, timeout=REVIEW_TIMEOUT, shard=WORKER_ID)
+fulfillment = (Fulfillment(store, PanelClient(PANEL_URL, PANEL_KEY, PANEL_CONNECTIONS), poll_interval=PANEL_POLL_INTERVAL,
+                           max_attempts=PANEL_MAX_ATTEMPTS, shard=WORKER_ID) if PANEL_URL else None)
+background_tasks: list = []
+metrics_server = None
+
+metrics.REGISTRY.gauge("bot_outbox_depth", "Messages waiting in the outbox.", lambda: outbox.depth)
+metrics.REGISTRY.gauge("bot_outbox_sent_total", "Messages delivered by the outbox.", lambda: outbox.sent, "counter")
+metrics.REGISTRY.gauge("bot_outbox_failed_total", "Messages the outbox gave up on.", lambda: outbox.failed, "counter")
+metrics.REGISTRY.gauge("bot_membership_cache_size", "Entries in the membership cache.", lambda: len(membership_cache))
+metrics.REGISTRY.gauge("bot_membership_cache_hits_total", "Membership cache hits.", lambda: membership_cache.hits, "counter")
+metrics.REGISTRY.gauge("bot_membership_cache_misses_total", "Membership cache misses.", lambda: membership_cache.misses, "counter")
+metrics.REGISTRY.gauge("bot_flood_tracked_users", "Users with flood limiter state.", lambda: len(flood_guard))
+metrics.REGISTRY.gauge("bot_proof_index_size", "Distinct proof image hashes indexed.", lambda: len(proof_index))
+metrics.REGISTRY.gauge("bot_reminders_pending", "Reminders scheduled.", lambda: len(stages.timers))
+metrics.REGISTRY.gauge("bot_fulfillments_placing", "Orders being placed on the panel.",
+                       lambda: len(fulfillment) if fulfillment is not None else 0)
 
 # --- Error Handler ---
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -62,33 +177,188 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 
 # --- Helper Functions ---
 async def is_user_subscribed(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    cached = membership_cache.get(user_id)
+    if cached is not None:
+        return cached
     try:
         member = await context.bot.get_chat_member(chat_id=FORCE_SUB_CHANNEL, user_id=user_id)
-        return member.status in ['member', 'administrator', 'creator']
     except TelegramError:
+        # Don't cache API failures, the next check should ask Telegram again.
         return False
+    membership_cache.set_status(user_id, member.status)
+    return member.status in SUBSCRIBED_STATUSES
+
+async def duplicate_proof_note(photo, order_number: int, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> str:
+    """Hash the proof's smallest thumbnail and report earlier proofs that look the same."""
+    try:
+        file = await context.bot.get_file(photo.file_id)
+        image_hash = dhash(bytes(await file.download_as_bytearray()))
+    except (TelegramError, OSError) as exc:
+        # Not being able to check must not hold up the order.
+        logger.warning("Could not hash proof of order %s: %s", order_number, exc)
+        return ""
+    matches = proof_index.search(image_hash)
+    proof_index.add(image_hash, order_number, user_id)
+    if not matches:
+        return ""
+    seen = ", ".join(f"{format_order_id(order)} ({'ያው ተጠቃሚ' if match_user == user_id else f'ID: {match_user}'})"
+                     for _, order, match_user in matches[:3])
+    more = f" +{len(matches) - 3}" if len(matches) > 3 else ""
+    return f"\n⚠️ **ተመሳሳይ ስክሪንሾት ቀድሞ ተልኳል:** {seen}{more}"
+
+async def verify_text_proof(text: str, order_number: int, price, user) -> tuple[bool, str]:
+    """Check a pasted Telebirr SMS against the order. If it matches, and Telebirr's own receipt
+    for the transaction matches too, approve the order. Returns whether it was approved and a
+    note for the admin notification."""
+    receipt = parse_receipt(text)
+    if receipt is None:
+        return False, ""
+    ordered_at = order_id_time(order_number)
+    problems = check_receipt(receipt, price, TELEBIRR_NAME, TELEBIRR_PHONE, ordered_at)
+    # Only a paste that fits this order may use up the transaction id.
+    if not problems:
+        owner = await used_transactions.claim(receipt.txid, order_number, user.id)
+        if owner != order_number:
+            problems.append(f"already used for {format_order_id(owner)}")
+    if not problems and receipt_lookup is not None:
+        official = await receipt_lookup.fetch(receipt.txid)
+        if official is None:
+            problems.append("no Telebirr receipt")
+        else:
+            problems = check_receipt(official, price, TELEBIRR_NAME, TELEBIRR_PHONE, ordered_at)
+            if not problems:
+                order = {'id': order_number, 'user_id': user.id, 'username': user.username or user.first_name}
+                if await decide_order(order, STATUS_APPROVED, AUTO_DECIDER):
+                    return True, f"\n🤖 **Telebirr {receipt.txid} ተረጋግጦ በራስ-ሰር ጸድቋል።**"
+            problems = [f"receipt {problem}" for problem in problems]
+    checked = "✔" if receipt_lookup is not None else "✔ SMS only, not checked with Telebirr"
+    # The note goes out as HTML, and the problems quote the pasted text (e.g. the recipient name).
+    return False, (f"\n🧾 **Telebirr:** {receipt.txid} · {receipt.amount or '?'} ETB · "
+                   + (f"⚠️ {html.escape(', '.join(problems))}" if problems else checked))
+
+def is_admin_chat(chat_id: int) -> bool:
+    return str(chat_id) == str(ADMIN_CHAT_ID) or chat_id in ADMIN_CHAT_IDS
+
+async def reply(update: Update, text: str, **kwargs) -> Message:
+    """Send ``text`` to the update's chat through the outbox, ahead of admin and bulk sends and
+    within the same per-bot budget. Not persisted: a reply is only worth sending now."""
+    return await outbox.enqueue('send_message', update.effective_chat.id, PRIORITY_USER, persist=False,
+                                text=text, **kwargs)
+
+# --- Flood Control ---
+def admit_update(update: object) -> bool:
+    """Asked by the update processor before an update waits for anything; False drops the
+    update because its user is flooding."""
+    if not isinstance(update, Update) or not (update.message or update.callback_query) or not update.effective_user:
+        return True
+    if update.effective_chat and is_admin_chat(update.effective_chat.id):
+        return True
+    verdict = flood_guard.check(update.effective_user.id, fingerprint(update, catalog.current().menu_buttons))
+    if verdict is None:
+        return True
+    if verdict == MUTED_NOW:
+        minutes = max(1, int(FLOOD_MUTE_SECONDS // 60))
+        outbox.enqueue('send_message', update.effective_user.id, PRIORITY_USER, persist=False,
+                       text=f"⚠️ በጣም ብዙ መልዕክት ልከዋል። እባክዎ ለ {minutes} ደቂቃ ይጠብቁ።")
+    return False
+
+# --- Channel Membership Tracking ---
+async def track_channel_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Keep the membership cache warm from chat_member updates of the force-sub channel."""
+    chat_member = update.chat_member
+    if (chat_member.chat.username or '').lower() != FORCE_SUB_CHANNEL.lstrip('@').lower():
+        return
+    member = chat_member.new_chat_member
+    membership_cache.set_status(member.user.id, member.status)
+
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    stats = membership_cache.stats()
+    await reply(update, f"📊 Membership cache\n\n"
+                        f"Size: {stats['size']}\n"
+                        f"Hits: {stats['hits']}\n"
+                        f"Misses: {stats['misses']}\n"
+                        f"Hit ratio: {stats['hit_ratio']:.1%}")
+
+async def queue_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    stats = outbox.stats()
+    await reply(update, f"📤 Outbox\n\n"
+                        f"Queued: {stats['depth']} (in flight: {stats['in_flight']})\n"
+                        f"Sent: {stats['sent']} | Failed: {stats['failed']} | Retries: {stats['retries']}\n"
+                        f"Latency p50: {stats['latency_p50']:.2f}s | p95: {stats['latency_p95']:.2f}s | max: {stats['latency_max']:.2f}s")
+
+async def health(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    def summary(histogram, labels) -> str:
+        return (f"p50 {histogram.quantile(0.5, *labels) * 1000:.0f} | p95 {histogram.quantile(0.95, *labels) * 1000:.0f}"
+                f" | p99 {histogram.quantile(0.99, *labels) * 1000:.0f} ms (n={histogram.series[labels].count})")
+
+    uptime = int(time.time() - metrics.REGISTRY.started)
+    lines = [f"🩺 Health (worker {WORKER_ID}, up {uptime // 3600}h {uptime % 3600 // 60}m)", "", "Handlers:"]
+    for labels in sorted(metrics.HANDLER_LATENCY.series):
+        handler, state = labels
+        lines.append(f"• {handler}{f' [{state}]' if state else ''}: {summary(metrics.HANDLER_LATENCY, labels)}")
+    lines += ["", "Bot API:"]
+    for labels in sorted(metrics.API_LATENCY.series):
+        lines.append(f"• {labels[0]}: {summary(metrics.API_LATENCY, labels)}")
+    errors = sorted(metrics.HANDLER_ERRORS.values.items()) + sorted(metrics.API_ERRORS.values.items())
+    if errors:
+        lines += ["", "Errors:"] + [f"• {' / '.join(labels)}: {int(count)}" for labels, count in errors]
+    lines += ["", "Updates per state: " + ", ".join(f"{state[0]} {int(count)}"
+                                                   for state, count in sorted(metrics.STATE_UPDATES.values.items()))]
+    stats = membership_cache.stats()
+    lines.append(f"Membership cache hit ratio: {stats['hit_ratio']:.1%} | Outbox queued: {outbox.depth}")
+    await reply(update, "\n".join(lines))
 
 # --- Start & Main Menu ---
-async def start_bot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def show_menu(update: Update, text: str, keyboard, inline_keyboard, **kwargs) -> None:
+    """Edit the menu message in place if an inline menu button was pressed, otherwise send
+    ``text`` with the reply keyboard, or the inline one with INLINE_MENUS."""
+    query = update.callback_query
+    if query and query.data.startswith(f"{MENU_PREFIX}:"):
+        try:
+            # The answer only stops the button's spinner, so it does not have to go first.
+            await asyncio.gather(query.answer(), query.edit_message_text(text, reply_markup=inline_keyboard, **kwargs))
+        except BadRequest as exc:
+            # A button of the menu that is already showing.
+            if "not modified" not in str(exc):
+                raise
+        return
+    await reply(update, text, reply_markup=inline_keyboard if INLINE_MENUS else keyboard, **kwargs)
+
+async def show_notice(update: Update, text: str) -> None:
+    if update.callback_query:
+        await update.callback_query.answer(text, show_alert=True)
+    else:
+        await reply(update, text)
+
+async def stale_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Inline menu buttons the conversation has no handler for in its current state, e.g. an
+    old menu pressed while the order waits for its proof."""
+    await update.callback_query.answer("ይህ ምናሌ ጊዜው አልፎበታል።")
+
+async def start_bot(update: Update, context: ContextTypes.DEFAULT_TYPE, notice: str = "") -> int:
     context.user_data.clear()
-    keyboard = [
-        [KeyboardButton("🔵 Telegram"), KeyboardButton("⚫️ TikTok")],
-        [KeyboardButton("🔴 YouTube"), KeyboardButton("🟣 Instagram")]
-    ]
-    message = update.message or update.callback_query.message
-    await message.reply_text(
-        "👋 እንኳን በደህና መጡ!\n\nእባክዎ አገልግሎት የሚፈልጉበትን ፕላትፎርም ይምረጡ።",
-        reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    )
+    stages.enter(update.effective_user.id, STATE_NAMES[PLATFORM_MENU])
+    current = catalog.current()
+    text = "👋 እንኳን በደህና መጡ!\n\nእባክዎ አገልግሎት የሚፈልጉበትን ፕላትፎርም ይምረጡ።"
+    await show_menu(update, f"{notice}\n\n{text}" if notice else text, current.platform_keyboard,
+                    current.platform_inline_keyboard)
     return PLATFORM_MENU
     
 # --- Main Conversation Flow ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.effective_user
+    store.register_user(user.id, user.username, user.first_name)
+    analytics.step(update.effective_user.id, "START")
     if not await is_user_subscribed(user.id, context):
         keyboard = [[InlineKeyboardButton("✅ ቻናሉን ይቀላቀሉ", url=f"https://t.me/{FORCE_SUB_CHANNEL.lstrip('@')}")],
                     [InlineKeyboardButton("🔄 አረጋግጥ", callback_data="check_subscription")]]
-        await update.message.reply_text(
+        await reply(update, 
             f"👋 እንኳን በደህና መጡ {user.mention_html()}!\n\nቦቱን ለመጠቀም እባክዎ መጀመሪያ ቻናላችንን ይቀላቀሉ።",
             reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML'
         )
@@ -98,6 +368,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def check_subscription_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
+    # The user says they just joined, so never trust a cached "not subscribed" here.
+    membership_cache.invalidate(query.from_user.id)
     if await is_user_subscribed(query.from_user.id, context):
         await query.message.delete()
         return await start_bot(update, context)
@@ -106,374 +378,651 @@ async def check_subscription_callback(update: Update, context: ContextTypes.DEFA
         return CHECKING_SUB
 
 async def platform_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    platform = update.message.text.lower().replace('🔵 ', '').replace('⚫️ ', '').replace('🔴 ', '').replace('🟣 ', '')
-    
-    if platform == "youtube":
-        await update.message.reply_text("ይህ አገልግሎት በቅርቡ ይጀመራል። እባክዎ ሌላ ፕላትፎርም ይምረጡ።")
+    platform = catalog.current().platform_buttons.get(update.message.text)
+    if not platform:
         return PLATFORM_MENU
+    return await choose_platform(update, context, platform)
 
-    context.user_data['platform'] = platform
-    
-    keyboards = {
-        "telegram": [
-            [KeyboardButton("👍 Reaction"), KeyboardButton("🤣 reaction"), KeyboardButton("❤️ reaction")],
-            [KeyboardButton("👁 Post View"), KeyboardButton("👁 5 last Posts")],
-            [KeyboardButton("👥 members")],
-            [KeyboardButton(BACK_BUTTON), KeyboardButton(MAIN_EXIT_BUTTON)]
-        ],
-        "tiktok": [
-            [KeyboardButton("👥 Followers"), KeyboardButton("❤️ Likes")],
-            [KeyboardButton("👁 Video Views"), KeyboardButton(BACK_BUTTON), KeyboardButton(MAIN_EXIT_BUTTON)]
-        ],
-        "instagram": [
-            [KeyboardButton("👥 Followers"), KeyboardButton("❤️ Likes")],
-            [KeyboardButton("👁 Views"), KeyboardButton(BACK_BUTTON), KeyboardButton(MAIN_EXIT_BUTTON)]
-        ],
-    }
-    keyboard = keyboards.get(platform)
-        
-    await update.message.reply_text(f"✨ {platform.title()}\n\nአሁን የሚፈልጉትን አገልግሎት ይምረጡ።",
-                                     reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
+async def choose_platform(update: Update, context: ContextTypes.DEFAULT_TYPE, platform) -> int:
+    if not platform.services:
+        await show_notice(update, "ይህ አገልግሎት በቅርቡ ይጀመራል። እባክዎ ሌላ ፕላትፎርም ይምረጡ።")
+        return PLATFORM_MENU
+
+    context.user_data['platform'] = platform.key
+    analytics.step(update.effective_user.id, STATE_NAMES[PLATFORM_MENU])
+    stages.enter(update.effective_user.id, STATE_NAMES[SERVICE_MENU])
+    await show_menu(update, f"✨ {platform.title}\n\nአሁን የሚፈልጉትን አገልግሎት ይምረጡ።", platform.keyboard,
+                    platform.inline_keyboard)
     return SERVICE_MENU
 
 async def service_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    service_text = update.message.text
-    normalized_text = service_text.lower()
-    
-    service_map = {
-        # Telegram
-        "👍 reaction": "reaction (👍)", "🤣 reaction": "reaction (🤣)", "❤️ reaction": "reaction (❤️)",
-        "👁 post view": "post view (1 last)", "👁 5 last posts": "post view (5 last)", "👥 members": "members",
-        # Instagram & TikTok
-        "👥 followers": "followers", "❤️ likes": "like",
-        "👁 views": "views", # Instagram specific
-        "👁 video views": "video view", # TikTok specific
-    }
-    
-    service = service_map.get(normalized_text)
+    platform = context.user_data['platform']
+    service = catalog.current().service_buttons.get((platform, update.message.text.lower()))
 
     if not service:
-        await update.message.reply_text("የተሳሳተ ምርጫ። እባክዎ እንደገና ይሞክሩ።")
+        await reply(update, "የተሳሳተ ምርጫ። እባክዎ እንደገና ይሞክሩ።")
         return SERVICE_MENU
-        
-    context.user_data['service'] = service
-    context.user_data['service_text'] = service_text
-    platform = context.user_data['platform']
-    package_prices = PRICES.get(platform, {}).get(service, {})
-    
-    if not package_prices:
-        await update.message.reply_text("ይቅርታ, ለዚህ አገልግሎት ፓኬጆች በቅርቡ ይዘጋጃሉ።")
+    return await choose_service(update, context, service)
+
+async def choose_service(update: Update, context: ContextTypes.DEFAULT_TYPE, service) -> int:
+    if not service.packages:
+        await show_notice(update, "ይቅርታ, ለዚህ አገልግሎት ፓኬጆች በቅርቡ ይዘጋጃሉ።")
         return SERVICE_MENU
-    
-    unit = "Items" # Default
-    if "reaction" in service: unit = "Reactions"
-    elif "view" in service: unit = "Views"
-    elif service in ["members", "followers"]: unit = service.title()
-    elif service == "like": unit = "Likes"
-
-    keyboard = [[KeyboardButton(f"{amount} {unit} | {price} ETB")] for amount, price in package_prices.items()]
-    keyboard.append([KeyboardButton(BACK_BUTTON)])
-    await update.message.reply_text(f"💖 {service_text}\n\nየሚፈልጉትን ፓኬጅ ይምረጡ:",
-                                     reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True))
+
+    context.user_data['platform'] = service.platform
+    context.user_data['service'] = service.key
+    context.user_data['service_text'] = service.button
+    analytics.step(update.effective_user.id, STATE_NAMES[SERVICE_MENU])
+    stages.enter(update.effective_user.id, STATE_NAMES[PACKAGE_MENU])
+    await show_menu(update, f"💖 {service.button}\n\nየሚፈልጉትን ፓኬጅ ይምረጡ:", service.keyboard, service.inline_keyboard)
     return PACKAGE_MENU
 
 async def package_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    try:
-        parts = update.message.text.split(' ')
-        amount = parts[0]
-        service = context.user_data['service']
-        platform = context.user_data['platform']
-        if amount not in PRICES[platform][service]:
-            raise ValueError("Invalid package selected")
-        context.user_data['amount'] = amount
-    except (IndexError, ValueError):
-        await update.message.reply_text("⚠️ የተሳሳተ ምርጫ። እባክዎ ከታች ካሉት ቁልፎች አንዱን ይምረጡ።")
+    current = catalog.current()
+    platform = context.user_data['platform']
+    service = context.user_data['service']
+    package = current.package_buttons.get((platform, service, update.message.text))
+    if not package:
+        await reply(update, "⚠️ የተሳሳተ ምርጫ። እባክዎ ከታች ካሉት ቁልፎች አንዱን ይምረጡ።")
         return PACKAGE_MENU
+    return await choose_package(update, context, package)
 
-    # --- Custom Prompts Logic ---
-    prompt = ""
-    example = ""
-    service_text = context.user_data.get('service_text', 'Items')
+async def choose_package(update: Update, context: ContextTypes.DEFAULT_TYPE, package) -> int:
+    service = catalog.current().service(package.platform, package.service)
+    context.user_data['platform'] = package.platform
+    context.user_data['service'] = package.service
+    context.user_data['service_text'] = service.button
+    context.user_data['amount'] = package.amount
+    analytics.step(update.effective_user.id, STATE_NAMES[PACKAGE_MENU])
+    return await send_input_prompt(update, service)
 
-    if platform == "telegram":
-        if service == "members":
-            prompt = "🔗 Public የሆነ የቻናል ሊንክ ይላኩ"
-            example = "ለምሳሌ:- https://t.me/skyFounders"
-        else:
-            prompt = f"🔗 {service_text} የሚጨመርበትን የTelegram Post link ያስገቡ❓"
-            example = "ለምሳሌ: https://t.me/channel_name/123"
-    elif platform == "tiktok":
-        if service == "followers":
-            prompt = "🔗 👥 Followers የሚጨመርበትን የ Tiktok Account username ያስገቡ❓"
-            example = "ለምሳሌ: @username"
-        elif service == "like":
-            prompt = "🔗 የ Tik Tok like የሚጨመርበትን የvideo link ያስገቡ❓"
-            example = "ለምሳሌ: https://vm.tiktok.com/..."
-        elif service == "video view":
-            prompt = "🔗 የTik Tok View የሚጨመርበትን የvideo link ያስገቡ❓"
-            example = "ለምሳሌ: https://vm.tiktok.com/..."
-    elif platform == "instagram":
-        if service == "followers":
-            prompt = "🔗 👥 Followers የሚጨመርበትን የ Instagram Account username ያስገቡ❓"
-            example = "ለምሳሌ: @username"
-        elif service == "like":
-            prompt = "🔗 የinstagram like የሚጨመርበትን የvideo link ያስገቡ❓"
-            example = "ለምሳሌ: https://www.instagram.com/p/..."
-        elif service == "views":
-            prompt = "🔗 የinstagram View የሚጨመርበትን የvideo link ያስገቡ❓"
-            example = "ለምሳሌ: https://www.instagram.com/p/..."
-    
-    await update.message.reply_text(f"{prompt}\n\n{example}", reply_markup=ReplyKeyboardMarkup([[KeyboardButton(BACK_BUTTON)]], resize_keyboard=True))
+async def menu_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Platform, service and package buttons of the inline menus."""
+    entry = catalog.current().menu_entry(update.callback_query.data)
+    if entry is None:
+        # A button from before a catalog reload, what it pointed at may be gone. Start over.
+        return await start_bot(update, context)
+    if isinstance(entry, Platform):
+        return await choose_platform(update, context, entry)
+    if isinstance(entry, Service):
+        return await choose_service(update, context, entry)
+    return await choose_package(update, context, entry)
+
+async def send_input_prompt(update: Update, service) -> int:
+    stages.enter(update.effective_user.id, STATE_NAMES[AWAITING_INPUT])
+    current = catalog.current()
+    await show_menu(update, f"{service.prompt}\n\n{service.example}", current.prompt_keyboard,
+                    current.prompt_inline_keyboard)
     return AWAITING_INPUT
 
 async def awaiting_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_input = update.message.text
-    platform = context.user_data['platform']
-    service = context.user_data['service']
-    
-    error_message = ""
-
-    # --- Validation Logic ---
-    if platform == 'telegram':
-        if not user_input.startswith(('http://t.me/', 'https://t.me/')):
-            error_message = "⚠️ ትክክለኛ የቴሌግራም ሊንክ አላስገቡም። ሊንኩ በ https://t.me/ መጀመር አለበት።\n\nእባክዎ እንደገና ይሞክሩ።"
-    
-    elif platform == 'tiktok':
-        if service == 'followers':
-            if not user_input.startswith('@'):
-                error_message = "⚠️ ትክክለኛ Username አላስገቡም። Username በ @ መጀመር አለበት።\n\nእባክዎ እንደገና ይሞክሩ።"
-        elif service in ['like', 'video view']:
-            if not user_input.startswith(('https://www.tiktok.com/', 'https://vm.tiktok.com/')):
-                error_message = "⚠️ ትክክለኛ የTikTok ሊንክ አላስገቡም። ሊንኩ በ https://vm.tiktok.com/ ወይም https://www.tiktok.com/ መጀመር አለበት።\n\nእባክዎ እንደገና ይሞክሩ።"
-
-    elif platform == 'instagram':
-        if service == 'followers':
-            if not user_input.startswith('@'):
-                error_message = "⚠️ ትክክለኛ Username አላስገቡም። Username በ @ መጀመር አለበት።\n\nእባክዎ እንደገና ይሞክሩ።"
-        elif service in ['like', 'views']:
-            if not user_input.startswith('https://www.instagram.com/'):
-                error_message = "⚠️ ትክክለኛ የInstagram ሊንክ አላስገቡም። ሊንኩ በ https://www.instagram.com/ መጀመር አለበት።\n\nእባክዎ እንደገና ይሞክሩ።"
+    platform_key = context.user_data['platform']
+    current = catalog.current()
+    platform = current.platforms.get(platform_key)
+    service = current.service(platform_key, context.user_data['service'])
+    if not service:
+        # The service was removed from the catalog while the user was ordering.
+        return await start_bot(update, context)
 
+    error_message = service.validate_input(user_input)
     if error_message:
-        await update.message.reply_text(error_message)
+        await reply(update, error_message)
         return AWAITING_INPUT
 
     # --- If valid, continue ---
     context.user_data['user_input'] = user_input
+    analytics.step(update.effective_user.id, STATE_NAMES[AWAITING_INPUT])
+    stages.enter(update.effective_user.id, STATE_NAMES[CONFIRMATION])
     amount = context.user_data['amount']
-    price = PRICES[platform][service][amount]
-    service_text = context.user_data.get('service_text', service.title())
-    
-    input_type = "Post ሊንክ" if service != 'followers' else "Account"
-    if platform == 'telegram' and service == 'members': input_type = "ቻናል ሊንክ"
+    price = current.price(platform_key, service.key, amount)
+    service_text = context.user_data.get('service_text', service.button)
 
-    confirmation_text = (f"🔵 {platform.title()} | {service_text}\n\n"
+    confirmation_text = (f"🔵 {platform.title} | {service_text}\n\n"
                          f"👤 መጠን: {amount}\n"
-                         f"🔗 {input_type}: {user_input}\n"
+                         f"🔗 {service.input_type}: {user_input}\n"
                          f"💸 ጠቅላላ ክፍያ: {price} ETB\n\n"
                          f"♻️ ለመቀጠል ከፈለጉ ❮ ✅ አረጋግጥ ❯ የሚለውን በተን ይንኩ")
-    keyboard = [[KeyboardButton("✅ አረጋግጥ"), KeyboardButton(BACK_BUTTON)]]
-    await update.message.reply_text(confirmation_text, reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True))
+    await show_menu(update, confirmation_text, CONFIRM_KEYBOARD, CONFIRM_INLINE_KEYBOARD)
     return CONFIRMATION
 
 async def confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    price = PRICES[context.user_data['platform']][context.user_data['service']][context.user_data['amount']]
+    user = update.effective_user
+    platform = context.user_data['platform']
+    service = context.user_data['service']
+    amount = context.user_data['amount']
+    price = catalog.current().price(platform, service, amount)
+    context.user_data['order_id'] = store.create_order(user.id, user.username or user.first_name, platform, service,
+                                                       amount, price, context.user_data.get('user_input'))
+    analytics.step(update.effective_user.id, STATE_NAMES[CONFIRMATION])
+    stages.enter(user.id, STATE_NAMES[AWAITING_PROOF], context.user_data['order_id'])
     payment_info = (f"🏦 **የባንክ መረጃዎች**\n\n"
                     f"- **የባንክ ስም:** Telebirr\n"
-                    f"- **ስልክ ቁጥር:** 0915243897\n"
-                    f"- **የአካውንት ስም:** Mohammed\n\n"
+                    f"- **ስልክ ቁጥር:** {TELEBIRR_PHONE}\n"
+                    f"- **የአካውንት ስም:** {TELEBIRR_NAME}\n\n"
                     f"💰 **የሚከፍሉት የብር መጠን: {price} ETB**\n\n"
                     f"🧾 የክፍያ ማረጋገጫ የላኩበትን Screenshot ወይም የትራንዛክሽን መረጃ እዚህ ጋር ይላኩ።")
-    await update.message.reply_text(payment_info, parse_mode='Markdown', reply_markup=ReplyKeyboardRemove())
+    await show_menu(update, payment_info, ReplyKeyboardRemove(), None, parse_mode='Markdown')
     return AWAITING_PROOF
 
 async def awaiting_proof(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.effective_user
-    order_id = f"#ID{random.randint(10000, 99999)}"
+    order_number = context.user_data.get('order_id')
+    if order_number is None:
+        # Conversation started before the order store existed, record it now.
+        order_number = store.create_order(user.id, user.username or user.first_name,
+                                          context.user_data.get('platform', 'N/A'), context.user_data.get('service', 'N/A'),
+                                          context.user_data.get('amount', 'N/A'), None, context.user_data.get('user_input'))
+    if update.message.photo:
+        store.submit_proof(order_number, 'photo', update.message.photo[-1].file_id)
+    else:
+        store.submit_proof(order_number, 'text', update.message.text)
+    order_id = format_order_id(order_number)
+    analytics.step(update.effective_user.id, STATE_NAMES[AWAITING_PROOF])
     
     user_message = (f"✅ትዕዛዝዎ ተልዕኮል\n\n"
                     f"🆔የትዕዛዝ ቁጥር: {order_id}\n"
                     f"📯የትዕዛዝ ሁኔታ: ⏳በሂደት ላይ\n\n"
                     f"❗️ትዕዛዝዎ እንደተጠናቀቀ የማረጋገጫ መልዕክት ይደርሶታል")
-    await update.message.reply_text(user_message)
+    if not INLINE_MENUS:
+        await reply(update, user_message)
     
     platform = context.user_data.get('platform', 'N/A')
     service = context.user_data.get('service', 'N/A')
     service_text = context.user_data.get('service_text', service.title())
     amount = context.user_data.get('amount', 'N/A')
-    price = PRICES.get(platform, {}).get(service, {}).get(amount, 'N/A')
+    # The price the user confirmed; the catalog may have been edited since.
+    order = await store.get_order(order_number)
+    price = order['price'] if order else None
     user_input = context.user_data.get('user_input', 'N/A')
+    if update.message.photo:
+        auto_approved = False
+        proof_note = await duplicate_proof_note(update.message.photo[0], order_number, user.id, context)
+    else:
+        auto_approved, proof_note = await verify_text_proof(update.message.text, order_number, price, user)
     
     admin_notification = (f"🔔 **አዲስ የክፍያ ማረጋገጫ** 🔔\n\n"
                           f"👤 **ከ:** {user.mention_html()} (ID: `{user.id}`)\n"
                           f"🆔 **የትዕዛዝ ቁጥር:** {order_id}\n"
                           f"--- ትዕዛዝ --- \n"
-                          f"📱 **አገልግሎት:** {platform.title()} - {service_text}\n"
-                          f"🔢 **መጠን:** {amount}\n"
-                          f"🔗 **ሊንክ/Username:** `{user_input}`\n"
-                          f"💵 **ክፍያ:** {price} ETB")
+                          f"📱 **አገልግሎት:** {html.escape(platform.title())} - {html.escape(service_text)}\n"
+                          f"🔢 **መጠን:** {html.escape(str(amount))}\n"
+                          f"🔗 **ሊንክ/Username:** `{html.escape(str(user_input))}`\n"
+                          f"💵 **ክፍያ:** {price or 'N/A'} ETB"
+                          f"{proof_note}")
 
-    keyboard = [[InlineKeyboardButton("✅ ክፍያ ተረጋግጧል", callback_data=f"approve_{user.id}_{order_id}")],
-                [InlineKeyboardButton("🚫 ክፍያ አልተፈጸመም", callback_data=f"reject_{user.id}_{order_id}_{user.username or user.first_name}")]]
-    
-    await context.bot.forward_message(chat_id=ADMIN_CHAT_ID, from_chat_id=user.id, message_id=update.message.message_id)
-    await context.bot.send_message(chat_id=ADMIN_CHAT_ID, text=admin_notification, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+    if auto_approved:
+        # Nothing to decide, the main admin chat just gets to see it.
+        outbox.enqueue('forward_message', ADMIN_CHAT_ID, PRIORITY_ADMIN, from_chat_id=user.id, message_id=update.message.message_id)
+        outbox.enqueue('send_message', ADMIN_CHAT_ID, PRIORITY_ADMIN, text=admin_notification, parse_mode='HTML')
+    else:
+        reviewer = reviewer_pool.assign(order_number)
+        outbox.enqueue('forward_message', reviewer, PRIORITY_ADMIN, from_chat_id=user.id, message_id=update.message.message_id)
+        outbox_id = store.ids.next()
+        reviewer_pool.track(order_number, outbox_id, outbox.enqueue(
+            'send_message', reviewer, PRIORITY_ADMIN, item_id=outbox_id, text=admin_notification,
+            reply_markup=decision_keyboard(order_number), parse_mode='HTML'))
     
-    await start_bot(update, context)
+    # Inline menus carry the receipt in the next menu's message rather than one of its own.
+    await start_bot(update, context, notice=user_message if INLINE_MENUS else "")
     return PLATFORM_MENU # Important: Return to a state in the conversation
 
-async def admin_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer("ውሳኔዎ ተመዝግቧል።")
-    
-    action, user_id, order_id, *rest = query.data.split('_')
-    user_id = int(user_id)
-    username = rest[0] if rest else "User"
+# --- Reminders ---
+async def send_reminder(user_id: int, stage: str, order_number) -> None:
+    # Bulk priority: a nudge must never hold up a reply to someone who is active.
+    if stage == STATE_NAMES[CONFIRMATION]:
+        keyboard = CONFIRM_INLINE_KEYBOARD if INLINE_MENUS else CONFIRM_KEYBOARD
+        outbox.enqueue('send_message', user_id, PRIORITY_BULK, reply_markup=keyboard,
+                       text="⏰ ትዕዛዝዎን ገና አላረጋገጡም።\n\n♻️ ለመቀጠል ❮ ✅ አረጋግጥ ❯ የሚለውን በተን ይንኩ")
+    elif stage == STATE_NAMES[AWAITING_PROOF]:
+        order_id = f" {format_order_id(order_number)}" if order_number else ""
+        outbox.enqueue('send_message', user_id, PRIORITY_BULK,
+                       text=f"⏰ የትዕዛዝ{order_id} የክፍያ ማረጋገጫ ገና አልደረሰንም።\n\n"
+                            f"🧾 ክፍያ ከፈጸሙ Screenshot ወይም የትራንዛክሽን መረጃውን እዚህ ጋር ይላኩ።")
 
-    if action == "approve":
+# --- Admin Decisions ---
+DECISION_NOTES = {STATUS_APPROVED: "✅ ትዕዛዝ {} ጸድቋል።", STATUS_REJECTED: "🚫 ትዕዛዝ {} ውድቅ ተደርጓል።"}
+# decided_by of orders approved by verify_text_proof.
+AUTO_DECIDER = 0
+
+def decision_keyboard(order_number: int) -> InlineKeyboardMarkup:
+    # Only the order id travels in the button, everything else is read back from the store.
+    token = to_base36(order_number)
+    return InlineKeyboardMarkup([[InlineKeyboardButton("✅ ክፍያ ተረጋግጧል", callback_data=f"o:a:{token}")],
+                                 [InlineKeyboardButton("🚫 ክፍያ አልተፈጸመም", callback_data=f"o:r:{token}")]])
+
+def notify_decision(user_id: int, order_id: str, status: str, username: str, fulfilling: bool = False) -> None:
+    if status == STATUS_APPROVED and fulfilling:
+        message_to_user = (f"✅ ክፍያዎ ተረጋግጧል!\n\n"
+                           f"የትዕዛዝ ቁጥር ({order_id}) በሂደት ላይ ነው። ሲጠናቀቅ መልዕክት ይደርሶታል።")
+    elif status == STATUS_APPROVED:
         message_to_user = f"🎉 እንኳን ደስ አለዎት!\n\nየትዕዛዝ ቁጥር ({order_id}) በተሳካ ሁኔታ ተጠናቋል!"
-        await context.bot.send_message(chat_id=user_id, text=message_to_user)
-        await query.edit_message_text(text=f"{query.message.text}\n\n--- \n✅ ትዕዛዝ {order_id} ጸድቋል።")
-    elif action == "reject":
+    else:
         message_to_user = (f"👤 ውድ @{username}\n\n"
                            f"⚠️ባስገቡት የክፍያ ማረጋገጫ ምንም አይነት ክፍያ ስላልተፈጸመ order Id:- {order_id}\n\n"
                            f"🚫Cancel ተደርጓል እባክዎ እንደገና በትክክል ትዕዛዝ ይስጡ!")
-        await context.bot.send_message(chat_id=user_id, text=message_to_user)
-        await query.edit_message_text(text=f"{query.message.text}\n\n--- \n🚫 ትዕዛዝ {order_id} ውድቅ ተደርጓል።")
+    outbox.enqueue('send_message', user_id, PRIORITY_USER, text=message_to_user)
+
+async def decide_order(order, status: str, decided_by: int) -> bool:
+    """Record the decision and tell the user. False if the order was already decided."""
+    # Only the first decision moves the order out of proof_submitted, so two reviewers
+    # pressing at once can't both approve it.
+    if not await store.decide(order['id'], status, decided_by):
+        return False
+    await reviewer_pool.decided(order['id'])
+    # Callers may only have the id and user, the rollups and the panel need the whole order.
+    order = await store.get_order(order['id'])
+    analytics.record_decision(order, status)
+    fulfilling = status == STATUS_APPROVED and await fulfill(order)
+    notify_decision(order['user_id'], format_order_id(order['id']), status, order['username'], fulfilling)
+    return True
+
+async def fulfill(order) -> bool:
+    """Hand an approved order to the panel. False if it has to be placed by hand."""
+    if fulfillment is None:
+        return False
+    service = catalog.current().service(order['platform'], order['service'])
+    if service is None or service.panel_service is None or not order['amount'].isdigit() or not order['user_input']:
+        return False
+    await fulfillment.submit(order['id'], order['user_id'], service.panel_service, order['user_input'], int(order['amount']))
+    return True
+
+async def notify_fulfillment(row: dict) -> None:
+    order_id = format_order_id(row['order_id'])
+    if row['status'] == COMPLETED:
+        outbox.enqueue('send_message', row['user_id'], PRIORITY_USER,
+                       text=f"🎉 እንኳን ደስ አለዎት!\n\nየትዕዛዝ ቁጥር ({order_id}) በተሳካ ሁኔታ ተጠናቋል!")
+        return
+    if row['status'] == UNKNOWN:
+        # It may be on its way, so the user hears nothing until an admin has checked.
+        outbox.enqueue('send_message', ADMIN_CHAT_ID, PRIORITY_ADMIN,
+                       text=f"🛒 Panel: order {order_id} was sent but the panel did not answer ({row['error']}). "
+                            f"Check on the panel whether it was placed before placing it again. Link: {row['link']}.")
+        return
+    if row['status'] == PARTIAL:
+        user_text = f"⚠️ የትዕዛዝ ቁጥር ({order_id}) በከፊል ተጠናቋል። ቀሪው {row['remains']} በቅርቡ ይስተካከላል።"
+    else:
+        user_text = f"⚠️ የትዕዛዝ ቁጥር ({order_id}) አልተጠናቀቀም። በቅርቡ እናስተካክለዋለን።"
+    outbox.enqueue('send_message', row['user_id'], PRIORITY_USER, text=user_text)
+    detail = f"{row['remains']} of {row['quantity']} not delivered" if row['status'] == PARTIAL else row['error'] or ""
+    outbox.enqueue('send_message', ADMIN_CHAT_ID, PRIORITY_ADMIN,
+                   text=f"🛒 Panel: order {order_id} {row['status']}{f' ({detail})' if detail else ''}. "
+                        f"Link: {row['link']}. Please handle it by hand.")
+
+async def admin_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    # The callback data is only the order number, which the buyer has on their receipt.
+    if not is_admin_chat(query.message.chat.id):
+        await query.answer()
+        return
+    await query.answer("ውሳኔዎ ተመዝግቧል።")
+
+    if query.data.startswith('o:'):
+        _, action, token = query.data.split(':')
+        order = await store.get_order(int(token, 36))
+        if order is None:
+            return
+        status = STATUS_APPROVED if action == 'a' else STATUS_REJECTED
+        order_id = format_order_id(order['id'])
+        decided = await decide_order(order, status, query.from_user.id)
+    else:
+        # Buttons sent before compact callback data carry the user and username themselves.
+        action, user_id, order_id, *rest = query.data.split('_')
+        status = STATUS_APPROVED if action == "approve" else STATUS_REJECTED
+        order_number = parse_order_id(order_id)
+        order = await store.get_order(order_number) if order_number is not None else None
+        if order is not None:
+            decided = await decide_order(order, status, query.from_user.id)
+        else:
+            # Orders from before the store was introduced have no row; handle those from the message alone.
+            notify_decision(int(user_id), order_id, status, rest[0] if rest else "User")
+            decided = True
+
+    if not decided:
+        order = await store.get_order(order['id'])
+        await append_note(query, f"ℹ️ ትዕዛዝ {order_id} ቀድሞ ተወስኗል ({order['status']})።")
+        return
+    await append_note(query, DECISION_NOTES[status].format(order_id))
+
+async def append_note(query, note: str) -> None:
+    # Proofs re-sent from /pending are photos, whose text is a caption.
+    if query.message.text is not None:
+        await query.edit_message_text(text=f"{query.message.text}\n\n--- \n{note}")
+    else:
+        await query.edit_message_caption(caption=f"{query.message.caption or ''}\n\n--- \n{note}")
+
+async def pending_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    text, markup = render_view(await pending_queue.open())
+    await reply(update, text, reply_markup=markup)
+
+async def pending_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    if not is_admin_chat(query.message.chat.id):
+        await query.answer()
+        return
+    _, token, action = query.data.split(':')
+    view = await pending_queue.get(int(token, 36))
+    if view is None:
+        await query.answer("ይህ ገጽ ጊዜው አልፎበታል፤ /pending ይላኩ።", show_alert=True)
+        return
+
+    note, confirm = "", None
+    if action == 'n':
+        view = await pending_queue.next(view)
+    elif action == 'p':
+        view = await pending_queue.previous(view)
+    elif action in ('A', 'R'):
+        confirm = action
+    elif action[0] in 'var' and action[1:].isdigit():
+        index = int(action[1:]) - 1
+        if not 0 <= index < len(view.orders):
+            await query.answer()
+            return
+        order = view.orders[index]
+        if action[0] == 'v':
+            await query.answer()
+            send_proof(query.message.chat.id, order)
+            return
+        status = STATUS_APPROVED if action[0] == 'a' else STATUS_REJECTED
+        decided = await decide_order(order, status, query.from_user.id)
+        note = DECISION_NOTES[status].format(format_order_id(order['id'])) if decided else \
+            f"ℹ️ ትዕዛዝ {format_order_id(order['id'])} ቀድሞ ተወስኗል።"
+    elif action in ('A!', 'R!'):
+        status = STATUS_APPROVED if action == 'A!' else STATUS_REJECTED
+        # All decisions are queued at once and land in one store commit; the user
+        # notifications fan out through the outbox.
+        results = await asyncio.gather(*(decide_order(order, status, query.from_user.id) for order in view.orders
+                                         if order['status'] == STATUS_PROOF_SUBMITTED))
+        skipped = len(view.orders) - sum(results)
+        note = (f"{'✅' if status == STATUS_APPROVED else '🚫'} {sum(results)} {status}"
+                + (f", {skipped} already decided" if skipped else ""))
+
+    if confirm is None:
+        view = await pending_queue.refresh(view)
+    await query.answer()
+    text, markup = render_view(view, note, confirm)
+    try:
+        await query.edit_message_text(text, reply_markup=markup)
+    except BadRequest as exc:
+        # Refreshing a page that did not change.
+        if "not modified" not in exc.message:
+            raise
+
+async def reassign_reviews(interval: float) -> None:
+    """Move proofs nobody decided within REVIEW_TIMEOUT to another reviewer."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            moved = await reviewer_pool.reassign_due()
+        except Exception:
+            logger.exception("Reassigning reviews failed.")
+            continue
+        for order in moved:
+            logger.info("Reassigning order %s from %s to %s.", order['id'], order['reviewer'], order['new_reviewer'])
+            if order['message_id']:
+                outbox.enqueue('edit_message_reply_markup', order['reviewer'], PRIORITY_ADMIN, persist=False,
+                               message_id=order['message_id'], reply_markup=None)
+            outbox_id = store.ids.next()
+            reviewer_pool.track(order['id'], outbox_id, send_proof(order['new_reviewer'], order, outbox_id))
+
+async def reviewers_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    lines = ["👥 Reviewers (last 24h)", ""]
+    for row in await reviewer_pool.report(time.time() - 86400):
+        lines.append(f"• {row['reviewer']}: open {row['open']} | decided {row['decided']}"
+                     f" | p50 {row['p50'] / 60:.1f}m | p95 {row['p95'] / 60:.1f}m"
+                     + (f" | {row['reassigned']} reassigned to them" if row['reassigned'] else ""))
+    await reply(update, "\n".join(lines))
+
+def send_proof(chat_id: int, order, outbox_id: Optional[int] = None) -> asyncio.Future:
+    # Reassigned proofs are persisted under ``outbox_id`` so a restart neither loses nor
+    # forgets them; one opened from /pending is only worth sending while the admin waits.
+    persist = outbox_id is not None
+    caption = (f"🆔 {format_order_id(order['id'])} · {order['platform']}/{order['service']} {order['amount']}"
+               f" · {order['price'] or 'N/A'} ETB · {order['username']}\n🔗 {order['user_input']}")
+    if order['proof_type'] == 'photo':
+        return outbox.enqueue('send_photo', chat_id, PRIORITY_ADMIN, persist=persist, item_id=outbox_id, photo=order['proof'],
+                              caption=caption, reply_markup=decision_keyboard(order['id']))
+    return outbox.enqueue('send_message', chat_id, PRIORITY_ADMIN, persist=persist, item_id=outbox_id,
+                          text=f"{caption}\n\n🧾 {order['proof'] or 'N/A'}", reply_markup=decision_keyboard(order['id']))
+
+# --- Admin Commands ---
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    message = update.message
+    if message.reply_to_message:
+        # Replying to a message with /broadcast copies it as is, media included.
+        broadcast_id = await broadcaster.start(message.chat_id, from_chat_id=message.chat_id,
+                                               message_id=message.reply_to_message.message_id)
+    elif context.args:
+        broadcast_id = await broadcaster.start(message.chat_id, text=message.text.split(maxsplit=1)[1])
+    else:
+        await reply(update, "አጠቃቀም: /broadcast <መልዕክት> ወይም ለመላክ የሚፈልጉትን መልዕክት በ /broadcast reply ያድርጉ።")
+        return
+    await reply(update, f"📣 Broadcast {broadcast_id} ተጀምሯል።")
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/stats [days] for totals, /stats csv [days] for the daily rollup as a file."""
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    args = list(context.args)
+    export = bool(args) and args[0].lower() == 'csv'
+    if export:
+        args.pop(0)
+    days = int(args[0]) if args and args[0].isdigit() else 7
+    since = day_of(time.time() - (days - 1) * 86400)
+
+    if export:
+        with await analytics.export_csv(since) as f:
+            await update.message.reply_document(f, filename=f"sales_{since}_{day_of(time.time())}.csv")
+        return
+
+    summary = await analytics.summary(since)
+    decided = summary['approved'] + summary['rejected']
+    lines = [f"📈 Sales, last {days} days (since {since})", "",
+             f"Approved: {summary['approved']} | Rejected: {summary['rejected']}"
+             f" ({summary['rejected'] / decided if decided else 0:.1%})",
+             f"Revenue: {summary['revenue']:,} ETB | today: {summary['revenue_today']:,} ETB", "", "By platform:"]
+    for platform, totals in sorted(summary['platforms'].items(), key=lambda item: -item[1]['revenue']):
+        lines.append(f"• {platform}: {totals['approved']} orders · {totals['revenue']:,} ETB")
+    lines += ["", "Top packages:"]
+    for row in summary['packages'][:5]:
+        lines.append(f"• {row['platform']}/{row['service']} {row['amount']}: {row['approved']} · {row['revenue']:,} ETB")
+    lines += ["", "Funnel (users past each step, once a day each):"]
+    first = summary['funnel'][0][1]
+    for step, count in summary['funnel']:
+        lines.append(f"• {step}: {count}" + (f" ({count / first:.0%})" if first else ""))
+    proofs = summary['funnel'][-1][1]
+    lines.append(f"• approved: {summary['approved']}" + (f" ({summary['approved'] / proofs:.0%} of proofs)" if proofs else ""))
+    # Everyone who finishes is back at the platform menu, so that stage says nothing about drop-off.
+    stuck = await stages.stuck(3600)
+    stuck.pop(STATE_NAMES[PLATFORM_MENU], None)
+    if stuck:
+        lines += ["", "Stopped for over 1h at:"] + [f"• {stage}: {count}" for stage, count in
+                                                    sorted(stuck.items(), key=lambda item: -item[1])]
+    await reply(update, "\n".join(lines))
 
 # --- Back Button Handlers ---
 async def back_to_platform_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return await start_bot(update, context)
 
 async def back_to_service_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    platform = context.user_data.get('platform')
-    if not platform: return await start_bot(update, context)
+    platform = catalog.current().platforms.get(context.user_data.get('platform'))
+    if not platform or not platform.services: return await start_bot(update, context)
     
-    keyboards = {
-        "telegram": [
-            [KeyboardButton("👍 Reaction"), KeyboardButton("🤣 reaction"), KeyboardButton("❤️ reaction")],
-            [KeyboardButton("👁 Post View"), KeyboardButton("👁 5 last Posts")],
-            [KeyboardButton("👥 members")],
-            [KeyboardButton(BACK_BUTTON), KeyboardButton(MAIN_EXIT_BUTTON)]
-        ],
-        "tiktok": [
-            [KeyboardButton("👥 Followers"), KeyboardButton("❤️ Likes")],
-            [KeyboardButton("👁 Video Views"), KeyboardButton(BACK_BUTTON), KeyboardButton(MAIN_EXIT_BUTTON)]
-        ],
-        "instagram": [
-            [KeyboardButton("👥 Followers"), KeyboardButton("❤️ Likes")],
-            [KeyboardButton("👁 Views"), KeyboardButton(BACK_BUTTON), KeyboardButton(MAIN_EXIT_BUTTON)]
-        ],
-    }
-    keyboard = keyboards.get(platform)
-    await update.message.reply_text(f"✨ {platform.title()}\n\nአሁን የሚፈልጉትን አገልግሎት ይምረጡ።",
-                                     reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
+    stages.enter(update.effective_user.id, STATE_NAMES[SERVICE_MENU])
+    await show_menu(update, f"✨ {platform.title}\n\nአሁን የሚፈልጉትን አገልግሎት ይምረጡ።", platform.keyboard,
+                    platform.inline_keyboard)
     return SERVICE_MENU
 
 
 async def back_to_package_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    service_text = context.user_data.get('service_text')
-    service = context.user_data.get('service')
-    platform = context.user_data.get('platform')
-    if not all([service_text, service, platform]): return await start_bot(update, context)
+    service = catalog.current().service(context.user_data.get('platform'), context.user_data.get('service'))
+    if not service: return await start_bot(update, context)
     
-    package_prices = PRICES.get(platform, {}).get(service, {})
-    
-    unit = "Items" # Default
-    if "reaction" in service: unit = "Reactions"
-    elif "view" in service: unit = "Views"
-    elif service in ["members", "followers"]: unit = service.title()
-    elif service == "like": unit = "Likes"
-
-    keyboard = [[KeyboardButton(f"{amount} {unit} | {price} ETB")] for amount, price in package_prices.items()]
-    keyboard.append([KeyboardButton(BACK_BUTTON)])
-    await update.message.reply_text(f"💖 {service_text}\n\nየሚፈልጉትን ፓኬጅ ይምረጡ:",
-                                     reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True))
+    stages.enter(update.effective_user.id, STATE_NAMES[PACKAGE_MENU])
+    await show_menu(update, f"💖 {service.button}\n\nየሚፈልጉትን ፓኬጅ ይምረጡ:", service.keyboard, service.inline_keyboard)
     return PACKAGE_MENU
 
 
 async def back_to_awaiting_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    prompt = ""
-    example = ""
-    platform = context.user_data.get('platform')
-    service = context.user_data.get('service')
-    service_text = context.user_data.get('service_text', 'Items')
-
-    if not platform or not service:
+    service = catalog.current().service(context.user_data.get('platform'), context.user_data.get('service'))
+    if not service:
         return await start_bot(update, context)
+    return await send_input_prompt(update, service)
 
-    if platform == "telegram":
-        if service == "members":
-            prompt = "🔗 Public የሆነ የቻናል ሊንክ ይላኩ"
-            example = "ለምሳሌ:- https://t.me/skyFounders"
-        else:
-            prompt = f"🔗 {service_text} የሚጨመርበትን የTelegram Post link ያስገቡ❓"
-            example = "ለምሳሌ: https://t.me/channel_name/123"
-    elif platform == "tiktok":
-        if service == "followers":
-            prompt = "🔗 👥 Followers የሚጨመርበትን የ Tiktok Account username ያስገቡ❓"
-            example = "ለምሳሌ: @username"
-        elif service == "like":
-            prompt = "🔗 የ Tik Tok like የሚጨመርበትን የvideo link ያስገቡ❓"
-            example = "ለምሳሌ: https://vm.tiktok.com/..."
-        elif service == "video view":
-            prompt = "🔗 የTik Tok View የሚጨመርበትን የvideo link ያስገቡ❓"
-            example = "ለምሳሌ: https://vm.tiktok.com/..."
-    elif platform == "instagram":
-        if service == "followers":
-            prompt = "🔗 👥 Followers የሚጨመርበትን የ Instagram Account username ያስገቡ❓"
-            example = "ለምሳሌ: @username"
-        elif service == "like":
-            prompt = "🔗 የinstagram like የሚጨመርበትን የvideo link ያስገቡ❓"
-            example = "ለምሳሌ: https://www.instagram.com/p/..."
-        elif service == "views":
-            prompt = "🔗 የinstagram View የሚጨመርበትን የvideo link ያስገቡ❓"
-            example = "ለምሳሌ: https://www.instagram.com/p/..."
-    
-    await update.message.reply_text(f"{prompt}\n\n{example}", reply_markup=ReplyKeyboardMarkup([[KeyboardButton(BACK_BUTTON)]], resize_keyboard=True))
-    return AWAITING_INPUT
 
+class PlatformButtonFilter(filters.MessageFilter):
+    """Matches the platform buttons of the live catalog, so a reload can add platforms."""
+
+    def filter(self, message: Message) -> bool:
+        return message.text in catalog.current().platform_buttons
 
-def main() -> None:
-    if not BOT_TOKEN or not ADMIN_CHAT_ID:
-        logger.error("FATAL: BOT_TOKEN or ADMIN_CHAT_ID environment variable not set.")
-        return
-        
-    application = Application.builder().token(BOT_TOKEN).build()
+
+async def post_init(application: Application) -> None:
+    store.open()
+    pending_queue.prune()
+    await proof_index.load()
+    logger.info("Proof index loaded with %d hashes.", len(proof_index))
+    catalog.current()
+    await reviewer_pool.load()
+    await analytics.backfill()
+    await outbox.start(application.bot)
+    await reviewer_pool.resume(outbox.restored)
+    outbox.restored.clear()
+    await broadcaster.resume_all()
+    await stages.start(send_reminder)
+    if fulfillment is not None:
+        await fulfillment.start(notify_fulfillment)
+    background_tasks.append(asyncio.create_task(catalog.watch(CATALOG_RELOAD_INTERVAL), name="catalog_watch"))
+    background_tasks.append(asyncio.create_task(analytics.watch(3600), name="analytics_prune"))
+    if SHARD_INDEX is not None:
+        background_tasks.append(asyncio.create_task(proof_index.watch(5), name="proof_index_watch"))
+    background_tasks.append(asyncio.create_task(reassign_reviews(min(60, REVIEW_TIMEOUT / 2)), name="reassign_reviews"))
+    if METRICS_PORT:
+        global metrics_server
+        metrics_server = metrics.serve(int(METRICS_PORT) + WORKER_ID, METRICS_LISTEN)
+
+async def post_shutdown(application: Application) -> None:
+    for task in background_tasks:
+        task.cancel()
+    if metrics_server:
+        metrics_server.stop()
+    await broadcaster.stop()
+    await stages.stop()
+    if fulfillment is not None:
+        await fulfillment.stop()
+    await outbox.stop()
+    if receipt_lookup is not None:
+        await receipt_lookup.close()
+    store.close()
+
+
+def build_application() -> Application:
+    builder = Application.builder().token(BOT_TOKEN)
+    if BOT_API_URL:
+        builder = builder.base_url(f"{BOT_API_URL}/bot").base_file_url(f"{BOT_API_URL}/file/bot")
+    application = (
+        builder
+        .request(InstrumentedRequest())
+        # One connection is all long polling needs, as in the library's own default.
+        .get_updates_request(InstrumentedRequest(connection_pool_size=1))
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES, admit_update))
+        .persistence(persistence)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
         states={
             CHECKING_SUB: [CallbackQueryHandler(check_subscription_callback, pattern="^check_subscription$")],
-            PLATFORM_MENU: [MessageHandler(filters.Regex("^(🔵 Telegram|⚫️ TikTok|🔴 YouTube|🟣 Instagram)$"), platform_menu)],
+            PLATFORM_MENU: [
+                MessageHandler(filters.TEXT & PlatformButtonFilter(), platform_menu),
+                CallbackQueryHandler(menu_choice, pattern=MENU_CHOICE_PATTERN)
+            ],
             SERVICE_MENU: [
                 MessageHandler(filters.Regex(f"^({BACK_BUTTON}|{MAIN_EXIT_BUTTON})$"), back_to_platform_menu), 
-                MessageHandler(filters.TEXT & ~filters.COMMAND, service_menu)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, service_menu),
+                CallbackQueryHandler(back_to_platform_menu, pattern=MENU_BACK_PATTERN),
+                CallbackQueryHandler(menu_choice, pattern=MENU_CHOICE_PATTERN)
             ],
             PACKAGE_MENU: [
                 MessageHandler(filters.Regex(f"^{BACK_BUTTON}$"), back_to_service_menu), 
-                MessageHandler(filters.TEXT & ~filters.COMMAND, package_menu)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, package_menu),
+                CallbackQueryHandler(back_to_service_menu, pattern=MENU_BACK_PATTERN),
+                CallbackQueryHandler(menu_choice, pattern=MENU_CHOICE_PATTERN)
             ],
             AWAITING_INPUT: [
                 MessageHandler(filters.Regex(f"^{BACK_BUTTON}$"), back_to_package_menu), 
-                MessageHandler(filters.TEXT & ~filters.COMMAND, awaiting_input)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, awaiting_input),
+                CallbackQueryHandler(back_to_package_menu, pattern=MENU_BACK_PATTERN)
             ],
             CONFIRMATION: [
                 MessageHandler(filters.Regex(f"^{BACK_BUTTON}$"), back_to_awaiting_input), 
-                MessageHandler(filters.Regex("^✅ አረጋግጥ$"), confirmation)
+                MessageHandler(filters.Regex(f"^{CONFIRM_BUTTON}$"), confirmation),
+                CallbackQueryHandler(back_to_awaiting_input, pattern=MENU_BACK_PATTERN),
+                CallbackQueryHandler(confirmation, pattern=f"^{MENU_CONFIRM}$")
             ],
             AWAITING_PROOF: [MessageHandler(filters.PHOTO | (filters.TEXT & ~filters.COMMAND), awaiting_proof)]
         },
         fallbacks=[CommandHandler('start', start)],
-        persistent=False,
+        persistent=True,
         name="main_conversation"
     )
     
+    # Restores the user's state after a restart before the conversation looks it up.
+    application.add_handler(TypeHandler(Update, persistence.hydrate_handler(conv_handler)), group=-1)
     application.add_handler(conv_handler)
-    application.add_handler(CallbackQueryHandler(admin_handler, pattern="^(approve_|reject_)"))
+    application.add_handler(CallbackQueryHandler(stale_menu, pattern=f"^{MENU_PREFIX}:"))
+    application.add_handler(CallbackQueryHandler(admin_handler, pattern="^(approve_|reject_|o:[ar]:)"))
+    application.add_handler(CallbackQueryHandler(pending_callback, pattern=f"^{PENDING_PREFIX}:"))
+    application.add_handler(ChatMemberHandler(track_channel_member, ChatMemberHandler.CHAT_MEMBER))
+    application.add_handler(CommandHandler('cachestats', cache_stats))
+    application.add_handler(CommandHandler('queuestats', queue_stats))
+    application.add_handler(CommandHandler('broadcast', broadcast_command))
+    application.add_handler(CommandHandler('health', health))
+    application.add_handler(CommandHandler('pending', pending_command))
+    application.add_handler(CommandHandler('reviewers', reviewers_command))
+    application.add_handler(CommandHandler('stats', stats_command))
     application.add_error_handler(error_handler)
-    
-    application.run_polling()
+    instrument_handlers(application, STATE_NAMES)
+    return application
+
+
+def main() -> None:
+    if not BOT_TOKEN or not ADMIN_CHAT_ID:
+        logger.error("FATAL: BOT_TOKEN or ADMIN_CHAT_ID environment variable not set.")
+        return
+
+    webhook_url = f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}" if WEBHOOK_URL else None
+    if SHARD_WORKERS > 1 and SHARD_INDEX is None:
+        asyncio.run(run_ingress(BOT_TOKEN, SHARD_WORKERS, SHARD_BASE_PORT, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+                                webhook_url, WEBHOOK_SECRET, base_url=BOT_API_URL,
+                                max_connections=min(MAX_CONCURRENT_UPDATES, 100)))
+        return
+
+    application = build_application()
+    if SHARD_INDEX is not None:
+        asyncio.run(run_worker(application, int(os.environ.get("SHARD_PORT", SHARD_BASE_PORT + WORKER_ID))))
+    # chat_member updates are only delivered when requested explicitly.
+    elif WEBHOOK_URL:
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=min(MAX_CONCURRENT_UPDATES, 100),
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import time
+from collections import OrderedDict
+
+SUBSCRIBED_STATUSES = ('member', 'administrator', 'creator')
+
+
+class MembershipCache:
+    """Bounded LRU of force-sub channel membership with separate TTLs for
+    subscribed (positive) and not-subscribed (negative) answers."""
+
+    def __init__(self, positive_ttl: float = 3600, negative_ttl: float = 30, max_size: int = 100_000):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, tuple[bool, float]]" = OrderedDict()
+
+    def get(self, user_id: int):
+        """Return the cached answer for ``user_id`` or ``None`` on a miss."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        subscribed, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return subscribed
+
+    def set(self, user_id: int, subscribed: bool) -> None:
+        ttl = self.positive_ttl if subscribed else self.negative_ttl
+        self._entries[user_id] = (subscribed, time.monotonic() + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def set_status(self, user_id: int, status: str) -> None:
+        self.set(user_id, status in SUBSCRIBED_STATUSES)
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
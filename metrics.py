@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import functools
+import time
+from typing import Callable, Optional
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from telegram.error import TelegramError
+from telegram.ext import Application, ApplicationHandlerStop, BaseHandler, ConversationHandler
+from telegram.request import HTTPXRequest
+
+# Seconds. Bot API calls and handlers mostly land between 10ms and a few seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """A value read from ``func`` at scrape time, so nothing has to keep it up to date.
+    Counters kept elsewhere (outbox, cache) are exported the same way with kind="counter"."""
+
+    def __init__(self, name: str, help: str, func: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.kind = kind
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {self.func()}"]
+
+
+class _Series:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * (buckets + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """Fixed-bucket histogram: one count per bucket and label set, no samples are kept.
+    Quantiles are interpolated within buckets like Prometheus does."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.series: dict[tuple, _Series] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = _Series(len(self.buckets))
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def quantile(self, q: float, *labels) -> float:
+        series = self.series.get(labels)
+        if series is None or not series.count:
+            return 0.0
+        rank = q * series.count
+        seen = 0
+        for index, count in enumerate(series.counts):
+            if seen + count >= rank and count:
+                if index == len(self.buckets):
+                    # Above the last bucket, the best we can say is "more than that".
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series.counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series.sum}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+        self.started = time.time()
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, func: Callable[[], float], kind: str = "gauge") -> Gauge:
+        return self._add(Gauge(name, help, func, kind))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+HANDLER_LATENCY = REGISTRY.histogram("bot_handler_seconds", "Time spent in a handler callback.", ("handler", "state"))
+HANDLER_ERRORS = REGISTRY.counter("bot_handler_errors_total", "Handler callbacks that raised.", ("handler", "error"))
+STATE_UPDATES = REGISTRY.counter("bot_conversation_updates_total", "Updates handled per conversation state.", ("state",))
+API_LATENCY = REGISTRY.histogram("bot_api_request_seconds", "Bot API request latency.", ("endpoint",))
+API_ERRORS = REGISTRY.counter("bot_api_errors_total", "Bot API requests that failed, by TelegramError type.",
+                              ("endpoint", "error"))
+
+
+# --- Bot API calls ---
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that times every Bot API call by endpoint and counts its errors."""
+
+    async def post(self, url: str, *args, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            return await super().post(url, *args, **kwargs)
+        except TelegramError as exc:
+            API_ERRORS.inc(endpoint, type(exc).__name__)
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - started, endpoint)
+
+
+# --- Handlers ---
+def _instrument(handler: BaseHandler, state: str) -> None:
+    callback = handler.callback
+    name = getattr(callback, "__name__", type(handler).__name__)
+
+    @functools.wraps(callback)
+    async def timed(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            # Control flow, not a failure.
+            raise
+        except Exception as exc:
+            HANDLER_ERRORS.inc(name, type(exc).__name__)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name, state)
+            if state:
+                STATE_UPDATES.inc(state)
+
+    handler.callback = timed
+
+
+def instrument_handlers(application: Application, state_names: Optional[dict] = None) -> None:
+    """Wrap the callback of every handler registered on ``application``, including those
+    nested in conversations, which are labelled with the state they belong to (others get
+    an empty state). Call it after all handlers are added."""
+    state_names = state_names or {}
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                for entry in handler.entry_points:
+                    _instrument(entry, "entry")
+                for state, state_handlers in handler.states.items():
+                    for state_handler in state_handlers:
+                        _instrument(state_handler, state_names.get(state, str(state)))
+                for fallback in handler.fallbacks:
+                    _instrument(fallback, "fallback")
+            else:
+                _instrument(handler, "")
+
+
+# --- Endpoint ---
+class _MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, registry: Registry) -> None:
+        self.registry = registry
+
+    def get(self) -> None:
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(self.registry.render())
+
+
+def serve(port: int, listen: str = "0.0.0.0", registry: Registry = REGISTRY) -> HTTPServer:
+    """Serve ``registry`` in the Prometheus text format on ``/metrics``."""
+    server = HTTPServer(tornado.web.Application([(r"/metrics", _MetricsHandler, {"registry": registry})]))
+    server.listen(port, listen)
+    return server
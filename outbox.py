@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Any, Optional
+
+from telegram import Bot, ForceReply, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, TelegramObject
+from telegram.error import Forbidden, NetworkError, RetryAfter, TelegramError
+
+from storage import OrderStore
+
+logger = logging.getLogger(__name__)
+
+# Lower numbers are sent first.
+PRIORITY_USER = 0
+PRIORITY_ADMIN = 10
+PRIORITY_BULK = 20
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL DEFAULT 0,
+    chat_id INTEGER NOT NULL,
+    method TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_shard ON outbox (shard);
+"""
+
+_MARKUP_TYPES = {cls.__name__: cls for cls in (InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, ForceReply)}
+
+
+def _dump_kwargs(kwargs: dict) -> str:
+    payload = {}
+    for key, value in kwargs.items():
+        if isinstance(value, TelegramObject):
+            value = {"__type__": type(value).__name__, "data": value.to_dict()}
+        payload[key] = value
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def _load_kwargs(payload: str, bot: Bot) -> dict:
+    kwargs = json.loads(payload)
+    for key, value in kwargs.items():
+        if isinstance(value, dict) and "__type__" in value:
+            kwargs[key] = _MARKUP_TYPES[value["__type__"]].de_json(value["data"], bot)
+    return kwargs
+
+
+def _seconds(value: Any) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available, 0 if one is available now."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Item:
+    __slots__ = ("id", "chat_id", "method", "kwargs", "priority", "seq", "attempts", "not_before",
+                 "enqueued_at", "future", "persist")
+
+    def __lt__(self, other: "_Item") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Outbox:
+    """Rate limited outbound send scheduler.
+
+    Every chat has its own FIFO (ordered by priority) and token bucket, and all chats
+    share a global bucket. A chat is in at most one of the waiting heap (bucket empty or
+    deferred by RetryAfter), the ready heap (ordered by the priority of its head item) or
+    in flight, so picking the next message is O(log n) in the number of chats.
+    Queued items are persisted and reloaded on start, so a restart does not drop them.
+    """
+
+    def __init__(self, store: OrderStore, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 group_rate: float = 20 / 60, max_in_flight: int = 16, max_attempts: int = 5, shard: int = 0):
+        self.store = store
+        self.shard = shard
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_attempts = max_attempts
+        self._max_in_flight = max_in_flight
+        self._in_flight = 0
+        self._bot: Optional[Bot] = None
+        self._seq = itertools.count()
+        self._queues: dict[int, list[_Item]] = {}
+        self._buckets: dict[int, TokenBucket] = {}
+        self._waiting: list[tuple[float, int]] = []
+        self._ready: list[tuple[int, int, int]] = []
+        self._scheduled: set[int] = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._sends: set[asyncio.Task] = set()
+        self._pruned_at = time.monotonic()
+        self.depth = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latencies: deque = deque(maxlen=1000)
+        # Futures of the messages start() reloaded, by outbox id, for callers that were
+        # waiting on them before the restart.
+        self.restored: dict[int, asyncio.Future] = {}
+        store.add_schema(OUTBOX_SCHEMA)
+        store.add_column("outbox", "shard", "INTEGER NOT NULL DEFAULT 0")
+
+    # --- Lifecycle ---
+    async def start(self, bot: Bot) -> None:
+        self._bot = bot
+        # Workers share the database, each one only resumes what it queued itself.
+        rows = await self.store.fetchall("SELECT * FROM outbox WHERE shard = ? ORDER BY id", (self.shard,))
+        for row in rows:
+            item = self._new_item(row["chat_id"], row["method"], _load_kwargs(row["payload"], bot),
+                                  row["priority"], persist=True, item_id=row["id"])
+            item.attempts = row["attempts"]
+            item.not_before = time.monotonic() + max(0.0, row["not_before"] - time.time())
+            self.restored[item.id] = item.future
+            self._push(item)
+        if rows:
+            logger.info("Outbox restored %d queued messages.", len(rows))
+        self._task = asyncio.create_task(self._run(), name="outbox")
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Stop dispatching and wait for in-flight sends. Queued items stay persisted."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._sends:
+            await asyncio.wait(self._sends, timeout=timeout)
+
+    # --- Enqueueing ---
+    def enqueue(self, method: str, chat_id: int, priority: int = PRIORITY_USER, persist: bool = True,
+                item_id: Optional[int] = None, **kwargs: Any) -> asyncio.Future:
+        """Queue ``bot.<method>(chat_id=chat_id, **kwargs)``. The returned future resolves to the
+        API result, or to the exception if the message could not be delivered. A caller that
+        needs to find the message in :attr:`restored` after a restart passes its own ``item_id``
+        from ``store.ids``."""
+        chat_id = int(chat_id)
+        item = self._new_item(chat_id, method, kwargs, priority, persist, item_id)
+        if persist:
+            self.store.write_nowait(
+                "INSERT INTO outbox (id, shard, chat_id, method, payload, priority, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (item.id, self.shard, chat_id, method, _dump_kwargs(kwargs), priority, time.time()),
+            )
+        self._push(item)
+        return item.future
+
+    def _new_item(self, chat_id: int, method: str, kwargs: dict, priority: int, persist: bool,
+                  item_id: Optional[int] = None) -> _Item:
+        item = _Item()
+        item.id = item_id if item_id is not None else self.store.ids.next()
+        item.chat_id = chat_id
+        item.method = method
+        item.kwargs = kwargs
+        item.priority = priority
+        item.seq = next(self._seq)
+        item.attempts = 0
+        item.not_before = 0.0
+        item.enqueued_at = time.monotonic()
+        item.future = asyncio.get_running_loop().create_future()
+        item.persist = persist
+        return item
+
+    def _push(self, item: _Item) -> None:
+        heapq.heappush(self._queues.setdefault(item.chat_id, []), item)
+        self.depth += 1
+        self._schedule(item.chat_id)
+
+    # --- Scheduling ---
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # Negative ids are groups and channels, which Telegram limits far more strictly.
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _schedule(self, chat_id: int) -> None:
+        if chat_id in self._scheduled or not self._queues.get(chat_id):
+            return
+        self._scheduled.add(chat_id)
+        head = self._queues[chat_id][0]
+        now = time.monotonic()
+        ready_at = max(now + self._bucket(chat_id).delay(now), head.not_before)
+        if ready_at <= now:
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        else:
+            heapq.heappush(self._waiting, (ready_at, chat_id))
+        self._wakeup.set()
+
+    def _prune_buckets(self, now: float) -> None:
+        # A full bucket of an idle chat is what _bucket would create anyway.
+        for chat_id, bucket in list(self._buckets.items()):
+            if chat_id not in self._queues and not bucket.delay(now) and bucket.tokens >= bucket.capacity:
+                del self._buckets[chat_id]
+        self._pruned_at = now
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now - self._pruned_at > 60:
+                self._prune_buckets(now)
+            while self._waiting and self._waiting[0][0] <= now:
+                _, chat_id = heapq.heappop(self._waiting)
+                head = self._queues[chat_id][0]
+                heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+
+            timeout = None
+            if self._ready and self._in_flight < self._max_in_flight:
+                timeout = self.global_bucket.delay(now)
+                if not timeout:
+                    self._dispatch(heapq.heappop(self._ready)[2], now)
+                    continue
+            elif not self._ready and self._waiting:
+                timeout = self._waiting[0][0] - now
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, chat_id: int, now: float) -> None:
+        item = heapq.heappop(self._queues[chat_id])
+        self.depth -= 1
+        self.global_bucket.take(now)
+        self._bucket(chat_id).take(now)
+        self._in_flight += 1
+        task = asyncio.create_task(self._send(item))
+        self._sends.add(task)
+        task.add_done_callback(self._sends.discard)
+
+    async def _send(self, item: _Item) -> None:
+        try:
+            result = await getattr(self._bot, item.method)(chat_id=item.chat_id, **item.kwargs)
+        except RetryAfter as exc:
+            self._retry(item, _seconds(exc.retry_after))
+        except NetworkError as exc:
+            # Covers TimedOut; the message may or may not have arrived, retry with backoff.
+            if item.attempts + 1 >= self.max_attempts:
+                self._finish(item, exc=exc)
+            else:
+                self._retry(item, 2 ** item.attempts)
+        except Forbidden as exc:
+            # The user blocked the bot, which is routine during broadcasts.
+            logger.debug("Dropping %s to %s: %s", item.method, item.chat_id, exc)
+            self._finish(item, exc=exc)
+        except TelegramError as exc:
+            logger.warning("Dropping %s to %s: %s", item.method, item.chat_id, exc)
+            self._finish(item, exc=exc)
+        except Exception as exc:
+            # A bug rather than Telegram (bad kwargs, a stored payload that no longer loads).
+            # Retrying or replaying it after a restart would fail the same way.
+            logger.exception("Dropping %s to %s.", item.method, item.chat_id)
+            self._finish(item, exc=exc)
+        else:
+            self._finish(item, result=result)
+        finally:
+            self._in_flight -= 1
+            self._scheduled.discard(item.chat_id)
+            if not self._queues.get(item.chat_id):
+                self._queues.pop(item.chat_id, None)
+            self._schedule(item.chat_id)
+            self._wakeup.set()
+
+    def _retry(self, item: _Item, delay: float) -> None:
+        item.attempts += 1
+        item.not_before = time.monotonic() + delay
+        self.retries += 1
+        if item.persist:
+            self.store.write_nowait("UPDATE outbox SET attempts = ?, not_before = ? WHERE id = ?",
+                                    (item.attempts, time.time() + delay, item.id))
+        # Keeps its original seq, so it stays at the head of its chat and order is preserved.
+        heapq.heappush(self._queues.setdefault(item.chat_id, []), item)
+        self.depth += 1
+
+    def _finish(self, item: _Item, result: Any = None, exc: Optional[BaseException] = None) -> None:
+        if item.persist:
+            self.store.write_nowait("DELETE FROM outbox WHERE id = ?", (item.id,))
+        if exc is not None:
+            self.failed += 1
+            if not item.future.done():
+                item.future.set_exception(exc)
+                # Most callers fire and forget, don't let asyncio warn about unretrieved errors.
+                item.future.exception()
+            return
+        self.sent += 1
+        self.latencies.append(time.monotonic() - item.enqueued_at)
+        if not item.future.done():
+            item.future.set_result(result)
+
+    # --- Metrics ---
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        def quantile(q: float) -> float:
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0
+        return {
+            "depth": self.depth,
+            "in_flight": self._in_flight,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "latency_p50": quantile(0.5),
+            "latency_p95": quantile(0.95),
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from storage import OrderStore, STATUS_PROOF_SUBMITTED, format_order_id, to_base36
+
+PENDING_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_views (
+    id INTEGER PRIMARY KEY,
+    page INTEGER NOT NULL,
+    after_created_at REAL NOT NULL,
+    after_id INTEGER NOT NULL,
+    prev_id INTEGER,
+    order_ids TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+# Views are only needed while someone might still press their buttons.
+VIEW_TTL = 7 * 24 * 3600
+CALLBACK_PREFIX = "pg"
+
+
+@dataclass
+class PendingView:
+    id: int
+    page: int
+    after: tuple
+    prev_id: Optional[int]
+    orders: list
+    has_more: bool
+    total: int
+
+    def callback(self, action: str) -> str:
+        # "pg:<view id in base36>:<action>", about 20 bytes against Telegram's 64.
+        return f"{CALLBACK_PREFIX}:{to_base36(self.id)}:{action}"
+
+
+class PendingQueue:
+    """Pages of orders waiting for review, for the admin /pending view.
+
+    A page is a keyset range of the (status, created_at) index. Each page shown is saved as
+    a view (cursor and the order ids on it), and its buttons only carry the view id and an
+    action. That keeps callback data small, and lets any worker answer a button press.
+    Bulk actions use the orders the admin actually saw, not whatever is pending by then.
+    """
+
+    def __init__(self, store: OrderStore, page_size: int = 10):
+        self.store = store
+        self.page_size = page_size
+        store.add_schema(PENDING_SCHEMA)
+
+    async def open(self, after: tuple = (0, 0), prev_id: Optional[int] = None, page: int = 1) -> PendingView:
+        rows = await self.store.pending_page(after, self.page_size + 1)
+        view = PendingView(self.store.ids.next(), page, after, prev_id, rows[:self.page_size],
+                           len(rows) > self.page_size, await self.store.count_pending())
+        await self.store.write(
+            "INSERT INTO pending_views (id, page, after_created_at, after_id, prev_id, order_ids, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (view.id, page, after[0], after[1], prev_id, json.dumps([row["id"] for row in view.orders]), time.time()),
+        )
+        return view
+
+    async def get(self, view_id: int) -> Optional[PendingView]:
+        row = await self.store.fetchone("SELECT * FROM pending_views WHERE id = ?", (view_id,))
+        if row is None:
+            return None
+        orders = await self.store.get_orders(json.loads(row["order_ids"]))
+        return PendingView(row["id"], row["page"], (row["after_created_at"], row["after_id"]), row["prev_id"],
+                           orders, False, await self.store.count_pending())
+
+    async def refresh(self, view: PendingView) -> PendingView:
+        """Re-read the view's page, so decided orders drop out and newer ones move up."""
+        rows = await self.store.pending_page(view.after, self.page_size + 1)
+        view.orders = rows[:self.page_size]
+        view.has_more = len(rows) > self.page_size
+        view.total = await self.store.count_pending()
+        await self.store.write("UPDATE pending_views SET order_ids = ? WHERE id = ?",
+                               (json.dumps([row["id"] for row in view.orders]), view.id))
+        return view
+
+    async def next(self, view: PendingView) -> PendingView:
+        if not view.orders:
+            return await self.refresh(view)
+        last = view.orders[-1]
+        return await self.open((last["created_at"], last["id"]), prev_id=view.id, page=view.page + 1)
+
+    async def previous(self, view: PendingView) -> PendingView:
+        previous = await self.get(view.prev_id) if view.prev_id else None
+        return await self.refresh(previous or view)
+
+    def prune(self) -> None:
+        self.store.write_nowait("DELETE FROM pending_views WHERE created_at < ?", (time.time() - VIEW_TTL,))
+
+
+def _age(created_at: float) -> str:
+    seconds = int(time.time() - created_at)
+    if seconds < 3600:
+        return f"{seconds // 60}m"
+    if seconds < 86400:
+        return f"{seconds // 3600}h"
+    return f"{seconds // 86400}d"
+
+
+def render_view(view: PendingView, note: str = "", confirm: Optional[str] = None) -> tuple[str, InlineKeyboardMarkup]:
+    """Text and buttons of a view. ``confirm`` ("A" or "R") asks before a bulk action."""
+    lines = [f"🗂 Pending orders: {view.total} | page {view.page}"]
+    if note:
+        lines.append(note)
+    lines.append("")
+    rows = []
+    for index, order in enumerate(view.orders, 1):
+        decided = "" if order["status"] == STATUS_PROOF_SUBMITTED else f" ({order['status']})"
+        lines.append(f"{index}. {format_order_id(order['id'])} · {order['platform']}/{order['service']} {order['amount']}"
+                     f" · {order['price'] or 'N/A'} ETB · {order['username']} · {_age(order['created_at'])}{decided}")
+        rows.append([InlineKeyboardButton(f"👁 {index}", callback_data=view.callback(f"v{index}")),
+                     InlineKeyboardButton(f"✅ {index}", callback_data=view.callback(f"a{index}")),
+                     InlineKeyboardButton(f"🚫 {index}", callback_data=view.callback(f"r{index}"))])
+    if not view.orders:
+        lines.append("✅ ምንም የሚጠብቅ ትዕዛዝ የለም።")
+
+    if confirm and view.orders:
+        verb = "Approve" if confirm == "A" else "Reject"
+        rows = [[InlineKeyboardButton(f"⚠️ {verb} all {len(view.orders)}?", callback_data=view.callback(f"{confirm}!")),
+                 InlineKeyboardButton("✖️ Cancel", callback_data=view.callback("f"))]]
+    elif view.orders:
+        rows.append([InlineKeyboardButton("✅ Approve page", callback_data=view.callback("A")),
+                     InlineKeyboardButton("🚫 Reject page", callback_data=view.callback("R"))])
+    navigation = []
+    if view.prev_id:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=view.callback("p")))
+    navigation.append(InlineKeyboardButton("🔄", callback_data=view.callback("f")))
+    if view.has_more:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=view.callback("n")))
+    if not confirm:
+        rows.append(navigation)
+    return "\n".join(lines), InlineKeyboardMarkup(rows)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import BasePersistence, ContextTypes, ConversationHandler, PersistenceInput
+
+from storage import Store
+
+PERSISTENCE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (name, key)
+);
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def _key(key: tuple) -> str:
+    return json.dumps(list(key))
+
+
+class SQLitePersistence(BasePersistence):
+    """Write-behind, lazily loaded persistence for conversation states and user_data.
+
+    The Application only hands us changed entries every ``update_interval`` seconds and
+    once more on shutdown; those go to the store's batching writer, so persisting adds
+    nothing to the handling of a message. Nothing is read at startup: a user's data and
+    conversation state are loaded on their first update after a restart (see
+    :meth:`hydrate_handler`), so startup time is independent of the number of users.
+
+    Which users and conversations have been loaded is kept in bounded LRUs; a key that
+    falls out is simply loaded again, which never overwrites data that is already live.
+    """
+
+    def __init__(self, store: Store, update_interval: float = 30, max_loaded: int = 100_000):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+        self.max_loaded = max_loaded
+        self._loaded_users: "OrderedDict[int, None]" = OrderedDict()
+        self._loaded_conversations: "OrderedDict[tuple, None]" = OrderedDict()
+        store.add_schema(PERSISTENCE_SCHEMA)
+
+    def _mark_loaded(self, loaded: OrderedDict, key) -> None:
+        loaded[key] = None
+        loaded.move_to_end(key)
+        while len(loaded) > self.max_loaded:
+            loaded.popitem(last=False)
+
+    # --- Loading (lazy) ---
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        # Called by the Application before every callback, the first call per user loads it.
+        if user_id in self._loaded_users:
+            self._loaded_users.move_to_end(user_id)
+            return
+        self._mark_loaded(self._loaded_users, user_id)
+        row = await self.store.fetchone("SELECT data FROM user_data WHERE user_id = ?", (user_id,))
+        if row is not None and not user_data:
+            user_data.update(json.loads(row["data"]))
+
+    async def load_conversation(self, name: str, key: tuple) -> Optional[int]:
+        if (name, key) in self._loaded_conversations:
+            self._loaded_conversations.move_to_end((name, key))
+            return None
+        self._mark_loaded(self._loaded_conversations, (name, key))
+        row = await self.store.fetchone("SELECT state FROM conversations WHERE name = ? AND key = ?", (name, _key(key)))
+        return row["state"] if row else None
+
+    def hydrate_handler(self, conversation: ConversationHandler):
+        """Callback for a TypeHandler in a group before ``conversation`` that restores the user's
+        conversation state before the ConversationHandler looks it up."""
+        async def hydrate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            if not (update.effective_chat and update.effective_user):
+                return
+            key = (update.effective_chat.id, update.effective_user.id)
+            state = await self.load_conversation(conversation.name, key)
+            if state is not None and key not in conversation._conversations:
+                # ConversationHandler has no public API to seed a single key; this is what its
+                # own persistence initialisation does for every key at startup.
+                conversation._conversations.update_no_track({key: state})
+        return hydrate
+
+    # --- Writing (batched by the store's writer thread) ---
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        if new_state is None:
+            # Forget the key only once the row is gone, so a reload can't bring the state back.
+            await self.store.write("DELETE FROM conversations WHERE name = ? AND key = ?", (name, _key(key)))
+            self._loaded_conversations.pop((name, key), None)
+            return
+        self._mark_loaded(self._loaded_conversations, (name, key))
+        self.store.write_nowait(
+            "INSERT INTO conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (name, key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (name, _key(key), new_state, time.time()),
+        )
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._mark_loaded(self._loaded_users, user_id)
+        self.store.write_nowait(
+            "INSERT INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (user_id, json.dumps(data, ensure_ascii=False), time.time()),
+        )
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self.store.write("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+        self._loaded_users.pop(user_id, None)
+
+    # --- Unused data kinds ---
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        # Everything handed to us is already queued on the store, which drains on close.
+        pass
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def update_key(update: object) -> Optional[Hashable]:
+    """The key updates are serialized on: the sending user, falling back to the chat.
+    Button presses in groups (the admin chats) have no conversation state to protect, and
+    are only serialized per message, so an admin's decisions on different orders run side
+    by side."""
+    if not isinstance(update, Update):
+        return None
+    query = update.callback_query
+    if query and query.message and query.message.chat.type != "private":
+        return query.message.chat.id, query.message.message_id
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different users concurrently while keeping the updates of a
+    single user strictly in arrival order, so ConversationHandler states never race.
+
+    An update first waits for its user's lock and only then for one of the
+    ``max_concurrent_updates`` slots, so updates queued behind their user's previous one
+    hold no slot: an admin clicking through approvals or a user sending many messages
+    takes one slot, not one per queued update. Updates that ``admit`` refuses (the flood
+    guard) are dropped before they wait for either.
+    """
+
+    __slots__ = ("_admit", "_locks", "_waiters")
+
+    def __init__(self, max_concurrent_updates: int, admit: Optional[Callable[[object], bool]] = None):
+        super().__init__(max_concurrent_updates)
+        self._admit = admit
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+        self._waiters: dict[Hashable, int] = {}
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:  # type: ignore[misc]
+        # Replaces the base class's, which takes the slot first and calls do_process_update in it.
+        if self._admit is not None and not self._admit(update):
+            coroutine.close()
+            return
+        key = update_key(update)
+        if key is None:
+            async with self._semaphore:
+                await self.do_process_update(update, coroutine)
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._semaphore:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            # Drop the lock once nobody is queued on it so the dict stays bounded by
+            # the number of users with updates in flight.
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import io
+import itertools
+import logging
+import time
+from collections import defaultdict
+
+from PIL import Image
+
+from storage import Store
+
+logger = logging.getLogger(__name__)
+
+PROOF_HASH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS proof_hashes (
+    id INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL,
+    order_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    hash INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def dhash(data: bytes) -> int:
+    """64 bit difference hash: whether each pixel of a 9x8 greyscale thumbnail is brighter
+    than its right neighbour. Survives re-compression and resizing, which is what a reused
+    screenshot goes through."""
+    with Image.open(io.BytesIO(data)) as image:
+        pixels = image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def _signed(value: int) -> int:
+    # SQLite integers are signed 64 bit.
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _flips(radius: int) -> list[int]:
+    """Every CHUNK_BITS wide mask with at most ``radius`` bits set."""
+    return [sum(1 << bit for bit in bits)
+            for r in range(radius + 1) for bits in itertools.combinations(range(CHUNK_BITS), r)]
+
+
+class ProofIndex:
+    """Near-duplicate lookup over proof image hashes (multi-index hashing).
+
+    Each 64 bit hash is split into 4 chunks of 16 bits, with one table per chunk. If two
+    hashes differ in at most ``max_distance`` bits, then at least one chunk differs in
+    at most ``max_distance // 4`` bits (pigeonhole). So a search only probes each table
+    with those few chunk variants (68 probes for distances up to 7) and verifies the
+    candidates, instead of scanning every stored hash.
+
+    The index lives in memory and is backed by the proof_hashes table. Rows written by
+    other shard workers are picked up by :meth:`watch`.
+    """
+
+    def __init__(self, store: Store, max_distance: int = 6, shard: int = 0):
+        self.store = store
+        self.max_distance = max_distance
+        self.shard = shard
+        self._flips = _flips(max_distance // CHUNKS)
+        self._tables: list[dict[int, list[int]]] = [defaultdict(list) for _ in range(CHUNKS)]
+        self._orders: dict[int, list[tuple[int, int]]] = {}
+        self._last_row = 0
+        self._loaded = False
+        store.add_schema(PROOF_HASH_SCHEMA)
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def _insert(self, image_hash: int, order_id: int, user_id: int) -> None:
+        entries = self._orders.get(image_hash)
+        if entries is None:
+            entries = self._orders[image_hash] = []
+            for chunk, table in enumerate(self._tables):
+                table[(image_hash >> (chunk * CHUNK_BITS)) & CHUNK_MASK].append(image_hash)
+        entries.append((order_id, user_id))
+
+    async def load(self) -> None:
+        """Load rows added since the last call: all of them the first time, afterwards only
+        those of other workers, since this one's are indexed as they are added."""
+        sql = "SELECT id, order_id, user_id, hash FROM proof_hashes WHERE id > ?"
+        params = (self._last_row,)
+        if self._loaded:
+            sql, params = sql + " AND shard != ?", params + (self.shard,)
+        rows = await self.store.fetchall(sql + " ORDER BY id", params)
+        self._loaded = True
+        for row in rows:
+            self._insert(row["hash"] & ((1 << 64) - 1), row["order_id"], row["user_id"])
+        if rows:
+            self._last_row = rows[-1]["id"]
+
+    async def watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.load()
+
+    def add(self, image_hash: int, order_id: int, user_id: int) -> None:
+        self._insert(image_hash, order_id, user_id)
+        self.store.write_nowait(
+            "INSERT INTO proof_hashes (shard, order_id, user_id, hash, created_at) VALUES (?, ?, ?, ?, ?)",
+            (self.shard, order_id, user_id, _signed(image_hash), time.time()),
+        )
+
+    def search(self, image_hash: int) -> list[tuple[int, int, int]]:
+        """Stored proofs within ``max_distance`` as (distance, order_id, user_id), closest first."""
+        candidates = set()
+        for chunk, table in enumerate(self._tables):
+            value = (image_hash >> (chunk * CHUNK_BITS)) & CHUNK_MASK
+            for flip in self._flips:
+                bucket = table.get(value ^ flip)
+                if bucket:
+                    candidates.update(bucket)
+        matches = []
+        for candidate in candidates:
+            distance = (candidate ^ image_hash).bit_count()
+            if distance <= self.max_distance:
+                matches.extend((distance, order_id, user_id) for order_id, user_id in self._orders[candidate])
+        matches.sort()
+        return matches
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+import metrics
+from storage import OrderStore
+
+logger = logging.getLogger(__name__)
+
+REMINDERS_SENT = metrics.REGISTRY.counter("bot_reminders_sent_total", "Abandoned-order reminders sent.", ("stage",))
+
+STAGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_stages (
+    user_id INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    order_id INTEGER,
+    entered_at REAL NOT NULL,
+    remind_at REAL,
+    reminded_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_user_stages_stage ON user_stages (stage, entered_at);
+CREATE INDEX IF NOT EXISTS idx_user_stages_remind ON user_stages (shard, remind_at) WHERE remind_at IS NOT NULL;
+CREATE TABLE IF NOT EXISTS stage_counts (
+    stage TEXT PRIMARY KEY,
+    users INTEGER NOT NULL
+);
+"""
+
+
+class TimerHeap:
+    """One pending deadline per key, in a binary heap.
+
+    Rescheduling or cancelling leaves the old heap entry behind and only updates the
+    dict; stale entries are skipped when they reach the top, and the heap is rebuilt
+    once they outnumber the live ones. Every operation is O(log n), and a timer costs a
+    tuple and a dict entry rather than a task.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[float, int]] = []
+        self._due: dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._due
+
+    def set(self, key: int, due: float) -> None:
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, key))
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [(due, key) for key, due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def cancel(self, key: int) -> None:
+        self._due.pop(key, None)
+
+    def next_due(self) -> Optional[float]:
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> list[tuple[int, float]]:
+        """Remove and return the (key, due) of every timer due at ``now``."""
+        fired = []
+        while (due := self.next_due()) is not None and due <= now:
+            key = heapq.heappop(self._heap)[1]
+            del self._due[key]
+            fired.append((key, due))
+        return fired
+
+
+class StageTracker:
+    """Where each user is in the order funnel, and reminders for those who stop.
+
+    Every stage change is one UPSERT into user_stages, which keeps when the user got
+    there, and moves the user between two counters in stage_counts. The drop-off per
+    stage is its counter minus the users who got there recently, which the
+    (stage, entered_at) index counts without touching anyone who stopped earlier.
+    Entering a stage listed in ``delays`` schedules a reminder for that long after; any
+    later stage change replaces or cancels it. Due reminders are handed to ``on_due``
+    (which queues them on the rate limited outbox) by a single task sleeping until the
+    earliest deadline.
+    """
+
+    def __init__(self, store: OrderStore, delays: dict[str, float], shard: int = 0):
+        self.store = store
+        self.delays = delays
+        self.shard = shard
+        self.timers = TimerHeap()
+        self._stages: dict[int, tuple[str, Optional[int]]] = {}
+        self._on_due: Optional[Callable[[int, str, Optional[int]], Awaitable[None]]] = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        store.add_schema(STAGES_SCHEMA)
+
+    # --- Lifecycle ---
+    async def start(self, on_due: Callable[[int, str, Optional[int]], Awaitable[None]]) -> None:
+        self._on_due = on_due
+        rows = await self.store.fetchall(
+            "SELECT user_id, stage, order_id, remind_at FROM user_stages WHERE shard = ? AND remind_at IS NOT NULL",
+            (self.shard,))
+        for row in rows:
+            self._stages[row["user_id"]] = (row["stage"], row["order_id"])
+            self.timers.set(row["user_id"], row["remind_at"])
+        if rows:
+            logger.info("Restored %d pending reminders.", len(rows))
+        if await self.store.fetchone("SELECT 1 FROM stage_counts LIMIT 1") is None:
+            # Stages tracked before the counters existed; the check is repeated in the write
+            # in case another shard worker got there first.
+            await self.store.write(
+                "INSERT INTO stage_counts (stage, users) SELECT stage, COUNT(*) FROM user_stages"
+                " WHERE NOT EXISTS (SELECT 1 FROM stage_counts) GROUP BY stage")
+        self._task = asyncio.create_task(self._run(), name="reminders")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # --- Stages ---
+    def enter(self, user_id: int, stage: str, order_id: Optional[int] = None) -> None:
+        now = time.time()
+        delay = self.delays.get(stage)
+        remind_at = now + delay if delay else None
+        # Writes run in queue order, so the old stage is read before the UPSERT replaces it.
+        self.store.write_nowait(
+            "UPDATE stage_counts SET users = users - 1 WHERE stage = (SELECT stage FROM user_stages WHERE user_id = ?)",
+            (user_id,))
+        self.store.write_nowait(
+            "INSERT INTO user_stages (user_id, shard, stage, order_id, entered_at, remind_at) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (user_id) DO UPDATE SET shard = excluded.shard, stage = excluded.stage,"
+            " order_id = excluded.order_id, entered_at = excluded.entered_at, remind_at = excluded.remind_at",
+            (user_id, self.shard, stage, order_id, now, remind_at))
+        self.store.write_nowait(
+            "INSERT INTO stage_counts (stage, users) VALUES (?, 1) ON CONFLICT (stage) DO UPDATE SET users = users + 1",
+            (stage,))
+        if remind_at is None:
+            self.timers.cancel(user_id)
+            self._stages.pop(user_id, None)
+            return
+        self._stages[user_id] = (stage, order_id)
+        earliest = self.timers.next_due()
+        self.timers.set(user_id, remind_at)
+        if earliest is None or remind_at < earliest:
+            self._wakeup.set()
+
+    async def stuck(self, older_than: float) -> dict[str, int]:
+        """Users per stage who have been there for more than ``older_than`` seconds."""
+        rows = await self.store.fetchall(
+            "SELECT stage, users - (SELECT COUNT(*) FROM user_stages s WHERE s.stage = c.stage AND s.entered_at >= ?)"
+            " AS n FROM stage_counts c", (time.time() - older_than,))
+        return {row["stage"]: row["n"] for row in rows if row["n"]}
+
+    # --- Timers ---
+    async def _run(self) -> None:
+        while True:
+            for user_id, due in self.timers.pop_due(time.time()):
+                stage, order_id = self._stages.pop(user_id)
+                self.store.write_nowait(
+                    "UPDATE user_stages SET remind_at = NULL, reminded_at = ? WHERE user_id = ? AND remind_at = ?",
+                    (time.time(), user_id, due))
+                REMINDERS_SENT.inc(stage)
+                try:
+                    await self._on_due(user_id, stage, order_id)
+                except Exception:
+                    logger.exception("Reminder for user %s failed.", user_id)
+            earliest = self.timers.next_due()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), None if earliest is None else max(earliest - time.time(), 0))
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from typing import Optional
+
+import metrics
+from storage import OrderStore, STATUS_PROOF_SUBMITTED, order_worker
+
+REVIEW_LATENCY = metrics.REGISTRY.histogram(
+    "bot_review_seconds", "Time from a proof being assigned to its decision.", ("reviewer",),
+    buckets=(30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 21600, 86400))
+
+REVIEW_SCHEMA = """
+CREATE TABLE IF NOT EXISTS review_assignments (
+    order_id INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL,
+    reviewer INTEGER NOT NULL,
+    message_id INTEGER,
+    outbox_id INTEGER,
+    assigned_at REAL NOT NULL,
+    reassignments INTEGER NOT NULL DEFAULT 0,
+    decided_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_review_open ON review_assignments (reviewer) WHERE decided_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_review_decided ON review_assignments (decided_at);
+"""
+
+
+class ReviewerPool:
+    """Spreads proofs over several admin chats.
+
+    A new proof goes to the reviewer with the fewest open assignments, ties rotate, so an
+    idle pool is round-robin. Open counts are kept in memory and re-read from the table by
+    :meth:`reassign_due`, since other shard workers assign too. A proof still undecided
+    after ``timeout`` seconds moves to the least-loaded other reviewer.
+
+    The proof message goes out through the outbox. Each assignment keeps the outbox id
+    of its message until it is sent, so :meth:`resume` can pick up a message the outbox
+    reloaded after a restart.
+    """
+
+    def __init__(self, store: OrderStore, reviewers: list[int], timeout: float = 900, shard: int = 0):
+        self.store = store
+        self.reviewers = reviewers
+        self.timeout = timeout
+        self.shard = shard
+        self._open = dict.fromkeys(reviewers, 0)
+        self._turn = 0
+        store.add_schema(REVIEW_SCHEMA)
+        store.add_column("review_assignments", "outbox_id", "INTEGER")
+
+    async def load(self) -> None:
+        rows = await self.store.fetchall(
+            "SELECT reviewer, COUNT(*) AS n FROM review_assignments WHERE decided_at IS NULL GROUP BY reviewer")
+        counts = {row["reviewer"]: row["n"] for row in rows}
+        self._open = {reviewer: counts.get(reviewer, 0) for reviewer in self.reviewers}
+
+    def _pick(self, exclude: Optional[int] = None) -> int:
+        self._turn = (self._turn + 1) % len(self.reviewers)
+        rotation = self.reviewers[self._turn:] + self.reviewers[:self._turn]
+        # min() keeps the first of equals, which is where the rotation starts.
+        return min((reviewer for reviewer in rotation if reviewer != exclude), key=self._open.__getitem__,
+                   default=rotation[0])
+
+    def assign(self, order_id: int) -> int:
+        """Pick the reviewer for a new proof and record the assignment."""
+        reviewer = self._pick()
+        self._open[reviewer] += 1
+        self.store.write_nowait(
+            "INSERT OR REPLACE INTO review_assignments (order_id, shard, reviewer, assigned_at) VALUES (?, ?, ?, ?)",
+            (order_id, self.shard, reviewer, time.time()))
+        return reviewer
+
+    async def resume(self, restored: dict[int, asyncio.Future]) -> None:
+        """Rebuild tracking after a restart. Proof messages still queued in the outbox
+        (``restored``, by outbox id) are tracked again. Submitted proofs of this worker with no
+        assignment get one dated from their submission, so reassign_due sends them on."""
+        rows = await self.store.fetchall(
+            "SELECT order_id, outbox_id FROM review_assignments"
+            " WHERE shard = ? AND decided_at IS NULL AND message_id IS NULL AND outbox_id IS NOT NULL", (self.shard,))
+        for row in rows:
+            if row["outbox_id"] in restored:
+                self._remember(row["order_id"], restored[row["outbox_id"]])
+        rows = await self.store.fetchall(
+            "SELECT o.id, o.updated_at FROM orders o LEFT JOIN review_assignments a ON a.order_id = o.id"
+            " WHERE o.status = ? AND a.order_id IS NULL", (STATUS_PROOF_SUBMITTED,))
+        for row in rows:
+            if order_worker(row["id"]) != self.shard:
+                continue
+            reviewer = self._pick()
+            self._open[reviewer] += 1
+            self.store.write_nowait(
+                "INSERT OR IGNORE INTO review_assignments (order_id, shard, reviewer, assigned_at) VALUES (?, ?, ?, ?)",
+                (row["id"], self.shard, reviewer, row["updated_at"]))
+
+    def track(self, order_id: int, outbox_id: int, sent: asyncio.Future) -> None:
+        """Remember the message with the proof's buttons once the outbox has sent it, so the
+        buttons can be removed if the proof is reassigned."""
+        self.store.write_nowait("UPDATE review_assignments SET outbox_id = ? WHERE order_id = ?", (outbox_id, order_id))
+        self._remember(order_id, sent)
+
+    def _remember(self, order_id: int, sent: asyncio.Future) -> None:
+        def remember(future: asyncio.Future) -> None:
+            if not future.cancelled() and future.exception() is None:
+                self.store.write_nowait("UPDATE review_assignments SET message_id = ?, outbox_id = NULL WHERE order_id = ?",
+                                        (future.result().message_id, order_id))
+        sent.add_done_callback(remember)
+
+    async def decided(self, order_id: int) -> None:
+        row = await self.store.fetchone(
+            "SELECT reviewer, assigned_at FROM review_assignments WHERE order_id = ? AND decided_at IS NULL", (order_id,))
+        if row is None:
+            return
+        now = time.time()
+        await self.store.write("UPDATE review_assignments SET decided_at = ? WHERE order_id = ?", (now, order_id))
+        if row["reviewer"] in self._open:
+            self._open[row["reviewer"]] = max(self._open[row["reviewer"]] - 1, 0)
+        REVIEW_LATENCY.observe(now - row["assigned_at"], row["reviewer"])
+
+    async def reassign_due(self) -> list:
+        """Move this worker's proofs that waited longer than ``timeout`` to another reviewer.
+        Returns the orders moved, each with the previous ``reviewer`` and ``message_id``
+        and the new reviewer as ``new_reviewer``."""
+        await self.load()
+        if len(self.reviewers) < 2:
+            return []
+        rows = await self.store.fetchall(
+            "SELECT o.*, a.reviewer, a.message_id FROM review_assignments a JOIN orders o ON o.id = a.order_id"
+            " WHERE a.shard = ? AND a.decided_at IS NULL AND a.assigned_at < ?",
+            (self.shard, time.time() - self.timeout))
+        moved = []
+        now = time.time()
+        for row in rows:
+            if row["status"] != STATUS_PROOF_SUBMITTED:
+                # Decided without going through decide_order, nothing to review any more.
+                self.store.write_nowait("UPDATE review_assignments SET decided_at = ? WHERE order_id = ?",
+                                        (row["updated_at"], row["id"]))
+                continue
+            reviewer = self._pick(exclude=row["reviewer"])
+            self._open[reviewer] += 1
+            if row["reviewer"] in self._open:
+                self._open[row["reviewer"]] = max(self._open[row["reviewer"]] - 1, 0)
+            self.store.write_nowait(
+                "UPDATE review_assignments SET reviewer = ?, message_id = NULL, outbox_id = NULL, assigned_at = ?,"
+                " reassignments = reassignments + 1 WHERE order_id = ?", (reviewer, now, row["id"]))
+            moved.append(dict(row, new_reviewer=reviewer))
+        return moved
+
+    async def report(self, since: float) -> list[dict]:
+        """Per reviewer: open proofs, decisions since ``since`` and their latency quantiles."""
+        await self.load()
+        rows = await self.store.fetchall(
+            "SELECT reviewer, decided_at - assigned_at AS latency, reassignments FROM review_assignments"
+            " WHERE decided_at >= ?", (since,))
+        latencies: dict[int, list[float]] = {}
+        reassigned: dict[int, int] = {}
+        for row in rows:
+            latencies.setdefault(row["reviewer"], []).append(row["latency"])
+            reassigned[row["reviewer"]] = reassigned.get(row["reviewer"], 0) + (row["reassignments"] > 0)
+        report = []
+        for reviewer in sorted(set(self.reviewers) | set(latencies), key=lambda r: (r not in self._open, r)):
+            values = sorted(latencies.get(reviewer, ()))
+            quantile = lambda q: values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+            report.append({"reviewer": reviewer, "open": self._open.get(reviewer, 0), "decided": len(values),
+                           "reassigned": reassigned.get(reviewer, 0), "p50": quantile(0.5), "p95": quantile(0.95)})
+        return report
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+import os
+import re
+import signal
+import subprocess
+import sys
+from typing import Optional
+
+import httpx
+import tornado.web
+from tornado.httpserver import HTTPServer
+from telegram import Bot, Update
+from telegram.ext import Application
+
+from storage import order_worker
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+FORWARD_BATCH_SIZE = 100
+# Approve/reject buttons on a proof: o:<a|r>:<base36 order id>.
+_DECISION = re.compile(r"o:[ar]:([0-9A-Za-z]+)$")
+
+
+def update_user_id(data: dict) -> int:
+    """The user an update belongs to, read from the raw JSON without building an Update."""
+    for key, value in data.items():
+        if key != "update_id" and isinstance(value, dict):
+            sender = value.get("from") or value.get("user") or value.get("chat")
+            if sender and "id" in sender:
+                return sender["id"]
+    return data.get("update_id", 0)
+
+
+def shard_for(user_id: int, shards: int) -> int:
+    # Fibonacci hashing spreads sequential ids evenly and is stable across processes,
+    # unlike hash() which is salted per interpreter.
+    return ((user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) * shards >> 64
+
+
+def update_shard(data: dict, shards: int) -> int:
+    """The worker for an update: by user, except that a decision on an order goes to the
+    worker that created the order. All decisions come from a few admins, so routing them
+    by user would put every approval (and the fulfillment it starts) on one worker."""
+    decision = _DECISION.match((data.get("callback_query") or {}).get("data") or "")
+    if decision:
+        worker = order_worker(int(decision.group(1), 36))
+        if worker < shards:
+            return worker
+    return shard_for(update_user_id(data), shards)
+
+
+# --- Ingress ---
+class _IngressHandler(tornado.web.RequestHandler):
+    def initialize(self, ingress: "Ingress") -> None:
+        self.ingress = ingress
+
+    async def post(self) -> None:
+        if self.ingress.secret_token and self.request.headers.get(SECRET_HEADER) != self.ingress.secret_token:
+            raise tornado.web.HTTPError(403)
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        self.ingress.route(update_shard(data, len(self.ingress.worker_ports)), self.request.body)
+        self.set_status(200)
+
+
+class Ingress:
+    """Receives webhook updates and routes each one to a worker process (see update_shard).
+
+    Every worker has a FIFO and a single forwarder that ships it in batches, so all
+    updates of a user reach the same worker in the order Telegram sent them.
+    """
+
+    def __init__(self, worker_ports: list[int], secret_token: Optional[str] = None):
+        self.worker_ports = worker_ports
+        self.secret_token = secret_token
+        self._queues = [asyncio.Queue() for _ in worker_ports]
+        self._client = httpx.AsyncClient(timeout=10, limits=httpx.Limits(max_keepalive_connections=len(worker_ports)))
+        self._tasks: list[asyncio.Task] = []
+        self.forwarded = [0] * len(worker_ports)
+
+    def route(self, shard: int, body: bytes) -> None:
+        self._queues[shard].put_nowait(body)
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._forward(index), name=f"forward_{index}")
+                       for index in range(len(self.worker_ports))]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._client.aclose()
+
+    async def _forward(self, index: int) -> None:
+        queue = self._queues[index]
+        url = f"http://127.0.0.1:{self.worker_ports[index]}/updates"
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < FORWARD_BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+            payload = b"[" + b",".join(batch) + b"]"
+            delay = 0.1
+            while True:
+                try:
+                    response = await self._client.post(url, content=payload, headers={"Content-Type": "application/json"})
+                    response.raise_for_status()
+                    break
+                except httpx.HTTPError as exc:
+                    # Worker restarting: hold the batch (and everything behind it) to keep order.
+                    logger.warning("Forwarding to worker %d failed (%s), retrying in %.1fs.", index, exc, delay)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 5)
+            self.forwarded[index] += len(batch)
+
+
+def _spawn_worker(index: int, port: int, shards: int) -> subprocess.Popen:
+    env = dict(os.environ, SHARD_INDEX=str(index), SHARD_PORT=str(port), SHARD_WORKERS=str(shards))
+    return subprocess.Popen([sys.executable, os.path.abspath(sys.argv[0])], env=env)
+
+
+async def run_ingress(token: str, shards: int, base_port: int, listen: str, port: int, url_path: str,
+                      webhook_url: Optional[str], secret_token: Optional[str], base_url: Optional[str] = None,
+                      max_connections: int = 40) -> None:
+    worker_ports = [base_port + index for index in range(shards)]
+    workers = [_spawn_worker(index, worker_port, shards) for index, worker_port in enumerate(worker_ports)]
+
+    ingress = Ingress(worker_ports, secret_token)
+    ingress.start()
+    server = HTTPServer(tornado.web.Application([(rf"/{url_path}/?", _IngressHandler, {"ingress": ingress})]))
+    server.listen(port, listen)
+    logger.info("Ingress listening on %s:%d, routing to %d workers.", listen, port, shards)
+
+    if webhook_url:
+        bot = Bot(token, base_url=f"{base_url}/bot" if base_url else "https://api.telegram.org/bot")
+        async with bot:
+            await bot.set_webhook(webhook_url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES,
+                                  max_connections=max_connections)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    while not stop.is_set():
+        for index, worker in enumerate(workers):
+            if worker.poll() is not None:
+                logger.error("Worker %d exited with %s, restarting it.", index, worker.returncode)
+                workers[index] = _spawn_worker(index, worker_ports[index], shards)
+        try:
+            await asyncio.wait_for(stop.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+
+    server.stop()
+    await ingress.stop()
+    for worker in workers:
+        worker.send_signal(signal.SIGTERM)
+    for worker in workers:
+        worker.wait()
+
+
+# --- Worker ---
+class _WorkerHandler(tornado.web.RequestHandler):
+    def initialize(self, bot_application: Application) -> None:
+        self.bot_application = bot_application
+
+    async def post(self) -> None:
+        bot = self.bot_application.bot
+        for data in json.loads(self.request.body):
+            await self.bot_application.update_queue.put(Update.de_json(data, bot))
+        self.set_status(200)
+
+
+async def run_worker(application: Application, port: int) -> None:
+    """Run ``application`` fed by the ingress instead of polling or its own webhook."""
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    server = HTTPServer(tornado.web.Application([(r"/updates", _WorkerHandler, {"bot_application": application})]))
+    server.listen(port, "127.0.0.1")
+    await application.start()
+    logger.info("Worker listening on 127.0.0.1:%d.", port)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    server.stop()
+    await application.stop()
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WRITE_ERRORS = metrics.REGISTRY.counter(
+    "bot_store_write_errors_total", "Store writes that failed, by whether the caller waited for them.", ("caller",))
+# A batch whose BEGIN or COMMIT fails (e.g. another shard process held the lock past the
+# busy timeout) is rolled back and replayed this many times before its writes fail.
+BATCH_ATTEMPTS = 3
+
+# --- Order IDs ---
+# Snowflake-style: 41 bits of milliseconds since ORDER_ID_EPOCH, 6 bits of worker id and a
+# 12 bit per-millisecond sequence. IDs are unique across workers and sort by creation time.
+ORDER_ID_EPOCH = 1704067200000  # 2024-01-01T00:00:00Z
+WORKER_BITS = 6
+SEQUENCE_BITS = 12
+_BASE36 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+STATUS_CREATED = "created"
+STATUS_PROOF_SUBMITTED = "proof_submitted"
+STATUS_APPROVED = "approved"
+STATUS_REJECTED = "rejected"
+
+
+def to_base36(number: int) -> str:
+    digits = ""
+    while number:
+        number, rem = divmod(number, 36)
+        digits = _BASE36[rem] + digits
+    return digits or "0"
+
+
+def format_order_id(order_id: int) -> str:
+    return f"#ID{to_base36(order_id)}"
+
+
+def parse_order_id(text: str) -> Optional[int]:
+    text = text.strip().upper()
+    if text.startswith("#ID"):
+        text = text[3:]
+    try:
+        return int(text, 36)
+    except ValueError:
+        return None
+
+
+def order_worker(order_id: int) -> int:
+    """Worker id encoded in an order id, i.e. the shard worker that created the order."""
+    return (order_id >> SEQUENCE_BITS) & ((1 << WORKER_BITS) - 1)
+
+
+def order_id_time(order_id: int) -> float:
+    """Creation time (unix seconds) encoded in an order id."""
+    return ((order_id >> (WORKER_BITS + SEQUENCE_BITS)) + ORDER_ID_EPOCH) / 1000
+
+
+class OrderIdGenerator:
+    def __init__(self, worker_id: int = 0):
+        if not 0 <= worker_id < (1 << WORKER_BITS):
+            raise ValueError(f"worker_id must be between 0 and {(1 << WORKER_BITS) - 1}")
+        self.worker_id = worker_id
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next(self) -> int:
+        with self._lock:
+            now = max(int(time.time() * 1000) - ORDER_ID_EPOCH, self._last_ms)
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & ((1 << SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    # Sequence exhausted for this millisecond, borrow the next one.
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (now << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    platform TEXT NOT NULL,
+    service TEXT NOT NULL,
+    amount TEXT NOT NULL,
+    price INTEGER,
+    user_input TEXT,
+    status TEXT NOT NULL,
+    proof_type TEXT,
+    proof TEXT,
+    decided_by INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders (user_id);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at);
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+"""
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+class Store:
+    """Embedded SQLite store.
+
+    All writes go through a single writer thread which commits them in batches, so
+    the event loop never blocks on disk. Reads run on worker threads against their own
+    connections, which WAL mode allows next to the writer.
+    """
+
+    def __init__(self, path: str, batch_size: int = 256):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._local = threading.local()
+        self._schemas: list[str] = [SCHEMA]
+        self._columns: list[tuple[str, str, str]] = []
+
+    def add_schema(self, schema: str) -> None:
+        """Register extra DDL to run on open. Must be called before :meth:`open`."""
+        self._schemas.append(schema)
+
+    def add_column(self, table: str, column: str, definition: str) -> None:
+        """Register a column added to an existing table after databases with the table were
+        created; open adds it where it is missing, before the schemas (and their indexes) run."""
+        self._columns.append((table, column, definition))
+
+    # --- Lifecycle ---
+    def open(self) -> None:
+        conn = _connect(self.path)
+        for table, column, definition in self._columns:
+            existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if existing and column not in existing:
+                logger.info("Adding column %s.%s.", table, column)
+                try:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                except sqlite3.OperationalError as exc:
+                    # Another shard worker opening the same file got there first.
+                    if "duplicate column" not in str(exc):
+                        raise
+        for schema in self._schemas:
+            conn.executescript(schema)
+        self._writer = threading.Thread(target=self._write_loop, args=(conn,), name="store-writer", daemon=True)
+        self._writer.start()
+
+    def close(self) -> None:
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+
+    # --- Writes ---
+    def write_nowait(self, sql: str, params: Iterable[Any] = ()) -> None:
+        """Queue a write without waiting for it to be committed."""
+        self._queue.put((sql, tuple(params), None, None))
+
+    async def write(self, sql: str, params: Iterable[Any] = ()) -> int:
+        """Queue a write and wait until its batch is committed. Returns the rowcount."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((sql, tuple(params), loop, future))
+        return await future
+
+    def _write_loop(self, conn: sqlite3.Connection) -> None:
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [item for item in batch if item is not None]
+            if not batch:
+                continue
+
+            for loop, future, rowcount, exc in self._commit(conn, batch):
+                if exc is not None:
+                    WRITE_ERRORS.inc("nowait" if future is None else "awaited")
+                if future is None:
+                    continue
+                if exc is not None:
+                    loop.call_soon_threadsafe(_set_future, future, None, exc)
+                else:
+                    loop.call_soon_threadsafe(_set_future, future, rowcount, None)
+        conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, batch: list) -> list:
+        """Run ``batch`` in one transaction. Returns (loop, future, rowcount, error) per write;
+        a failing statement only fails its own write, a failing transaction fails them all."""
+        for attempt in range(BATCH_ATTEMPTS):
+            results = []
+            try:
+                # IMMEDIATE takes the write lock here, so waiting for it fails the batch (and is
+                # retried) rather than failing whichever statement happens to be first.
+                conn.execute("BEGIN IMMEDIATE")
+                for sql, params, loop, future in batch:
+                    try:
+                        results.append((loop, future, conn.execute(sql, params).rowcount, None))
+                    except sqlite3.Error as exc:
+                        logger.error("Store write failed: %s", sql, exc_info=exc)
+                        results.append((loop, future, None, exc))
+                conn.execute("COMMIT")
+                return results
+            except Exception as exc:
+                logger.error("Store batch of %d writes failed (attempt %d of %d).", len(batch), attempt + 1,
+                             BATCH_ATTEMPTS, exc_info=exc)
+                try:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                error = exc
+                time.sleep(0.1 * 2 ** attempt)
+        return [(loop, future, None, error) for _, _, loop, future in batch]
+
+    # --- Reads ---
+    def _read_conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+        return conn
+
+    def _fetchall(self, sql: str, params: tuple) -> list[sqlite3.Row]:
+        return self._read_conn().execute(sql, params).fetchall()
+
+    async def fetchall(self, sql: str, params: Iterable[Any] = ()) -> list[sqlite3.Row]:
+        return await asyncio.to_thread(self._fetchall, sql, tuple(params))
+
+    async def fetchone(self, sql: str, params: Iterable[Any] = ()) -> Optional[sqlite3.Row]:
+        rows = await self.fetchall(sql, params)
+        return rows[0] if rows else None
+
+
+def _set_future(future: asyncio.Future, result: Any, exc: Optional[BaseException]) -> None:
+    if future.done():
+        return
+    if exc is not None:
+        future.set_exception(exc)
+    else:
+        future.set_result(result)
+
+
+class OrderStore(Store):
+    """Orders move through created -> proof_submitted -> approved/rejected."""
+
+    def __init__(self, path: str, worker_id: int = 0, batch_size: int = 256):
+        super().__init__(path, batch_size)
+        self.ids = OrderIdGenerator(worker_id)
+
+    def create_order(self, user_id: int, username: Optional[str], platform: str, service: str,
+                     amount: str, price: Optional[int], user_input: Optional[str]) -> int:
+        order_id = self.ids.next()
+        now = time.time()
+        self.write_nowait(
+            "INSERT INTO orders (id, user_id, username, platform, service, amount, price, user_input,"
+            " status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (order_id, user_id, username, platform, service, amount, price, user_input,
+             STATUS_CREATED, now, now),
+        )
+        return order_id
+
+    def submit_proof(self, order_id: int, proof_type: str, proof: Optional[str]) -> None:
+        self.write_nowait(
+            "UPDATE orders SET status = ?, proof_type = ?, proof = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (STATUS_PROOF_SUBMITTED, proof_type, proof, time.time(), order_id, STATUS_CREATED),
+        )
+
+    async def decide(self, order_id: int, status: str, decided_by: Optional[int]) -> bool:
+        """Atomically move a submitted order to approved/rejected. Returns False if the
+        order was already decided (or does not exist)."""
+        rowcount = await self.write(
+            "UPDATE orders SET status = ?, decided_by = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (status, decided_by, time.time(), order_id, STATUS_PROOF_SUBMITTED),
+        )
+        return rowcount == 1
+
+    async def get_order(self, order_id: int) -> Optional[sqlite3.Row]:
+        return await self.fetchone("SELECT * FROM orders WHERE id = ?", (order_id,))
+
+    async def get_orders(self, order_ids: list[int]) -> list[sqlite3.Row]:
+        if not order_ids:
+            return []
+        rows = await self.fetchall(f"SELECT * FROM orders WHERE id IN ({', '.join('?' * len(order_ids))})", order_ids)
+        by_id = {row["id"]: row for row in rows}
+        return [by_id[order_id] for order_id in order_ids if order_id in by_id]
+
+    async def pending_page(self, after: tuple = (0, 0), limit: int = 10) -> list[sqlite3.Row]:
+        """Oldest orders awaiting review after the keyset ``after`` = (created_at, id). The
+        keyset seeks into idx_orders_status instead of skipping earlier rows like OFFSET."""
+        return await self.fetchall(
+            "SELECT * FROM orders WHERE status = ? AND (created_at, id) > (?, ?) ORDER BY created_at, id LIMIT ?",
+            (STATUS_PROOF_SUBMITTED, after[0], after[1], limit),
+        )
+
+    async def count_pending(self) -> int:
+        row = await self.fetchone("SELECT COUNT(*) AS n FROM orders WHERE status = ?", (STATUS_PROOF_SUBMITTED,))
+        return row["n"]
+
+    # --- Users ---
+    def register_user(self, user_id: int, username: Optional[str], first_name: Optional[str]) -> None:
+        """Record a user who talked to the bot. Talking to us again also undoes a block."""
+        now = time.time()
+        self.write_nowait(
+            "INSERT INTO users (user_id, username, first_name, first_seen, last_seen) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (user_id) DO UPDATE SET username = excluded.username, first_name = excluded.first_name,"
+            " blocked = 0, last_seen = excluded.last_seen",
+            (user_id, username, first_name, now, now),
+        )
+
+    def mark_blocked(self, user_id: int) -> None:
+        self.write_nowait("UPDATE users SET blocked = 1 WHERE user_id = ?", (user_id,))
+
+    async def users_page(self, after_user_id: int, limit: int) -> list[int]:
+        """Reachable users with ids above ``after_user_id``, in id order."""
+        rows = await self.fetchall(
+            "SELECT user_id FROM users WHERE user_id > ? AND blocked = 0 ORDER BY user_id LIMIT ?",
+            (after_user_id, limit),
+        )
+        return [row["user_id"] for row in rows]
+
+    async def count_users(self, after_user_id: int = 0) -> int:
+        row = await self.fetchone("SELECT COUNT(*) AS n FROM users WHERE user_id > ? AND blocked = 0", (after_user_id,))
+        return row["n"]
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+import html
+import logging
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
+from typing import Optional
+
+import httpx
+
+from storage import Store
+
+logger = logging.getLogger(__name__)
+
+# Telebirr prints local time (East Africa Time, no daylight saving).
+EAT = timezone(timedelta(hours=3))
+# Payments made a little before the order was confirmed, or with a skewed phone clock, still count.
+CLOCK_SLACK = 15 * 60
+
+_TXID = re.compile(r"(?:transaction\s+(?:number|no\.?|id)\s*(?:is|:)?|የግብይት\s+ቁጥር\w*|receipt/)\s*([A-Z0-9]{8,12})\b",
+                   re.IGNORECASE)
+# Only the amount of the transfer sentence: the same SMS quotes the fee and the balance in ETB too.
+_AMOUNT = re.compile(r"(?:transferred|paid|sent)\s+(?:ETB|Birr|ብር)\s*([\d,]+(?:\.\d{1,2})?)"
+                     r"|(?:ETB|Birr|ብር)\s*([\d,]+(?:\.\d{1,2})?)[^።\n]*?(?:ከፍለዋል|አስተላልፈዋል)", re.IGNORECASE)
+_RECIPIENT = re.compile(r"(?:\bto|ወደ)\s+([^()\n]+?)\s*\(([\d*]{6,})\)", re.IGNORECASE)
+_TIMESTAMP = re.compile(r"(\d{1,2})[/-](\d{1,2})[/-](\d{4})\s+(\d{1,2}):(\d{2})(?::(\d{2}))?"
+                        r"|(\d{4})-(\d{2})-(\d{2})[ T](\d{1,2}):(\d{2})(?::(\d{2}))?")
+
+
+@dataclass(frozen=True)
+class Receipt:
+    txid: str
+    amount: Optional[Decimal]
+    recipient_name: Optional[str]
+    recipient_account: Optional[str]
+    timestamp: Optional[float]
+
+
+def _timestamp(match: re.Match) -> Optional[float]:
+    if match.group(1):
+        day, month, year, hour, minute, second = match.group(1, 2, 3, 4, 5, 6)
+    else:
+        year, month, day, hour, minute, second = match.group(7, 8, 9, 10, 11, 12)
+    try:
+        moment = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second or 0), tzinfo=EAT)
+    except ValueError:
+        return None
+    return moment.timestamp()
+
+
+def parse_receipt(text: str) -> Optional[Receipt]:
+    """Pick the transaction id, amount, recipient and time out of a pasted Telebirr SMS.
+    Returns None when there is no transaction id, i.e. the text is not a receipt at all."""
+    txid = _TXID.search(text)
+    if not txid:
+        return None
+    amount = _AMOUNT.search(text)
+    recipient = _RECIPIENT.search(text)
+    timestamp = _TIMESTAMP.search(text)
+    try:
+        value = Decimal((amount.group(1) or amount.group(2)).replace(",", "")) if amount else None
+    except InvalidOperation:
+        value = None
+    return Receipt(
+        txid=txid.group(1).upper(),
+        amount=value,
+        recipient_name=recipient.group(1).strip() if recipient else None,
+        recipient_account=recipient.group(2) if recipient else None,
+        timestamp=_timestamp(timestamp) if timestamp else None,
+    )
+
+
+def _international(phone: str) -> str:
+    digits = re.sub(r"\D", "", phone)
+    return "251" + digits[1:] if digits.startswith("0") else digits
+
+
+def _account_matches(masked: str, phone: str) -> bool:
+    """Telebirr masks the middle of the number (2519****3897); compare the digits it shows."""
+    phone = _international(phone)
+    if masked.startswith("0"):
+        masked = "251" + masked[1:]
+    if len(masked) != len(phone):
+        return masked[-4:] == phone[-4:]
+    return all(shown in ("*", digit) for shown, digit in zip(masked, phone))
+
+
+def check_receipt(receipt: Receipt, price: Optional[int], receiver_name: str, receiver_phone: str,
+                  ordered_at: float) -> list[str]:
+    """Everything that stops ``receipt`` from proving payment of ``price``; empty if it does."""
+    problems = []
+    if price is None or receipt.amount is None:
+        problems.append("amount unknown")
+    elif receipt.amount != Decimal(price):
+        problems.append(f"amount {receipt.amount} ≠ {price}")
+    if not receipt.recipient_account or not _account_matches(receipt.recipient_account, receiver_phone):
+        problems.append(f"recipient {receipt.recipient_account or '?'}")
+    elif receiver_name.lower() not in (receipt.recipient_name or "").lower():
+        problems.append(f"recipient name {receipt.recipient_name}")
+    if receipt.timestamp is None:
+        problems.append("no date")
+    elif not ordered_at - CLOCK_SLACK <= receipt.timestamp <= time.time() + CLOCK_SLACK:
+        problems.append("date " + datetime.fromtimestamp(receipt.timestamp, EAT).strftime("%d/%m/%Y %H:%M"))
+    return problems
+
+
+# Labels of the rows on Telebirr's receipt page, lower case.
+_PAGE_FIELDS = {"name": "credited party name", "account": "credited party account no", "status": "transaction status",
+                "txid": "invoice no", "date": "payment date", "amount": "settled amount"}
+
+
+def parse_receipt_page(page: str, txid: str) -> Optional[Receipt]:
+    """The receipt on Telebirr's receipt page for ``txid``. None unless the page is for that
+    transaction and it completed."""
+    cells = [html.unescape(cell).strip() for cell in re.split(r"<[^>]+>", page)]
+    cells = [cell for cell in cells if cell]
+    values = {}
+    for label, value in zip(cells, cells[1:]):
+        label = label.lower().rstrip(":").strip()
+        for field, name in _PAGE_FIELDS.items():
+            if label.startswith(name):
+                values.setdefault(field, value)
+    if values.get("txid", "").upper() != txid.upper() or values.get("status", "").lower() != "completed":
+        return None
+    amount = re.search(r"[\d,]+(?:\.\d{1,2})?", values.get("amount", ""))
+    timestamp = _TIMESTAMP.search(values.get("date", ""))
+    return Receipt(
+        txid=txid.upper(),
+        amount=Decimal(amount.group(0).replace(",", "")) if amount else None,
+        recipient_name=values.get("name"),
+        recipient_account=values.get("account"),
+        timestamp=_timestamp(timestamp) if timestamp else None,
+    )
+
+
+class ReceiptLookup:
+    """Reads a transaction's receipt from Telebirr's receipt page.
+
+    A pasted SMS is text the buyer typed, and everything :func:`check_receipt` compares it
+    with is shown to every buyer, so only a receipt fetched from Telebirr proves payment.
+    """
+
+    def __init__(self, url: str, timeout: float = 10):
+        self.url = url
+        self._client = httpx.AsyncClient(timeout=timeout, follow_redirects=True)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    async def fetch(self, txid: str) -> Optional[Receipt]:
+        """The completed receipt of ``txid``, None if Telebirr has none or could not be asked."""
+        try:
+            response = await self._client.get(self.url.format(txid=txid))
+        except httpx.HTTPError as exc:
+            logger.warning("Telebirr receipt lookup of %s failed: %s", txid, exc)
+            return None
+        if response.status_code != 200:
+            return None
+        return parse_receipt_page(response.text, txid)
+
+
+USED_TRANSACTIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS used_transactions (
+    txid TEXT PRIMARY KEY,
+    order_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    created_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class UsedTransactions:
+    """Transaction ids that have already been submitted as proof.
+
+    The primary key is the index: a claim is one INSERT OR IGNORE, which is atomic across
+    shard workers, and a lookup stays a few B-tree pages deep at millions of rows without
+    having to load anything into memory at startup.
+    """
+
+    def __init__(self, store: Store):
+        self.store = store
+        store.add_schema(USED_TRANSACTIONS_SCHEMA)
+
+    async def claim(self, txid: str, order_id: int, user_id: int) -> int:
+        """Record ``txid`` as used by ``order_id``. Returns the order that owns it, which is
+        ``order_id`` unless an earlier order already used the same transaction."""
+        inserted = await self.store.write(
+            "INSERT OR IGNORE INTO used_transactions (txid, order_id, user_id, created_at) VALUES (?, ?, ?, ?)",
+            (txid, order_id, user_id, time.time()),
+        )
+        if inserted:
+            return order_id
+        row = await self.store.fetchone("SELECT order_id FROM used_transactions WHERE txid = ?", (txid,))
+        return row["order_id"]
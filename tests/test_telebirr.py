@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from telebirr import EAT, check_receipt, parse_receipt, parse_receipt_page
+
+SMS = ("Dear Abebe \nYou have transferred ETB 1,500.00 to Kebede Alemu (2519****3897) on 12/05/2024 14:23:11. "
+       "Your transaction number is CEF1ABC2DE. The service fee is  ETB 0.87 and  15% VAT on the service fee is ETB 0.13. "
+       "Your current E-Money Account  balance is ETB 2,345.67. To download your payment information please click this "
+       "link: https://transactioninfo.ethiotelecom.et/receipt/CEF1ABC2DE.\n\nThank you for using telebirr\nEthio telecom")
+SMS_BALANCE_FIRST = ("Dear Abebe, your telebirr account balance is ETB 2,345.67. You have transferred ETB 1,500.00 to "
+                     "Kebede Alemu (2519****3897) on 12/05/2024 14:23:11. Your transaction number is CEF1ABC2DE.")
+SMS_AMHARIC = ("ውድ ደንበኛ፣ ቀሪ ሂሳብዎ ብር 2,345.67 ነው። ብር 1,500.00 ወደ ከበደ አለሙ (2519****3897) በ12/05/2024 14:23:11 "
+               "ከፍለዋል። የግብይት ቁጥርዎ CEF1ABC2DE ነው።")
+PAID_AT = datetime(2024, 5, 12, 14, 23, 11, tzinfo=EAT).timestamp()
+
+
+def test_parse_english_sms():
+    receipt = parse_receipt(SMS)
+    assert receipt.txid == "CEF1ABC2DE"
+    assert receipt.amount == Decimal("1500.00")
+    assert receipt.recipient_name == "Kebede Alemu"
+    assert receipt.recipient_account == "2519****3897"
+    assert receipt.timestamp == PAID_AT
+
+
+def test_amount_is_the_transfer_not_the_balance():
+    assert parse_receipt(SMS_BALANCE_FIRST).amount == Decimal("1500.00")
+    assert parse_receipt(SMS_AMHARIC).amount == Decimal("1500.00")
+
+
+def test_parse_amharic_sms():
+    receipt = parse_receipt(SMS_AMHARIC)
+    assert receipt.txid == "CEF1ABC2DE"
+    assert receipt.recipient_name == "ከበደ አለሙ"
+    assert receipt.timestamp == PAID_AT
+
+
+def test_amount_without_transfer_phrase_is_unknown():
+    receipt = parse_receipt("Your balance is ETB 1,500.00. Your transaction number is CEF1ABC2DE.")
+    assert receipt.amount is None
+    assert "amount unknown" in check_receipt(receipt, 1500, "Kebede", "0911223897", PAID_AT)
+
+
+def test_not_a_receipt():
+    assert parse_receipt("I paid 1500 birr, please check") is None
+
+
+def test_check_receipt(monkeypatch):
+    monkeypatch.setattr(time, "time", lambda: PAID_AT + 60)
+    receipt = parse_receipt(SMS)
+    assert check_receipt(receipt, 1500, "Kebede", "0911223897", PAID_AT - 60) == []
+    assert check_receipt(receipt, 1200, "Kebede", "0911223897", PAID_AT - 60) == ["amount 1500.00 ≠ 1200"]
+    assert check_receipt(receipt, 1500, "Kebede", "0911224444", PAID_AT - 60) == ["recipient 2519****3897"]
+    assert check_receipt(receipt, 1500, "Kebede", "0911223897", PAID_AT + 3600) == ["date 12/05/2024 14:23"]
+
+
+def test_parse_receipt_page():
+    page = ("<table><tr><td>Credited Party name</td><td>Kebede Alemu</td></tr>"
+            "<tr><td>Credited party account no</td><td>2519****3897</td></tr>"
+            "<tr><td>transaction status</td><td>Completed</td></tr>"
+            "<tr><td>Invoice No.</td><td>CEF1ABC2DE</td></tr>"
+            "<tr><td>Payment date</td><td>12-05-2024 14:23:11</td></tr>"
+            "<tr><td>Settled Amount</td><td>1,500.00 Birr</td></tr></table>")
+    receipt = parse_receipt_page(page, "cef1abc2de")
+    assert receipt.amount == Decimal("1500.00")
+    assert receipt.recipient_name == "Kebede Alemu"
+    assert receipt.timestamp == PAID_AT
+    assert parse_receipt_page(page.replace("Completed", "Failed"), "CEF1ABC2DE") is None
+    assert parse_receipt_page(page, "OTHER12345") is None